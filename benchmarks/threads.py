@@ -0,0 +1,70 @@
+'''
+Throughput of the batched C kernels as a function of thread count.
+
+Usage: python benchmarks/threads.py [N]
+'''
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from astropy import units as u
+from astropy.coordinates import Angle, Distance
+
+from spacerocks.cbindings import kepM_to_xyz, calc_kep_from_xyz, correct_for_ltt
+
+
+class Batch(SimpleNamespace):
+    # stands in for the SpaceRock and Observer objects correct_for_ltt expects
+    def __len__(self):
+        return len(self.x) if hasattr(self, 'x') else len(self.e)
+
+
+def best_of(func, repeats=3):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main(N):
+
+    rng = np.random.default_rng(0)
+    a = rng.uniform(30, 100, N)
+    e = rng.uniform(0, 0.5, N)
+    inc = rng.uniform(0, np.pi, N)
+    arg = rng.uniform(0, 2 * np.pi, N)
+    node = rng.uniform(0, 2 * np.pi, N)
+    M = rng.uniform(0, 2 * np.pi, N)
+
+    rocks = Batch(a=Distance(a, u.au), e=e, inc=Angle(inc, u.rad), arg=Angle(arg, u.rad),
+                  node=Angle(node, u.rad), M=Angle(M, u.rad))
+    observers = Batch(x=Distance(np.ones(N), u.au), y=Distance(np.zeros(N), u.au, allow_negative=True),
+                      z=Distance(np.zeros(N), u.au, allow_negative=True),
+                      vx=np.zeros(N) * u.au/u.day, vy=np.full(N, 0.0172) * u.au/u.day, vz=np.zeros(N) * u.au/u.day)
+
+    out = np.empty((6, N))
+    x, y, z, vx, vy, vz = [q.value.copy() for q in kepM_to_xyz(a, e, inc, arg, node, M)]
+
+    kernels = {'kepM_to_xyz': lambda t: kepM_to_xyz(a, e, inc, arg, node, M, out=out, threads=t),
+               'calc_kep_from_xyz': lambda t: calc_kep_from_xyz(0.00029630927493457475, x, y, z, vx, vy, vz, out=out, threads=t),
+               'correct_for_ltt': lambda t: correct_for_ltt(rocks, observers, out=out, threads=t)}
+
+    counts = [1]
+    while counts[-1] * 2 <= os.cpu_count():
+        counts.append(counts[-1] * 2)
+
+    print('N = {}'.format(N))
+    print('{:<20} {:>8} {:>16} {:>10}'.format('kernel', 'threads', 'Mobjects/s', 'speedup'))
+    for name, kernel in kernels.items():
+        serial = best_of(lambda: kernel(1))
+        for t in counts:
+            elapsed = best_of(lambda: kernel(t))
+            print('{:<20} {:>8} {:>16.2f} {:>10.2f}'.format(name, t, N / elapsed / 1e6, serial / elapsed))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
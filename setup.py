@@ -3,28 +3,39 @@ from setuptools import setup, Extension
 import sys
 import sysconfig
 import glob
+import numpy
 from setuptools_scm import get_version
 
 suffix = sysconfig.get_config_var('EXT_SUFFIX')
 if suffix is None:
     suffix = ".so"
 
-extra_link_args = []
+extra_link_args = ['-pthread']
 if sys.platform == 'darwin':
     from distutils import sysconfig
     vars = sysconfig.get_config_vars()
     vars['LDSHARED'] = vars['LDSHARED'].replace('-bundle', '-shared')
-    extra_link_args = ['-Wl,-install_name,@rpath/libspacerocks' + suffix]
+    extra_link_args += ['-Wl,-install_name,@rpath/libspacerocks' + suffix]
 
 libspacerocksmodule = Extension('libspacerocks',
                                 sources=['src/speedy.c'],
                                 include_dirs=['src'],
                                 language='c',
                                 extra_compile_args=[
-                                    '-O3', '-fPIC', '-std=c99'],#, '-march=native'],
+                                    '-O3', '-fPIC', '-std=c99', '-pthread'],#, '-march=native'],
                                 extra_link_args=extra_link_args
                                 )
 
+# The same kernels, exposed as NumPy ufuncs.
+ufuncsmodule = Extension('spacerocks._ufuncs',
+                         sources=['src/ufuncs.c', 'src/speedy.c'],
+                         include_dirs=['src', numpy.get_include()],
+                         language='c',
+                         extra_compile_args=[
+                             '-O3', '-fPIC', '-std=c99', '-pthread'],
+                         extra_link_args=['-pthread']
+                         )
+
 data_files = []
 dirs = ['spacerocks/data/spice/*', 'spacerocks/data/spice/asteroids/*', 'spacerocks/data/*']
 for dir in dirs:
@@ -40,7 +51,7 @@ setup(
     author_email='kjnapier@umich.edu',
     url="https://github.com/kjnapier/spacerocks",
     packages=['spacerocks'],
-    package_data={'spacerocks.data': ['*.csv'], 
+    package_data={'spacerocks.data': ['*.csv', '*.npy'], 
                   'spacerocks.data.spice': ['*'], 
                   'spacerocks.data.spice.asteroids': ['*.bsp']},
     data_files=data_files,
@@ -53,6 +64,6 @@ setup(
                       'pandas',
                       'rebound', 
                       'astroquery'],
-    ext_modules=[libspacerocksmodule],
+    ext_modules=[libspacerocksmodule, ufuncsmodule],
     zip_safe=False
 )
\ No newline at end of file
@@ -6,6 +6,160 @@ from astropy import units as u
 from astropy.coordinates import Angle, Distance
 
 from . import clibspacerocks
+from .timescales import tdb_jd
+
+_threads = 1
+
+
+def set_threads(threads):
+    '''
+    Set the default number of threads used by the batched C kernels
+    (kepM_to_xyz, kepE_to_xyz, calc_kep_from_xyz, calc_E_from_M and
+    correct_for_ltt). The N dimension is split into contiguous chunks,
+    so results are identical to the serial path. Small batches are
+    always run on a single thread.
+    '''
+    global _threads
+    if int(threads) < 1:
+        raise ValueError('threads must be a positive integer.')
+    _threads = int(threads)
+
+
+def get_threads():
+    '''
+    Return the default number of threads used by the batched C kernels.
+    '''
+    return _threads
+
+
+# Accuracy tiers for the Kepler solver. The solver stops once the estimated
+# error in the eccentric anomaly (in radians) is below the tolerance. The
+# final Newton correction typically leaves the actual error orders of
+# magnitude smaller: 'precise' reaches machine precision, while 'screening'
+# is good to ~1e-8 rad and saves an iteration on most objects.
+TOLERANCES = {'precise': 1e-12,
+              'screening': 1e-6}
+
+
+def _resolve_tol(tol):
+    if isinstance(tol, str):
+        try:
+            return TOLERANCES[tol]
+        except KeyError:
+            raise ValueError('Unknown tolerance tier {}. Use one of {}, or a float.'.format(tol, list(TOLERANCES)))
+    if tol <= 0:
+        raise ValueError('tol must be positive.')
+    return float(tol)
+
+
+# Single precision.
+#
+# kepM_to_xyz, calc_E_from_M and correct_for_ltt take dtype=np.float32 to run
+# float versions of the kernels, meant for screening very large synthetic
+# populations. Angles are reduced to [-pi, pi] in double precision, then all
+# inputs are rounded to float32, and the outputs are float32. Measured against
+# the float64 path for 2e5 random orbits with a < 100 au and e < 0.95, seen
+# from 1 au, the error budget is
+#
+#   eccentric anomaly                 < 3e-7 rad
+#   position and velocity             < 1.1e-6 relative (typically 3e-7)
+#   direction of observed position    < 0.25 arcsec (typically 0.07) for delta > 0.1 au
+#
+# The error in the observed direction scales as the position error divided by
+# delta, so close approaches (delta < 0.1 au) reach arcseconds and should use
+# the float64 path. Tolerances tighter than 1e-6 are clamped to it.
+
+def _resolve_dtype(dtype):
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float64, np.float32):
+        raise ValueError('dtype must be float64 or float32.')
+    return dtype
+
+
+def _reduce(x):
+    # Reduce to [-pi, pi] in double precision. Rounding to float32 afterwards
+    # keeps small angles, like mean anomalies near pericenter, accurate.
+    return np.remainder(np.asarray(x, dtype=np.float64) + np.pi, 2 * np.pi) - np.pi
+
+
+def _as_float_anomaly(e, M):
+    # Only elliptic mean anomalies can be range reduced.
+    return np.ascontiguousarray(np.where(np.asarray(e) < 1, _reduce(M), M), dtype=np.float32)
+
+
+def _resolve_threads(threads):
+    if threads is None:
+        return _threads
+    if int(threads) < 1:
+        raise ValueError('threads must be a positive integer.')
+    return int(threads)
+
+
+def _broadcast(*arrays, dtype=np.float64):
+    '''
+    Prepare the per-object inputs of a kernel. Each input may be a scalar
+    or an array of length 1 or N. Returns N, the inputs as contiguous 1-d
+    arrays, and their strides: 0 for a value shared by every object and 1
+    for an array of N values. Shared values are never expanded.
+    '''
+    arrays = [np.ascontiguousarray(x, dtype=dtype).ravel() for x in arrays]
+    sizes = {x.size for x in arrays} - {1}
+    if len(sizes) > 1:
+        raise ValueError('Inputs must be scalars or arrays of the same length, not lengths {}.'.format(sorted(sizes)))
+    N = sizes.pop() if sizes else 1
+    strides = np.array([0 if x.size == 1 else 1 for x in arrays], dtype=np.intc)
+    return N, arrays, strides
+
+
+def _check_grid(N, T):
+    '''
+    Grids are indexed with ssize_t in the kernels, six quantities per point.
+    '''
+    if 6 * N * T > np.iinfo(np.intp).max:
+        raise ValueError('A grid of {} x {} states is too large to index.'.format(N, T))
+
+
+def _output_buffer(out, shape, dtype=np.float64):
+    '''
+    Return a buffer for the C kernels to write into.
+
+    If out is None a fresh array is allocated. Otherwise out is validated
+    and returned as-is, so that repeated calls over the same catalog can
+    reuse a single buffer. The kernels write one row per output quantity,
+    so the arrays returned by the wrappers below are contiguous views
+    into this buffer.
+    '''
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+
+    if not isinstance(out, np.ndarray):
+        raise TypeError('out must be a numpy array.')
+    if out.dtype != dtype:
+        raise ValueError('out must have dtype {}.'.format(np.dtype(dtype).name))
+    if not out.flags['C_CONTIGUOUS']:
+        raise ValueError('out must be C-contiguous.')
+    if out.shape != shape:
+        raise ValueError('out has shape {}, but shape {} is required.'.format(out.shape, shape))
+    return out
+
+
+def _as_state(arr):
+    '''
+    Wrap the rows of a kernel output buffer in astropy quantities 
+    without copying. Every wrapper below takes a raw flag which skips 
+    this step and returns the buffer itself, in au, au/day and rad.
+    '''
+    x, y, z, vx, vy, vz = arr
+
+    x = Distance(x, u.au, allow_negative=True, copy=False)
+    y = Distance(y, u.au, allow_negative=True, copy=False)
+    z = Distance(z, u.au, allow_negative=True, copy=False)
+    vx = u.Quantity(vx, u.au/u.day, copy=False)
+    vy = u.Quantity(vy, u.au/u.day, copy=False)
+    vz = u.Quantity(vz, u.au/u.day, copy=False)
+
+    return x, y, z, vx, vy, vz
+
 
 clibspacerocks.py_kepM_to_xyz.argtypes = [ctypes.c_int,
                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
@@ -13,23 +167,43 @@ clibspacerocks.py_kepM_to_xyz.argtypes = [ctypes.c_int,
                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
-                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS')]
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_int, flags='C_CONTIGUOUS'),
+                                              ctypes.c_double,
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ctypes.c_int]
 
-clibspacerocks.py_kepM_to_xyz.restype = ctypes.POINTER(ctypes.c_double)
+clibspacerocks.py_kepM_to_xyz.restype = None
 
-def kepM_to_xyz(a, e, inc, arg, node, M):
+clibspacerocks.py_kepM_to_xyz_f.argtypes = [ctypes.c_int,
+                                            ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                            ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                            ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                            ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                            ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                            ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                            ndpointer(ctypes.c_int, flags='C_CONTIGUOUS'),
+                                            ctypes.c_double,
+                                            ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                            ctypes.c_int]
 
-    N = len(a)
-    rock = clibspacerocks.py_kepM_to_xyz(N, a, e, inc, arg, node, M)
-    arr = np.ctypeslib.as_array(rock, (6 * N,))
+clibspacerocks.py_kepM_to_xyz_f.restype = None
+
+def kepM_to_xyz(a, e, inc, arg, node, M, out=None, threads=None, tol='precise', raw=False, dtype=np.float64):
+
+    if _resolve_dtype(dtype) == np.float32:
+        N, inputs, strides = _broadcast(a, e, _reduce(inc), _reduce(arg), _reduce(node), _as_float_anomaly(e, M), dtype=np.float32)
+        out = _output_buffer(out, (6, N), np.float32)
+        clibspacerocks.py_kepM_to_xyz_f(N, *inputs, strides, _resolve_tol(tol), out, _resolve_threads(threads))
+    else:
+        N, inputs, strides = _broadcast(a, e, inc, arg, node, M)
+        out = _output_buffer(out, (6, N))
+        clibspacerocks.py_kepM_to_xyz(N, *inputs, strides, _resolve_tol(tol), out, _resolve_threads(threads))
 
-    x, y, z, vx, vy, vz = arr.reshape(N, 6).T
+    if raw:
+        return out
 
-    x = Distance(x, u.au, allow_negative=True)
-    y = Distance(y, u.au, allow_negative=True)
-    z = Distance(z, u.au, allow_negative=True)
-    
-    return x, y, z, vx * u.au/u.d, vy * u.au/u.d, vz * u.au/u.d
+    return _as_state(out)
 
 clibspacerocks.py_kepE_to_xyz.argtypes = [ctypes.c_int,
                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
@@ -37,23 +211,23 @@ clibspacerocks.py_kepE_to_xyz.argtypes = [ctypes.c_int,
                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
-                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS')]
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_int, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ctypes.c_int]
 
-clibspacerocks.py_kepE_to_xyz.restype = ctypes.POINTER(ctypes.c_double)
+clibspacerocks.py_kepE_to_xyz.restype = None
 
-def kepE_to_xyz(a, e, inc, arg, node, E):
+def kepE_to_xyz(a, e, inc, arg, node, E, out=None, threads=None, raw=False):
 
-    N = len(a)
-    rock = clibspacerocks.py_kepE_to_xyz(N, a, e, inc, arg, node, E)
-    arr = np.ctypeslib.as_array(rock, (6 * N,))
+    N, inputs, strides = _broadcast(a, e, inc, arg, node, E)
+    out = _output_buffer(out, (6, N))
+    clibspacerocks.py_kepE_to_xyz(N, *inputs, strides, out, _resolve_threads(threads))
 
-    x, y, z, vx, vy, vz = arr.reshape(N, 6).T
+    if raw:
+        return out
 
-    x = Distance(x, u.au, allow_negative=True)
-    y = Distance(y, u.au, allow_negative=True)
-    z = Distance(z, u.au, allow_negative=True)
-    
-    return x, y, z, vx * u.au/u.d, vy * u.au/u.d, vz * u.au/u.d
+    return _as_state(out)
 
 
 clibspacerocks.py_calc_kep_from_xyz.argtypes = [ctypes.c_int,
@@ -63,23 +237,27 @@ clibspacerocks.py_calc_kep_from_xyz.argtypes = [ctypes.c_int,
                                                 ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                                 ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                                 ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
-                                                ndpointer(ctypes.c_double, flags='C_CONTIGUOUS')]
+                                                ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                ctypes.c_int]
 
-clibspacerocks.py_calc_kep_from_xyz.restype = ctypes.POINTER(ctypes.c_double)
+clibspacerocks.py_calc_kep_from_xyz.restype = None
 
-def calc_kep_from_xyz(mu, x, y, z, vx, vy, vz):
+def calc_kep_from_xyz(mu, x, y, z, vx, vy, vz, out=None, threads=None, raw=False):
 
     N = len(x)
-    rock = clibspacerocks.py_calc_kep_from_xyz(N, mu, x, y, z, vx, vy, vz)
-    arr = np.ctypeslib.as_array(rock, (6 * N,))
+    out = _output_buffer(out, (6, N))
+    clibspacerocks.py_calc_kep_from_xyz(N, mu, x, y, z, vx, vy, vz, out, _resolve_threads(threads))
+
+    if raw:
+        return out
 
-    a, e, inc, arg, node, f = arr.reshape(N, 6).T
-    a = Distance(a, u.au, allow_negative=True)
-    e = np.ascontiguousarray(e)
-    inc = Angle(inc, u.rad)
-    arg = Angle(arg, u.rad)
-    node = Angle(node, u.rad)
-    f = Angle(f, u.rad)
+    a, e, inc, arg, node, f = out
+    a = Distance(a, u.au, allow_negative=True, copy=False)
+    inc = Angle(inc, u.rad, copy=False)
+    arg = Angle(arg, u.rad, copy=False)
+    node = Angle(node, u.rad, copy=False)
+    f = Angle(f, u.rad, copy=False)
 
     return a, e, inc, arg, node, f
 
@@ -89,121 +267,386 @@ clibspacerocks.py_calc_vovec_from_kep.argtypes = [ctypes.c_int,
                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                  ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS')]
 
-clibspacerocks.py_calc_vovec_from_kep.restype = ctypes.POINTER(ctypes.c_double)
+clibspacerocks.py_calc_vovec_from_kep.restype = None
 
 
-def calc_vovec_from_kep(mu, a, e, r, E):
+def calc_vovec_from_kep(mu, a, e, r, E, out=None, raw=False):
 
     N = len(a)
-    rock = clibspacerocks.py_calc_vovec_from_kep(N, mu, a, e.astype(np.float64), r, E)
-    arr = np.ctypeslib.as_array(rock, (3 * N,))
+    out = _output_buffer(out, (3, N))
+    clibspacerocks.py_calc_vovec_from_kep(N, mu, a, e.astype(np.float64), r, E, out)
+
+    if raw:
+        return out
 
-    vx, vy, vz = arr.reshape(N, 3).T
-    return vx * u.au/u.d, vy * u.au/u.d, vz * u.au/u.d
+    vx, vy, vz = out
+    vx = u.Quantity(vx, u.au/u.day, copy=False)
+    vy = u.Quantity(vy, u.au/u.day, copy=False)
+    vz = u.Quantity(vz, u.au/u.day, copy=False)
+    return vx, vy, vz
 
 
 clibspacerocks.py_calc_E_from_M.argtypes = [ctypes.c_int,
                                             ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
-                                            ndpointer(ctypes.c_double, flags='C_CONTIGUOUS')]
+                                            ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                            ndpointer(ctypes.c_int, flags='C_CONTIGUOUS'),
+                                            ctypes.c_double,
+                                            ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                            ctypes.c_int]
 
-clibspacerocks.py_calc_E_from_M.restype = ctypes.POINTER(ctypes.c_double)
+clibspacerocks.py_calc_E_from_M.restype = None
 
-def calc_E_from_M(e, M):
+clibspacerocks.py_calc_E_from_M_f.argtypes = [ctypes.c_int,
+                                              ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_int, flags='C_CONTIGUOUS'),
+                                              ctypes.c_double,
+                                              ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                              ctypes.c_int]
 
-    N = len(e)
-    rock = clibspacerocks.py_calc_E_from_M(N, e.astype(np.float64), M.astype(np.float64))
-    E = np.ctypeslib.as_array(rock, (N,))
+clibspacerocks.py_calc_E_from_M_f.restype = None
 
-    return Angle(E, u.rad)
+def calc_E_from_M(e, M, out=None, threads=None, tol='precise', raw=False, dtype=np.float64):
+
+    if _resolve_dtype(dtype) == np.float32:
+        N, inputs, strides = _broadcast(e, _as_float_anomaly(e, M), dtype=np.float32)
+        out = _output_buffer(out, (N,), np.float32)
+        clibspacerocks.py_calc_E_from_M_f(N, *inputs, strides, _resolve_tol(tol), out, _resolve_threads(threads))
+    else:
+        N, inputs, strides = _broadcast(e, M)
+        out = _output_buffer(out, (N,))
+        clibspacerocks.py_calc_E_from_M(N, *inputs, strides, _resolve_tol(tol), out, _resolve_threads(threads))
+
+    if raw:
+        return out
+
+    return Angle(out, u.rad, copy=False)
 
 
 clibspacerocks.py_calc_M_from_E.argtypes = [ctypes.c_int,
+                                            ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                             ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                             ndpointer(ctypes.c_double, flags='C_CONTIGUOUS')]
 
-clibspacerocks.py_calc_M_from_E.restype = ctypes.POINTER(ctypes.c_double)
+clibspacerocks.py_calc_M_from_E.restype = None
 
-def calc_M_from_E(e, E):
+def calc_M_from_E(e, E, out=None, raw=False):
 
     N = len(e)
-    rock = clibspacerocks.py_calc_M_from_E(N, e, E)
-    M = np.ctypeslib.as_array(rock, (N,))
+    out = _output_buffer(out, (N,))
+    clibspacerocks.py_calc_M_from_E(N, e, E, out)
+
+    if raw:
+        return out
 
-    return Angle(M, u.rad)
+    return Angle(out, u.rad, copy=False)
 
 
 clibspacerocks.py_calc_E_from_f.argtypes = [ctypes.c_int,
+                                                       ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                                        ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                                        ndpointer(ctypes.c_double, flags='C_CONTIGUOUS')]
 
-clibspacerocks.py_calc_E_from_f.restype = ctypes.POINTER(ctypes.c_double)
+clibspacerocks.py_calc_E_from_f.restype = None
 
-def calc_E_from_f(e, f):
+def calc_E_from_f(e, f, out=None, raw=False):
 
     N = len(e)
-    rock = clibspacerocks.py_calc_E_from_f(N, e.astype(np.float64), f)
-    E = np.ctypeslib.as_array(rock, (N,))
+    out = _output_buffer(out, (N,))
+    clibspacerocks.py_calc_E_from_f(N, e.astype(np.float64), f, out)
+
+    if raw:
+        return out
 
-    return Angle(E, u.rad)
+    return Angle(out, u.rad, copy=False)
 
 
 clibspacerocks.py_calc_f_from_E.argtypes = [ctypes.c_int,
+                                            ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                             ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
                                             ndpointer(ctypes.c_double, flags='C_CONTIGUOUS')]
 
-clibspacerocks.py_calc_f_from_E.restype = ctypes.POINTER(ctypes.c_double)
+clibspacerocks.py_calc_f_from_E.restype = None
 
-def calc_f_from_E(e, E):
+def calc_f_from_E(e, E, out=None, raw=False):
 
     N = len(e)
-    rock = clibspacerocks.py_calc_f_from_E(N, e.astype(np.float64), E)
-    f = np.ctypeslib.as_array(rock, (N,))
+    out = _output_buffer(out, (N,))
+    clibspacerocks.py_calc_f_from_E(N, e.astype(np.float64), E, out)
 
-    return Angle(f, u.rad)
+    if raw:
+        return out
+
+    return Angle(out, u.rad, copy=False)
 
 
 clibspacerocks.py_correct_for_ltt.argtypes = [ctypes.c_int,
                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
-                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'), 
-                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'), 
-                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'), 
-                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'), 
-                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'), 
-                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'), 
-                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'), 
-                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'), 
                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
-                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'), 
-                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS')]
-
-clibspacerocks.py_correct_for_ltt.restype = ctypes.POINTER(ctypes.c_double)
-
-def correct_for_ltt(rocks, observers):
-
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ndpointer(ctypes.c_int, flags='C_CONTIGUOUS'),
+                                              ctypes.c_double,
+                                              ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                              ctypes.c_int]
+
+clibspacerocks.py_correct_for_ltt.restype = None
+
+clibspacerocks.py_correct_for_ltt_f.argtypes = [ctypes.c_int,
+                                                ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                                ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                                ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                                ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                                ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                                ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                                ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                                ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                                ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                                ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                                ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                                ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                                ndpointer(ctypes.c_int, flags='C_CONTIGUOUS'),
+                                                ctypes.c_double,
+                                                ndpointer(ctypes.c_float, flags='C_CONTIGUOUS'),
+                                                ctypes.c_int]
+
+clibspacerocks.py_correct_for_ltt_f.restype = None
+
+def correct_for_ltt(rocks, observers, out=None, threads=None, tol='precise', raw=False, dtype=np.float64):
+
+    ox = observers.x.au
+    oy = observers.y.au
+    oz = observers.z.au
+    ovx = observers.vx.to(u.au/u.day).value
+    ovy = observers.vy.to(u.au/u.day).value
+    ovz = observers.vz.to(u.au/u.day).value
+
+    if _resolve_dtype(dtype) == np.float32:
+        N, inputs, strides = _broadcast(rocks.a.au, rocks.e, _reduce(rocks.inc.rad), _reduce(rocks.arg.rad), _reduce(rocks.node.rad), 
+                                        _as_float_anomaly(rocks.e, rocks.M.rad), ox, oy, oz, ovx, ovy, ovz, dtype=np.float32)
+        out = _output_buffer(out, (6, N), np.float32)
+        clibspacerocks.py_correct_for_ltt_f(N, *inputs, strides, _resolve_tol(tol), out, _resolve_threads(threads))
+        return out if raw else _as_state(out)
+
+    N, inputs, strides = _broadcast(rocks.a.au, rocks.e, rocks.inc.rad, rocks.arg.rad, rocks.node.rad, rocks.M.rad, 
+                                    ox, oy, oz, ovx, ovy, ovz)
+    out = _output_buffer(out, (6, N))
+    clibspacerocks.py_correct_for_ltt(N, *inputs, strides, _resolve_tol(tol), out, _resolve_threads(threads))
+
+    if raw:
+        return out
+
+    return _as_state(out)
+
+
+clibspacerocks.py_propagate_kepler.argtypes = [ctypes.c_ssize_t,
+                                               ctypes.c_ssize_t,
+                                               ctypes.c_double,
+                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                               ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                               ctypes.c_int]
+
+clibspacerocks.py_propagate_kepler.restype = None
+
+def propagate_kepler(mu, x, y, z, vx, vy, vz, epoch0, epochs, out=None, threads=None, raw=False):
+    '''
+    Propagate N states (au, au/day) given at epoch0 (days) to each of the
+    T epochs on two-body orbits with gravitational parameter mu. Each
+    returned quantity has shape (T, N).
+    '''
+    N = len(x)
+    T = len(epochs)
+    _check_grid(N, T)
+    out = _output_buffer(out, (6, T, N))
+    clibspacerocks.py_propagate_kepler(N, T, mu, x, y, z, vx, vy, vz, epoch0, epochs, out, _resolve_threads(threads))
+
+    if raw:
+        return out
+
+    return _as_state(out)
+
+
+clibspacerocks.py_correct_for_ltt_grid.argtypes = [ctypes.c_ssize_t,
+                                                   ctypes.c_ssize_t,
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ctypes.c_double,
+                                                   ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                                   ctypes.c_int]
+
+clibspacerocks.py_correct_for_ltt_grid.restype = None
+
+def correct_for_ltt_grid(rocks, observers, epochs, out=None, threads=None, tol='precise', raw=False):
+    '''
+    Light-time corrected observer-centric states of N rocks (barycentric,
+    ecliptic) as seen by T observers at the T epochs (tdb jd). The rocks are
+    advanced on their Keplerian orbits, so no copies of the elements are
+    made for each epoch. Each returned quantity has shape (T, N).
+    '''
     N = len(rocks)
-    a = rocks.a.au.astype(np.double)
-    e = rocks.e.astype(np.double)
-    inc = rocks.inc.rad.astype(np.double)
-    arg = rocks.arg.rad.astype(np.double)
-    node = rocks.node.rad.astype(np.double)
-    M = rocks.M.rad.astype(np.double)
-
-    ox = observers.x.au.astype(np.double)
-    oy = observers.y.au.astype(np.double)
-    oz = observers.z.au.astype(np.double)
-    ovx = observers.vx.to(u.au/u.day).value.astype(np.double)
-    ovy = observers.vy.to(u.au/u.day).value.astype(np.double)
-    ovz = observers.vz.to(u.au/u.day).value.astype(np.double)
-
-    rock = clibspacerocks.py_correct_for_ltt(N, a, e, inc, arg, node, M, ox, oy, oz, ovx, ovy, ovz)
-    arr = np.ctypeslib.as_array(rock, (6 * N,))
-
-    x, y, z, vx, vy, vz = arr.reshape(N, 6).T
-
-    x = Distance(x, u.au, allow_negative=True)
-    y = Distance(y, u.au, allow_negative=True)
-    z = Distance(z, u.au, allow_negative=True)
-
-    return x, y, z, vx * u.au/u.day, vy * u.au/u.day, vz * u.au/u.day
+    T = len(epochs)
+    _check_grid(N, T)
+    a = np.ascontiguousarray(rocks.a.au, dtype=np.double)
+    e = np.ascontiguousarray(rocks.e, dtype=np.double)
+    inc = np.ascontiguousarray(rocks.inc.rad, dtype=np.double)
+    arg = np.ascontiguousarray(rocks.arg.rad, dtype=np.double)
+    node = np.ascontiguousarray(rocks.node.rad, dtype=np.double)
+    M = np.ascontiguousarray(rocks.M.rad, dtype=np.double)
+    epoch0 = np.ascontiguousarray(tdb_jd(rocks.epoch), dtype=np.double)
+    epochs = np.ascontiguousarray(epochs, dtype=np.double)
+
+    ox = np.ascontiguousarray(observers.x.au, dtype=np.double)
+    oy = np.ascontiguousarray(observers.y.au, dtype=np.double)
+    oz = np.ascontiguousarray(observers.z.au, dtype=np.double)
+    ovx = np.ascontiguousarray(observers.vx.to(u.au/u.day).value, dtype=np.double)
+    ovy = np.ascontiguousarray(observers.vy.to(u.au/u.day).value, dtype=np.double)
+    ovz = np.ascontiguousarray(observers.vz.to(u.au/u.day).value, dtype=np.double)
+
+    out = _output_buffer(out, (6, T, N))
+    clibspacerocks.py_correct_for_ltt_grid(N, T, a, e, inc, arg, node, M, epoch0, epochs, ox, oy, oz, ovx, ovy, ovz, _resolve_tol(tol), out, _resolve_threads(threads))
+
+    if raw:
+        return out
+
+    return _as_state(out)
+
+
+# One record per object from the fused observe kernel. Angles are in
+# radians, rates in radians per day (ra_rate includes the cos(dec) factor,
+# as in Ephemerides), delta in au and mag in magnitudes.
+OBSERVATION_DTYPE = np.dtype([('ra', np.float64), 
+                              ('dec', np.float64), 
+                              ('ra_rate', np.float64), 
+                              ('dec_rate', np.float64), 
+                              ('delta', np.float64), 
+                              ('phase_angle', np.float64), 
+                              ('mag', np.float64)])
+
+clibspacerocks.py_observe.argtypes = [ctypes.c_int,
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ndpointer(ctypes.c_int, flags='C_CONTIGUOUS'),
+                                      ctypes.c_double,
+                                      ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                      ctypes.c_int]
+
+clibspacerocks.py_observe.restype = None
+
+def observe(a, e, inc, arg, node, M, observer, sun, H, G, out=None, threads=None, tol='precise'):
+    '''
+    Fused ephemeris computation. Takes barycentric ecliptic elements (au, 
+    rad), the (6, N) barycentric ecliptic observer states and (3, N) Sun 
+    positions (au, au/day) and the H and G values, and returns a structured 
+    array with OBSERVATION_DTYPE. Objects with NaN H get NaN magnitudes.
+    '''
+    N, inputs, strides = _broadcast(a, e, inc, arg, node, M, *observer, *sun[:3], H, G)
+    if out is None:
+        out = np.empty(N, dtype=OBSERVATION_DTYPE)
+    elif not isinstance(out, np.ndarray):
+        raise TypeError('out must be a numpy array.')
+    elif out.dtype != OBSERVATION_DTYPE or out.shape != (N,) or not out.flags['C_CONTIGUOUS']:
+        raise ValueError('out must be a contiguous array of {} records with OBSERVATION_DTYPE.'.format(N))
+
+    clibspacerocks.py_observe(N, *inputs, strides, _resolve_tol(tol), out.view(np.float64), _resolve_threads(threads))
+
+    return out
+
+
+clibspacerocks.py_kep_jacobian.argtypes = [ctypes.c_int,
+                                           ctypes.c_double,
+                                           ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                           ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                           ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                           ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                           ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                           ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                           ctypes.c_double,
+                                           ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                           ctypes.c_int]
+
+clibspacerocks.py_kep_jacobian.restype = None
+
+def kep_jacobian(mu, a, e, inc, arg, node, M, out=None, threads=None, tol='precise'):
+    '''
+    Jacobian of the state (x, y, z, vx, vy, vz) with respect to the elements 
+    (a, e, inc, arg, node, M), in au, au/day and rad, for orbits with 
+    gravitational parameter mu. Returns an (N, 6, 6) array, with one row 
+    per state component and one column per element.
+    '''
+    N = len(a)
+    out = _output_buffer(out, (N, 6, 6))
+    clibspacerocks.py_kep_jacobian(N, mu, a, e, inc, arg, node, M, _resolve_tol(tol), out, _resolve_threads(threads))
+
+    return out
+
+
+clibspacerocks.py_stm_kepler.argtypes = [ctypes.c_int,
+                                         ctypes.c_double,
+                                         ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                         ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                         ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                         ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                         ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                         ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                         ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                         ndpointer(ctypes.c_double, flags='C_CONTIGUOUS'),
+                                         ctypes.c_int]
+
+clibspacerocks.py_stm_kepler.restype = None
+
+def stm_kepler(mu, x, y, z, vx, vy, vz, dt, out=None, threads=None):
+    '''
+    Two-body state transition matrices d(state at t + dt) / d(state at t) 
+    for N states (au, au/day) and time steps dt (days). Returns an 
+    (N, 6, 6) array.
+    '''
+    N = len(x)
+    out = _output_buffer(out, (N, 6, 6))
+    clibspacerocks.py_stm_kepler(N, mu, x, y, z, vx, vy, vz, np.ascontiguousarray(np.broadcast_to(dt, (N,)), dtype=np.float64), out, _resolve_threads(threads))
+
+    return out
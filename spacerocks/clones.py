@@ -0,0 +1,150 @@
+import numpy as np
+
+from .constants import mu_bary, frames
+from .observer import get_observer
+from .spice import SpiceBody
+from . import fast
+from .timescales import utc_jd
+
+sun = SpiceBody(spiceid='Sun')
+
+# Per-object summary of the clouds of clones on the sky. Angles are in
+# radians. sigma_major and sigma_minor are the 1-sigma semi-axes of the
+# ellipse in the tangent plane, and position_angle is the direction of the
+# major axis, measured from north through east.
+ELLIPSE_DTYPE = np.dtype([('ra', np.float64),
+                          ('dec', np.float64),
+                          ('sigma_major', np.float64),
+                          ('sigma_minor', np.float64),
+                          ('position_angle', np.float64),
+                          ('sigma_delta', np.float64)])
+
+
+class Clones:
+
+    '''
+    Monte-Carlo clones of N rocks, held as plain (6, n, N) arrays of
+    Keplerian elements (a, e, inc, arg, node, M) in au and radians.
+    Clone k of rock j is elements[:, k, j]. The clones share the epoch,
+    origin and frame of the rocks they were drawn from.
+
+    Create them with SpaceRock.sample_clones.
+    '''
+
+    def __init__(self, elements, epoch, name, origin, frame, mu, H=None, G=None):
+        self.elements = elements
+        self.epoch = epoch
+        self.name = name
+        self.origin = origin
+        self.frame = frame
+        self.mu = mu
+        self.H = H
+        self.G = G
+
+    def __len__(self):
+        return self.elements.shape[2]
+
+    @property
+    def n(self):
+        return self.elements.shape[1]
+
+    def states(self):
+        '''
+        Barycentric ecliptic states of all clones as a (6, n, N) array in
+        au and au/day.
+        '''
+        n, N = self.n, len(self)
+        state = fast.kepM_to_xyz(*self.elements.reshape(6, n * N))
+
+        # kepM_to_xyz assumes mu_bary. Positions do not depend on mu, and
+        # velocities scale as sqrt(mu).
+        state[3:] *= np.sqrt(self.mu / mu_bary.value)
+
+        if self.frame.upper() != 'ECLIPJ2000':
+            rotation_matrix = np.asarray(frames['ECLIPJ2000']) @ np.linalg.inv(frames[self.frame.upper()])
+            state[:3] = rotation_matrix @ state[:3]
+            state[3:] = rotation_matrix @ state[3:]
+
+        state = state.reshape(6, n, N)
+
+        if self.origin != 'ssb':
+            state += SpiceBody(spiceid=self.origin).states(self.epoch).T[:, None, :]
+
+        return state
+
+    def observe(self, **kwargs):
+        '''
+        Ephemerides of every clone from an observer (obscode, spiceid or observer),
+        computed in one batch with the fused observe kernel. Returns an
+        (n, N) structured array with cbindings.OBSERVATION_DTYPE.
+        '''
+        observer = get_observer(utc_jd(self.epoch), **kwargs)
+
+        n, N = self.n, len(self)
+        state = self.states().reshape(6, n * N)
+
+        # The kernel takes barycentric elements, with the mean anomaly.
+        a, e, inc, arg, node, f = fast.calc_kep_from_xyz(mu_bary.value, *state)
+        M = fast.calc_M_from_E(e, fast.calc_E_from_f(e, f))
+
+        s = sun.states(self.epoch)
+        observers = np.tile([observer.x.au, observer.y.au, observer.z.au,
+                             observer.vx.value, observer.vy.value, observer.vz.value], n)
+        suns = np.tile(s[:, :3].T, n)
+
+        H = np.full(N, np.nan) if self.H is None else self.H
+        G = np.full(N, 0.15) if self.G is None else self.G
+
+        observations = fast.observe(a, e, inc, arg, node, M, observers, suns, np.tile(H, n), np.tile(G, n))
+        return observations.reshape(n, N)
+
+    def ellipses(self, **kwargs):
+        '''
+        Sky-plane uncertainty ellipses of the rocks, from the ephemerides of
+        their clones as seen by an observer (obscode, spiceid or observer). Returns an
+        (N,) structured array with ELLIPSE_DTYPE.
+        '''
+        return ellipses(self.observe(**kwargs))
+
+
+def ellipses(observations):
+    '''
+    Summarize an (n, N) array of clone observations as N sky-plane
+    ellipses. The clones are projected onto the plane tangent to the sky
+    at their mean direction.
+    '''
+    ra = observations['ra']
+    dec = observations['dec']
+
+    ux = np.cos(dec) * np.cos(ra)
+    uy = np.cos(dec) * np.sin(ra)
+    uz = np.sin(dec)
+    mx, my, mz = ux.mean(axis=0), uy.mean(axis=0), uz.mean(axis=0)
+
+    ra0 = np.arctan2(my, mx) % (2 * np.pi)
+    dec0 = np.arctan2(mz, np.hypot(mx, my))
+
+    # Gnomonic projection; xi points east and eta points north.
+    cosc = np.sin(dec0) * np.sin(dec) + np.cos(dec0) * np.cos(dec) * np.cos(ra - ra0)
+    xi = np.cos(dec) * np.sin(ra - ra0) / cosc
+    eta = (np.cos(dec0) * np.sin(dec) - np.sin(dec0) * np.cos(dec) * np.cos(ra - ra0)) / cosc
+
+    xi = xi - xi.mean(axis=0)
+    eta = eta - eta.mean(axis=0)
+    sxx = (xi * xi).mean(axis=0)
+    syy = (eta * eta).mean(axis=0)
+    sxy = (xi * eta).mean(axis=0)
+
+    # Eigenvalues of the 2x2 covariance.
+    half_trace = (sxx + syy) / 2
+    root = np.sqrt(((sxx - syy) / 2)**2 + sxy**2)
+
+    out = np.empty(len(ra0), dtype=ELLIPSE_DTYPE)
+    out['ra'] = ra0
+    out['dec'] = dec0
+    out['sigma_major'] = np.sqrt(half_trace + root)
+    out['sigma_minor'] = np.sqrt(np.maximum(half_trace - root, 0))
+    out['position_angle'] = (0.5 * np.arctan2(2 * sxy, syy - sxx)) % np.pi
+    out['sigma_delta'] = observations['delta'].std(axis=0)
+
+    return out
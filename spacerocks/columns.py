@@ -0,0 +1,123 @@
+'''
+Columnar storage for large catalogs of SpaceRocks.
+
+A SpaceRock keeps every quantity as its own astropy object, which is
+convenient but costs several arrays (and a Time and an object array of
+names) per quantity. A Columns object instead holds a catalog as
+
+    state   (N, 6) float64 block of x, y, z (au), vx, vy, vz (au/day)
+    epoch   (N,) float64 TDB Julian dates
+    id      (N,) int64 identifiers
+
+in a given origin and frame, 64 bytes per rock, so a catalog of 50 million
+rocks takes 3.2 GB. The arrays are used as given when they already have
+the right dtype and layout, e.g. straight from np.load(..., mmap_mode='r'),
+and are handed out as they are, so other tools can use them without copies.
+
+    columns = Columns(state, epoch, id)
+    rocks = SpaceRock.from_columns(columns[:1000000])
+    rocks.x                 # a view of columns.state[:1000000, 0]
+    rocks.to_columns()      # columns[:1000000] again, as long as the
+                            # state has not been changed
+
+The Cartesian properties of such a SpaceRock are views of the block, and its
+name is the id column. Its epoch is a Time, which does hold its own copy of
+the epochs.
+'''
+
+import numpy as np
+from astropy import units as u
+from astropy.coordinates import Distance
+
+STATE_FIELDS = ['x', 'y', 'z', 'vx', 'vy', 'vz']
+
+
+class Columns:
+
+    '''
+    States (au, au/day), TDB Julian dates and integer ids of N rocks, as an
+    (N, 6) block and two columns. Slicing gives views and other indexing
+    gives copies, as for numpy arrays.
+    '''
+
+    def __init__(self, state, epoch, id=None, origin='ssb', frame='eclipJ2000'):
+        self.state = np.require(state, dtype=np.float64, requirements='C')
+        if self.state.ndim != 2 or self.state.shape[1] != 6:
+            raise ValueError('state must have shape (N, 6).')
+
+        n = len(self.state)
+        self.epoch = np.asarray(epoch, dtype=np.float64)
+        if self.epoch.ndim == 0:
+            self.epoch = np.full(n, self.epoch)
+        self.id = np.arange(n, dtype=np.int64) if id is None else np.asarray(id)
+        if self.id.dtype.kind not in 'iu':
+            raise ValueError('id must be an integer array.')
+        if len(self.epoch) != n or len(self.id) != n:
+            raise ValueError('state, epoch and id must have the same length.')
+
+        self.origin = origin
+        self.frame = frame
+
+    def __len__(self):
+        return len(self.state)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            idx = slice(idx, idx + 1 or None)
+        return Columns(self.state[idx], self.epoch[idx], self.id[idx], origin=self.origin, frame=self.frame)
+
+    @property
+    def nbytes(self):
+        return self.state.nbytes + self.epoch.nbytes + self.id.nbytes
+
+    @property
+    def position(self):
+        return self.state[:, :3]
+
+    @property
+    def velocity(self):
+        return self.state[:, 3:]
+
+    def quantities(self):
+        '''
+        x, y, z and vx, vy, vz as astropy quantities sharing memory with
+        the state block.
+        '''
+        x, y, z = [Distance(self.state[:, k], u.au, allow_negative=True, copy=False) for k in range(3)]
+        vx, vy, vz = [u.Quantity(self.state[:, k], u.au / u.day, copy=False) for k in range(3, 6)]
+        return x, y, z, vx, vy, vz
+
+    def shares_state(self, rock):
+        '''
+        Whether the Cartesian state of a SpaceRock is still this block,
+        i.e. its properties are the views made by SpaceRock.from_columns.
+        '''
+        for k, field in enumerate(STATE_FIELDS):
+            value = rock.__dict__.get('_' + field)
+            if value is None or value.unit != (u.au if k < 3 else u.au / u.day):
+                return False
+            view, column = value.value, self.state[:, k]
+            if np.ndim(view) == 0:
+                return False
+            if view.ctypes.data != column.ctypes.data or view.strides != column.strides or len(view) != len(column):
+                return False
+        return rock.origin == self.origin and rock.frame == self.frame
+
+    @classmethod
+    def from_spacerock(cls, rock, id=None):
+        '''
+        Pack the states of a SpaceRock into a new block. The id defaults to
+        the names, if they are integers, and otherwise to 0, ..., N-1. A
+        single rock, e.g. rocks[0], gives a block of one row.
+        '''
+        from .timescales import tdb_jd
+
+        name = np.atleast_1d(rock.name)
+        if id is None and name.dtype.kind in 'iu':
+            id = name
+        state = np.empty((len(name), 6))
+        for k, field in enumerate(STATE_FIELDS):
+            unit = u.au if k < 3 else u.au / u.day
+            state[:, k] = getattr(rock, field).to_value(unit)
+        return cls(state, np.atleast_1d(tdb_jd(rock.epoch)), None if id is None else np.atleast_1d(id), 
+                   origin=rock.origin, frame=rock.frame)
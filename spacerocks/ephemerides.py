@@ -9,17 +9,9 @@ from healpy.pixelfunc import ang2pix
 from numpy import sin, cos, arctan2, sqrt, arcsin, tan, exp, log10, where, array, arccos, pi
 
 from .constants import c, epsilon
-import spiceypy as spice
-import pkg_resources
-import os
 
 from .spice import SpiceBody
 
-SPICE_PATH = pkg_resources.resource_filename('spacerocks', 'data/spice')
-spice.furnsh(os.path.join(SPICE_PATH, 'latest_leapseconds.tls'))
-spice.furnsh(os.path.join(SPICE_PATH, 'de440s.bsp'))
-spice.furnsh(os.path.join(SPICE_PATH, 'hst.bsp'))
-spice.furnsh(os.path.join(SPICE_PATH, 'nh.bsp'))
 
 sun = SpiceBody(spiceid='Sun')
 earth = SpiceBody(spiceid='Earth')
@@ -166,18 +158,21 @@ class Ephemerides(Convenience):
         Estimate the apparent magnitude of a TNO
         https://iopscience.iop.org/article/10.3847/1538-3881/ab18a9/pdf for light curves
         '''
-        e = earth.at(self.epoch)
-        s = sun.at(self.epoch)
+        es = earth.states(self.epoch) - sun.states(self.epoch)
 
-        x_helio = self.x + e.x - s.x
-        y_helio = self.y + e.y - s.y
-        z_helio = self.z + e.z - s.z
+        # The ephemerides are equatorial, so rotate the Earth there too.
+        ey = es[:, 1] * cos(epsilon) - es[:, 2] * sin(epsilon)
+        ez = es[:, 1] * sin(epsilon) + es[:, 2] * cos(epsilon)
+
+        x_helio = self.x + es[:, 0] * u.au
+        y_helio = self.y + ey * u.au
+        z_helio = self.z + ez * u.au
 
         r_helio = Distance(sqrt(x_helio*x_helio + y_helio*y_helio + z_helio*z_helio).value, u.au)
         
-        earth_dist = ((e.x - s.x)**2 + (e.y - s.y)**2 + (e.z - s.z)**2)**0.5
+        earth_dist = (es[:, 0]**2 + es[:, 1]**2 + es[:, 2]**2)**0.5
 
-        q = (r_helio.au**2 + self.delta.au**2 - earth_dist.value) / \
+        q = (r_helio.au**2 + self.delta.au**2 - earth_dist**2) / \
             (2 * r_helio.au * self.delta.au)
 
         # pyephem
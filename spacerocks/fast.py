@@ -0,0 +1,148 @@
+'''
+Units-free interface to the C kernels.
+
+Everything here takes and returns plain float64 numpy arrays in the
+canonical units used by the kernels: au, au/day, radians and TDB Julian
+dates. Nothing is wrapped in astropy objects, so these functions avoid the
+unit machinery entirely. Inputs of any dtype or memory layout are accepted
+and converted once. Per-object inputs may also be scalars or length-1
+arrays, which are shared by every object without being copied, e.g. to
+trace one orbit at many mean anomalies.
+
+The batched functions return the kernel's output buffer, with one row per
+quantity, so the results can be unpacked like the wrappers in cbindings
+
+    x, y, z, vx, vy, vz = fast.kepM_to_xyz(a, e, inc, arg, node, M)
+
+or kept as a single (6, N) block. All of them accept out= to reuse a buffer
+and threads= to split the work across threads. Orbits given by elements
+are barycentric, like in the rest of the kernels. kepM_to_xyz, calc_E_from_M
+and correct_for_ltt also take dtype=np.float32 for screening; see the error
+budget in cbindings.
+'''
+
+import numpy as np
+
+from . import cbindings
+from .cbindings import clibspacerocks, _output_buffer, _resolve_threads, _resolve_tol, _resolve_dtype
+from .cbindings import _broadcast, _reduce, _as_float_anomaly
+
+
+def _double(x):
+    return np.ascontiguousarray(x, dtype=np.float64)
+
+
+def kepM_to_xyz(a, e, inc, arg, node, M, out=None, threads=None, tol='precise', dtype=np.float64):
+    '''
+    Barycentric ecliptic state (6, N) from elements with mean anomalies.
+    '''
+    return cbindings.kepM_to_xyz(_double(a), _double(e), _double(inc), _double(arg), _double(node), _double(M),
+                                 out=out, threads=threads, tol=tol, raw=True, dtype=dtype)
+
+
+def kepE_to_xyz(a, e, inc, arg, node, E, out=None, threads=None):
+    '''
+    Barycentric ecliptic state (6, N) from elements with eccentric anomalies.
+    '''
+    return cbindings.kepE_to_xyz(_double(a), _double(e), _double(inc), _double(arg), _double(node), _double(E),
+                                 out=out, threads=threads, raw=True)
+
+
+def calc_kep_from_xyz(mu, x, y, z, vx, vy, vz, out=None, threads=None):
+    '''
+    Elements (a, e, inc, arg, node, f) as a (6, N) block from states
+    about a body with gravitational parameter mu (au^3/day^2).
+    '''
+    return cbindings.calc_kep_from_xyz(mu, _double(x), _double(y), _double(z), _double(vx), _double(vy), _double(vz),
+                                       out=out, threads=threads, raw=True)
+
+
+def calc_E_from_M(e, M, out=None, threads=None, tol='precise', dtype=np.float64):
+    return cbindings.calc_E_from_M(_double(e), _double(M), out=out, threads=threads, tol=tol, raw=True, dtype=dtype)
+
+
+def calc_M_from_E(e, E, out=None):
+    return cbindings.calc_M_from_E(_double(e), _double(E), out=out, raw=True)
+
+
+def calc_E_from_f(e, f, out=None):
+    return cbindings.calc_E_from_f(_double(e), _double(f), out=out, raw=True)
+
+
+def calc_f_from_E(e, E, out=None):
+    return cbindings.calc_f_from_E(_double(e), _double(E), out=out, raw=True)
+
+
+def propagate_kepler(mu, x, y, z, vx, vy, vz, epoch0, epochs, out=None, threads=None):
+    '''
+    Two-body propagation of N states at epoch0 to T epochs. Returns a
+    (6, T, N) block.
+    '''
+    return cbindings.propagate_kepler(mu, _double(x), _double(y), _double(z), _double(vx), _double(vy), _double(vz),
+                                      _double(epoch0), np.atleast_1d(_double(epochs)), out=out, threads=threads, raw=True)
+
+
+def correct_for_ltt(a, e, inc, arg, node, M, ox, oy, oz, ovx, ovy, ovz, out=None, threads=None, tol='precise', dtype=np.float64):
+    '''
+    Light-time corrected state (6, N) of barycentric orbits relative to
+    observers with barycentric ecliptic states (ox, ..., ovz).
+    '''
+    if _resolve_dtype(dtype) == np.float32:
+        N, inputs, strides = _broadcast(a, e, _reduce(inc), _reduce(arg), _reduce(node), _as_float_anomaly(e, M), 
+                                        ox, oy, oz, ovx, ovy, ovz, dtype=np.float32)
+        out = _output_buffer(out, (6, N), np.float32)
+        clibspacerocks.py_correct_for_ltt_f(N, *inputs, strides, _resolve_tol(tol), out, _resolve_threads(threads))
+        return out
+
+    N, inputs, strides = _broadcast(a, e, inc, arg, node, M, ox, oy, oz, ovx, ovy, ovz)
+    out = _output_buffer(out, (6, N))
+    clibspacerocks.py_correct_for_ltt(N, *inputs, strides, _resolve_tol(tol), out, _resolve_threads(threads))
+    return out
+
+
+def observe(a, e, inc, arg, node, M, observer, sun, H, G, out=None, threads=None, tol='precise'):
+    '''
+    Fused ephemerides of barycentric orbits, as a structured array with
+    cbindings.OBSERVATION_DTYPE. observer is a (6, N) block of barycentric
+    ecliptic states and sun a (3, N) block of Sun positions.
+    '''
+    return cbindings.observe(_double(a), _double(e), _double(inc), _double(arg), _double(node), _double(M),
+                             observer, sun, H, G, out=out, threads=threads, tol=tol)
+
+
+def state(rocks):
+    '''
+    Return the (6, N) state block of a SpaceRock in au and au/day,
+    in its current origin and frame.
+    '''
+    out = np.empty((6, len(rocks)))
+    out[0] = rocks.x.au
+    out[1] = rocks.y.au
+    out[2] = rocks.z.au
+    out[3] = rocks.vx.to_value('au/day')
+    out[4] = rocks.vy.to_value('au/day')
+    out[5] = rocks.vz.to_value('au/day')
+    return out
+
+
+def elements(rocks):
+    '''
+    Return the (6, N) block of elements (a, e, inc, arg, node, M) of
+    a SpaceRock in au and radians.
+    '''
+    out = np.empty((6, len(rocks)))
+    out[0] = rocks.a.au
+    out[1] = rocks.e
+    out[2] = rocks.inc.rad
+    out[3] = rocks.arg.rad
+    out[4] = rocks.node.rad
+    out[5] = rocks.M.rad
+    return out
+
+
+def as_state(block):
+    '''
+    Zero-copy astropy views (Distance and au/day Quantity) of the rows 
+    of a (6, ...) state block, for when units are wanted after all.
+    '''
+    return cbindings._as_state(block)
@@ -5,18 +5,11 @@ from astropy.time import Time
 from .constants import mu_bary, frames
 
 from .vector import Vector
-from .cbindings import calc_kep_from_xyz, calc_vovec_from_kep, calc_M_from_E, calc_E_from_f, calc_E_from_M, calc_f_from_E
+from .units import Units
+from .cbindings import calc_kep_from_xyz, calc_vovec_from_kep, calc_M_from_E, calc_E_from_f, calc_E_from_M, calc_f_from_E, propagate_kepler, kep_jacobian, stm_kepler
 from .spice import SpiceBody
+from .timescales import tdb_jd
 
-import pkg_resources
-import spiceypy as spice
-import os
-
-SPICE_PATH = pkg_resources.resource_filename('spacerocks', 'data/spice')
-spice.furnsh(os.path.join(SPICE_PATH, 'latest_leapseconds.tls'))
-spice.furnsh(os.path.join(SPICE_PATH, 'de440s.bsp'))
-spice.furnsh(os.path.join(SPICE_PATH, 'hst.bsp'))
-spice.furnsh(os.path.join(SPICE_PATH, 'nh.bsp'))
 
 class KeplerOrbit:
 
@@ -31,22 +24,21 @@ class KeplerOrbit:
 
             current_origin = SpiceBody(spiceid=self.origin)
             new = SpiceBody(spiceid=new_origin)
-            co = current_origin.at(self.epoch)
-            no = new.at(self.epoch)
+            shift = current_origin.states(self.epoch) - new.states(self.epoch)
 
-            x = self.x + co.x - no.x
-            y = self.y + co.y - no.y
-            z = self.z + co.z - no.z
-            vx = self.vx + co.vx - no.vx
-            vy = self.vy + co.vy - no.vy
-            vz = self.vz + co.vz - no.vz
+            x = self.x + shift[:, 0] * u.au
+            y = self.y + shift[:, 1] * u.au
+            z = self.z + shift[:, 2] * u.au
+            vx = self.vx + shift[:, 3] * u.au / u.day
+            vy = self.vy + shift[:, 4] * u.au / u.day
+            vz = self.vz + shift[:, 5] * u.au / u.day
 
             self.origin = new_origin
 
             if new_origin == 'ssb':
                 self.mu = mu_bary
             else:
-                self.mu = no.mu
+                self.mu = new.mu
 
             # clear the keplerian variables because they need to be recomputed
             self.clear_kep()
@@ -98,6 +90,88 @@ class KeplerOrbit:
         self.change_origin('sun')
        
 
+    def propagate_kepler(self, epochs, units=Units()):
+        '''
+        Analytically propagate all bodies to the desired epochs on two-body
+        Keplerian orbits about the current origin, without any perturbers.
+        This is much faster than the N-body propagate method, and is a good
+        approximation over short arcs.
+
+        Returns a new object holding every body at every epoch, ordered like
+        the output of propagate: all bodies at the first epoch, then all
+        bodies at the second epoch, and so on. The epochs are not sorted.
+        '''
+        epochs = self.detect_timescale(np.atleast_1d(epochs), units.timescale)
+        epochs = tdb_jd(epochs)
+        N = len(self)
+        T = len(epochs)
+
+        x, y, z, vx, vy, vz = propagate_kepler(self.mu.value, 
+                                               np.ascontiguousarray(self.x.au, dtype=np.float64), 
+                                               np.ascontiguousarray(self.y.au, dtype=np.float64), 
+                                               np.ascontiguousarray(self.z.au, dtype=np.float64), 
+                                               np.ascontiguousarray(self.vx.to(u.au/u.day).value, dtype=np.float64), 
+                                               np.ascontiguousarray(self.vy.to(u.au/u.day).value, dtype=np.float64), 
+                                               np.ascontiguousarray(self.vz.to(u.au/u.day).value, dtype=np.float64), 
+                                               np.ascontiguousarray(tdb_jd(self.epoch), dtype=np.float64), 
+                                               np.ascontiguousarray(epochs, dtype=np.float64), 
+                                               raw=True)
+
+        units = Units()
+        units.timescale = 'tdb'
+        rocks = self.__class__(x=x.ravel(), 
+                               y=y.ravel(), 
+                               z=z.ravel(), 
+                               vx=vx.ravel(), 
+                               vy=vy.ravel(), 
+                               vz=vz.ravel(), 
+                               epoch=np.repeat(epochs, N), 
+                               name=np.tile(self.name, T), 
+                               origin=self.origin, 
+                               frame=self.frame, 
+                               units=units)
+
+        if hasattr(self, 'G'):
+            rocks.G = np.tile(self.G, T)
+
+        if hasattr(self, 'H_func'):
+            rocks.H_func = np.tile(self.H_func, T)
+
+        if hasattr(self, 'mag_func'):
+            rocks.mag_func = np.tile(self.mag_func, T)
+
+        return rocks
+
+    def jacobian(self):
+        '''
+        Partial derivatives of the Cartesian state (x, y, z, vx, vy, vz) with 
+        respect to the Keplerian elements (a, e, inc, arg, node, M), in au, 
+        au/day and radians. Returns an (N, 6, 6) array with one row per state 
+        component and one column per element.
+        '''
+        return kep_jacobian(self.mu.value, 
+                            np.ascontiguousarray(self.a.au, dtype=np.float64), 
+                            np.ascontiguousarray(self.e, dtype=np.float64), 
+                            np.ascontiguousarray(self.inc.rad, dtype=np.float64), 
+                            np.ascontiguousarray(self.arg.rad, dtype=np.float64), 
+                            np.ascontiguousarray(self.node.rad, dtype=np.float64), 
+                            np.ascontiguousarray(self.M.rad, dtype=np.float64))
+
+    def stm(self, dt):
+        '''
+        Two-body state transition matrices over a time step dt (days, scalar 
+        or one per body), mapping changes in the current Cartesian state to 
+        changes in the state at epoch + dt. Returns an (N, 6, 6) array.
+        '''
+        return stm_kepler(self.mu.value, 
+                          np.ascontiguousarray(self.x.au, dtype=np.float64), 
+                          np.ascontiguousarray(self.y.au, dtype=np.float64), 
+                          np.ascontiguousarray(self.z.au, dtype=np.float64), 
+                          np.ascontiguousarray(self.vx.to(u.au/u.day).value, dtype=np.float64), 
+                          np.ascontiguousarray(self.vy.to(u.au/u.day).value, dtype=np.float64), 
+                          np.ascontiguousarray(self.vz.to(u.au/u.day).value, dtype=np.float64), 
+                          dt)
+
     def clear_kep(self):
 
         to_delete = ['_a', 
@@ -129,13 +203,20 @@ class KeplerOrbit:
                      '_z', 
                      '_vx', 
                      '_vy', 
-                     '_vz']
+                     '_vz', 
+                     '_columns']
 
         for attr in to_delete:
             self.__dict__.pop(attr, None)
 
     def kep_from_xyz(self):
-        self.a, self.e, self.inc, self.arg, self.node, self.f = calc_kep_from_xyz(self.mu.value, self.x.au, self.y.au, self.z.au, self.vx.value, self.vy.value, self.vz.value)
+        self.a, self.e, self.inc, self.arg, self.node, self.f = calc_kep_from_xyz(self.mu.value, 
+                                                                                  np.ascontiguousarray(self.x.au, dtype=np.float64), 
+                                                                                  np.ascontiguousarray(self.y.au, dtype=np.float64), 
+                                                                                  np.ascontiguousarray(self.z.au, dtype=np.float64), 
+                                                                                  np.ascontiguousarray(self.vx.value, dtype=np.float64), 
+                                                                                  np.ascontiguousarray(self.vy.value, dtype=np.float64), 
+                                                                                  np.ascontiguousarray(self.vz.value, dtype=np.float64))
 
     ''' Vector Quantities '''
 
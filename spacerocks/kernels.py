@@ -0,0 +1,322 @@
+'''
+The SPICE kernels loaded by spacerocks.
+
+Every module used to furnsh the same kernels at import, so the kernel pool
+held several copies of each and importing spacerocks paid for loading them.
+The kernel manager instead loads the default kernels (the leapseconds, the
+planetary and spacecraft SPKs and the GM constants) once, the first time
+anything in spacerocks needs SPICE. Call ensure_loaded() before using
+spiceypy directly.
+
+Additional kernels can be registered at any time. SPKs registered here
+take priority over the defaults, in SPICE and in the vectorized reader in
+spk, like kernels loaded later with furnsh. SPKs furnished with spiceypy
+directly are also honored by the reader, which then reads the list of
+loaded SPKs from SPICE, but the state cache in statecache does not see
+them; call statecache.invalidate() after loading or unloading kernels that
+way.
+
+    from spacerocks import kernels
+    kernels.register('my_spacecraft.bsp')
+    kernels.loaded()
+    kernels.unload('my_spacecraft.bsp')
+
+SPKs of small bodies, one or a few bodies per file like the ones in
+data/spice/asteroids, go to the SPK pool instead. The pool indexes files by
+the bodies they cover and loads them on demand, when SpiceBody.at asks for
+one of their bodies, keeping at most POOL_SIZE of them loaded (well under
+the CSPICE limit on open files) and unloading the least recently used.
+
+    kernels.pool().add_directory('/data/small_bodies')
+    SpiceBody(spiceid='2000433').at(epoch)
+    kernels.pool().stats()
+'''
+
+import collections
+import glob
+import os
+
+import pkg_resources
+import spiceypy as spice
+
+SPICE_PATH = pkg_resources.resource_filename('spacerocks', 'data/spice')
+
+DEFAULT_KERNELS = ['latest_leapseconds.tls', 'de440s.bsp', 'hst.bsp', 'nh.bsp', 'gm_Horizons.pck']
+
+# CSPICE allows 5000 loaded files.
+POOL_SIZE = 1000
+
+# The number of SPK loads and unloads remembered by the kernel manager.
+CHANGE_LOG = 4096
+
+
+def is_spk(path):
+    return path.lower().endswith('.bsp')
+
+
+class KernelManager:
+
+    '''
+    The kernels furnished to SPICE by spacerocks, in load order. version
+    changes whenever the set of loaded SPKs does, so readers of the SPKs
+    can tell when to rebuild, and changes records which SPK each version
+    loaded or unloaded.
+    '''
+
+    def __init__(self, defaults=DEFAULT_KERNELS):
+        self.defaults = [os.path.join(SPICE_PATH, kernel) for kernel in defaults]
+        self.registered = []
+        self.kernels = []
+        self.version = 0
+        self.changes = collections.deque(maxlen=CHANGE_LOG)
+        self.ready = False
+
+    def changed(self, path):
+        '''
+        Record a load or unload of an SPK, or of every kernel if path is
+        None.
+        '''
+        self.version += 1
+        self.changes.append((self.version, path))
+
+    def changed_since(self, version):
+        '''
+        Paths of the SPKs loaded or unloaded since version, or None if that
+        is not known or everything was unloaded.
+        '''
+        if version == self.version:
+            return []
+        paths = [path for v, path in self.changes if v > version]
+        if len(paths) != self.version - version or None in paths:
+            return None
+        return paths
+
+    def ensure_loaded(self):
+        '''
+        Load the default and registered kernels, if they are not already.
+        '''
+        if not self.ready:
+            self.ready = True
+            for path in self.defaults + self.registered:
+                self.load(path)
+
+    def load(self, path):
+        '''
+        Furnish a kernel, unless it is already loaded.
+        '''
+        path = os.path.abspath(path)
+        if path in self.kernels:
+            return
+        if not os.path.isfile(path):
+            raise FileNotFoundError('No kernel at {}.'.format(path))
+        spice.furnsh(path)
+        self.kernels.append(path)
+        if is_spk(path):
+            self.changed(path)
+
+    def register(self, path):
+        '''
+        Add a kernel to the ones spacerocks uses. It is loaded right away if
+        the defaults already are, and otherwise along with them.
+        '''
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            raise FileNotFoundError('No kernel at {}.'.format(path))
+        if path not in self.registered:
+            self.registered.append(path)
+        if self.ready:
+            self.load(path)
+        return path
+
+    def unload(self, path=None):
+        '''
+        Unload a kernel, or all of them if no path is given. After unloading
+        everything, the defaults are loaded again on next use.
+        '''
+        if path is None:
+            for kernel in self.kernels:
+                spice.unload(kernel)
+            self.kernels = []
+            self.registered = []
+            self.ready = False
+            self.changed(None)
+            return
+
+        path = os.path.abspath(path)
+        if path in self.registered:
+            self.registered.remove(path)
+        if path in self.kernels:
+            spice.unload(path)
+            self.kernels.remove(path)
+            if is_spk(path):
+                self.changed(path)
+
+    def loaded(self):
+        '''
+        Paths of the loaded kernels, in load order.
+        '''
+        return list(self.kernels)
+
+    def spks(self):
+        '''
+        Paths of the SPKs that are loaded, or will be on first use, in load
+        order.
+        '''
+        kernels = self.kernels if self.ready else self.defaults + self.registered
+        return [path for path in kernels if is_spk(path)]
+
+
+class SPKPool:
+
+    '''
+    Small-body SPKs indexed by NAIF ID and loaded through the kernel
+    manager on demand, at most capacity at a time, least recently used
+    first out.
+    '''
+
+    def __init__(self, manager, capacity=POOL_SIZE):
+        self.manager = manager
+        self.capacity = capacity
+        self.index = {}
+        self.codes = {}
+        self.active = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def add(self, path, code=None):
+        '''
+        Add an SPK for the body with NAIF ID code, or for every body it has
+        segments for if code is None.
+        '''
+        path = os.path.abspath(path)
+        if code is None:
+            from .spk import read_segments
+            codes = {segment.target for segment in read_segments(path)}
+        else:
+            codes = [int(code)]
+        for code in codes:
+            self.index[code] = path
+
+    def add_directory(self, directory):
+        '''
+        Add every SPK in a directory named after the NAIF ID of its body,
+        e.g. 2000001.bsp for Ceres.
+        '''
+        for path in glob.glob(os.path.join(directory, '*.bsp')):
+            stem = os.path.splitext(os.path.basename(path))[0]
+            if stem.lstrip('-').isdigit():
+                self.index[int(stem)] = os.path.abspath(path)
+
+    def code(self, body):
+        '''
+        NAIF ID of a body given by name or number, or None if SPICE does not
+        know it.
+        '''
+        if body not in self.codes:
+            try:
+                self.codes[body] = int(body)
+            except ValueError:
+                try:
+                    self.codes[body] = spice.bods2c(str(body))
+                except Exception:
+                    self.codes[body] = None
+        return self.codes[body]
+
+    def require(self, bodies):
+        '''
+        Make sure the SPKs of the pooled bodies among bodies are loaded.
+        Bodies that are not in the pool are ignored.
+        '''
+        paths = []
+        for body in bodies:
+            path = self.index.get(self.code(body))
+            if path is not None and path not in paths:
+                paths.append(path)
+        if len(paths) > self.capacity:
+            raise ValueError('Cannot load {} pooled SPKs at once, the pool holds {}.'.format(len(paths), self.capacity))
+
+        self.manager.ensure_loaded()
+        for path in paths:
+            if path in self.active and path in self.manager.kernels:
+                self.hits += 1
+                self.active.move_to_end(path)
+                continue
+            self.misses += 1
+            while len(self.active) >= self.capacity:
+                self.evict()
+            self.manager.load(path)
+            self.active[path] = True
+
+    def evict(self):
+        '''
+        Unload the least recently used SPK, unless it was also registered
+        with the kernel manager.
+        '''
+        path, _ = self.active.popitem(last=False)
+        if path not in self.manager.registered:
+            self.manager.unload(path)
+        self.evictions += 1
+
+    def clear(self):
+        '''
+        Unload every pooled SPK.
+        '''
+        while self.active:
+            self.evict()
+
+    def stats(self):
+        '''
+        Counts of pool hits, misses and evictions, and of loaded and indexed
+        SPKs.
+        '''
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'loaded': len(self.active), 'indexed': len(set(self.index.values()))}
+
+
+_manager = KernelManager()
+_pool = None
+
+
+def manager():
+    return _manager
+
+
+def pool():
+    '''
+    The SPK pool, with the asteroid kernels that ship with spacerocks
+    indexed on first use.
+    '''
+    global _pool
+    if _pool is None:
+        _pool = SPKPool(_manager)
+        _pool.add_directory(os.path.join(SPICE_PATH, 'asteroids'))
+    return _pool
+
+
+def ensure_loaded():
+    '''
+    Load the kernels spacerocks uses, if they are not already.
+    '''
+    _manager.ensure_loaded()
+
+
+def register(path):
+    '''
+    Register an additional SPK or PCK. Returns its absolute path.
+    '''
+    return _manager.register(path)
+
+
+def unload(path=None):
+    '''
+    Unload a kernel, or all of them.
+    '''
+    _manager.unload(path)
+
+
+def loaded():
+    '''
+    Paths of the loaded kernels, in load order.
+    '''
+    return _manager.loaded()
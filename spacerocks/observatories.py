@@ -0,0 +1,110 @@
+'''
+The MPC observatory codes, as a table of geocentric parallax constants.
+
+The table ships as data/observatories.npy, built from data/observatories.csv
+by build(), and is loaded on first use. Besides the geodetic lat (deg), lon
+(deg, east) and elevation (m) of each site, it stores its distance from the
+Earth's axis, rho_cos, and from the equatorial plane, rho_sin, in km, so a
+site's geocentric position at local sidereal time theta is
+(rho_cos cos(theta), rho_cos sin(theta), rho_sin).
+'''
+
+import csv
+
+import numpy as np
+import pkg_resources
+
+CSV_PATH = pkg_resources.resource_filename('spacerocks', 'data/observatories.csv')
+DATA_PATH = pkg_resources.resource_filename('spacerocks', 'data/observatories.npy')
+
+# WGS84
+EQUAT_RAD = 6378.137
+FLATTEN = 1 / 298.257223563
+
+OBSERVATORY_DTYPE = np.dtype([('obscode', 'U3'),
+                              ('lat', np.float64),
+                              ('lon', np.float64),
+                              ('elevation', np.float64),
+                              ('rho_cos', np.float64),
+                              ('rho_sin', np.float64)])
+
+
+def parallax_constants(lat, elevation):
+    '''
+    Distances (km) of sites from the Earth's axis and from the equatorial
+    plane, given their geodetic latitudes (deg) and elevations (m).
+    '''
+    lat = np.radians(lat)
+    denom = (1 - FLATTEN) * np.sin(lat)
+    denom = np.cos(lat) * np.cos(lat) + denom*denom
+
+    C_geo = 1 / np.sqrt(denom)
+    S_geo = (1 - FLATTEN) * (1 - FLATTEN) * C_geo
+    C_geo = C_geo * EQUAT_RAD + elevation / 1000
+    S_geo = S_geo * EQUAT_RAD + elevation / 1000
+    return C_geo * np.cos(lat), S_geo * np.sin(lat)
+
+
+def build(csv_path=CSV_PATH, path=DATA_PATH):
+    '''
+    Write the observatory table from the csv of observatory codes.
+    '''
+    with open(csv_path, newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    table = np.zeros(len(rows), dtype=OBSERVATORY_DTYPE)
+    table['obscode'] = [row['obscode'] for row in rows]
+    for field in ['lat', 'lon', 'elevation']:
+        table[field] = [float(row[field]) for row in rows]
+    table['rho_cos'], table['rho_sin'] = parallax_constants(table['lat'], table['elevation'])
+
+    np.save(path, table)
+
+
+class ObservatoryTable:
+
+    '''
+    Observatory parameters with a dictionary index from code to row.
+    '''
+
+    def __init__(self, path=DATA_PATH):
+        self.data = np.load(path)
+        self.index = {code: k for k, code in enumerate(self.data['obscode'])}
+
+    def __len__(self):
+        return len(self.data)
+
+    def rows(self, obscodes):
+        '''
+        Row numbers of an array of obscodes. Each distinct code is looked up
+        once.
+        '''
+        codes, inverse = np.unique(np.atleast_1d(obscodes).astype(str), return_inverse=True)
+        try:
+            rows = np.array([self.index[code] for code in codes], dtype=np.intp)
+        except KeyError as error:
+            raise ValueError('Unknown observatory code {}.'.format(error.args[0])) from None
+        return rows[inverse.ravel()]
+
+    def lookup(self, obscodes):
+        '''
+        The table records of an array of obscodes.
+        '''
+        return self.data[self.rows(obscodes)]
+
+
+_observatories = None
+
+
+def observatories():
+    '''
+    The observatory table shipped with spacerocks, loaded on first use.
+    '''
+    global _observatories
+    if _observatories is None:
+        _observatories = ObservatoryTable()
+    return _observatories
+
+
+if __name__ == '__main__':
+    build()
@@ -0,0 +1,144 @@
+'''
+Opt-in parallel backend for the spkezr fallback of SpiceBody and Observer.
+
+CSPICE is not thread-safe, so bodies that the vectorized reader in spk
+cannot evaluate are computed one (body, epoch) pair at a time on one core.
+With the backend enabled, the unique pairs are sharded across a pool of
+worker processes, each with its own kernel pool holding the same kernels as
+the parent, and the states are written straight into a shared memory block.
+
+    from spacerocks import parallel
+    parallel.enable(8)
+
+The pool is started on first use and kept for later queries. Workers load
+or unload kernels to match the parent before every shard. Queries with fewer
+than MIN_PAIRS unique pairs are computed in the parent.
+
+Workers are spawned rather than forked, so that they do not inherit the
+parent's CSPICE state or threads. As with any spawned pool, scripts that
+enable the backend need an if __name__ == '__main__' guard.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+import spiceypy as spice
+
+from . import kernels
+from .timescales import utc_to_et
+
+MIN_PAIRS = 1000
+SHARDS_PER_PROCESS = 4
+
+_processes = 0
+_executor = None
+
+# The kernels furnished in a worker process.
+_worker_kernels = []
+
+
+def enable(processes=None):
+    '''
+    Use a pool of processes (by default one per core) for spkezr queries.
+    '''
+    global _processes
+    processes = os.cpu_count() if processes is None else processes
+    if processes != _processes:
+        disable()
+    _processes = processes
+
+
+def disable():
+    '''
+    Go back to serial spkezr queries, and stop the pool.
+    '''
+    global _processes, _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+    _processes = 0
+
+
+def enabled():
+    return _processes > 1
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=_processes, mp_context=get_context('spawn'))
+    return _executor
+
+
+def _sync_kernels(paths):
+    global _worker_kernels
+    for path in _worker_kernels:
+        if path not in paths:
+            spice.unload(path)
+    for path in paths:
+        if path not in _worker_kernels:
+            spice.furnsh(path)
+    _worker_kernels = list(paths)
+
+
+def _shard(name, size, start, bodies, et, frame, origin, paths):
+    '''
+    Compute the states of one shard of (body, et) pairs in a worker, into
+    columns start:start + len(et) of the shared (6, size) block.
+    '''
+    _sync_kernels(paths)
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        out = np.ndarray((6, size), dtype=np.float64, buffer=block.buf)
+        for k, (body, t) in enumerate(zip(bodies, et)):
+            out[:, start + k] = spice.spkezr(body, t, frame, 'none', origin)[0]
+    finally:
+        block.close()
+
+
+def _serial(bodies, et, frame, origin):
+    out = np.empty((6, len(et)))
+    for k, (body, t) in enumerate(zip(bodies, et)):
+        out[:, k] = spice.spkezr(body, t, frame, 'none', origin)[0]
+    return out
+
+
+def states(spiceid, epoch, frame='ECLIPJ2000', origin='ssb'):
+    '''
+    States of bodies at UTC Julian dates from spkezr, as a (6, N) array in
+    km and km/s. Each unique (body, epoch) pair is computed once, in the
+    pool if the backend is enabled and there are enough of them.
+    '''
+    kernels.ensure_loaded()
+    epoch = np.atleast_1d(epoch)
+    spiceid = np.atleast_1d(spiceid).astype(str)
+    if len(spiceid) < len(epoch):
+        spiceid = np.repeat(spiceid, len(epoch))
+
+    pairs = np.empty(len(epoch), dtype=[('body', spiceid.dtype), ('epoch', np.float64)])
+    pairs['body'] = spiceid
+    pairs['epoch'] = epoch
+    unique, inverse = np.unique(pairs, return_inverse=True)
+    bodies = unique['body'].tolist()
+    et = utc_to_et(unique['epoch'])
+    size = len(unique)
+
+    if not enabled() or size < MIN_PAIRS:
+        return _serial(bodies, et, frame, origin)[:, inverse.ravel()]
+
+    paths = kernels.loaded()
+    step = -(-size // (_processes * SHARDS_PER_PROCESS))
+    block = shared_memory.SharedMemory(create=True, size=6 * size * 8)
+    try:
+        futures = [executor().submit(_shard, block.name, size, start, bodies[start:start + step],
+                                     et[start:start + step], frame, origin, paths)
+                   for start in range(0, size, step)]
+        for future in futures:
+            future.result()
+        out = np.ndarray((6, size), dtype=np.float64, buffer=block.buf)[:, inverse.ravel()]
+    finally:
+        block.close()
+        block.unlink()
+    return out
@@ -0,0 +1,99 @@
+'''
+The massive bodies of the n-body force models used by SpaceRock.propagate.
+
+Building a model means looking up the mass of every body and evaluating its
+state at the start of the integration. PerturberSets are memoized by
+(model, start epoch), so repeated propagations from the same epoch share
+one, and masses come from the process-wide GM cache in spice.
+
+Model 0 is the Sun, with the masses of the planets added to it. Model 1 is
+the Sun and the giant planets, with the masses of the terrestrial planets
+added to the Sun. Model 2 is the Sun, the planets, the Moon and Pluto, and
+model 3 adds the 16 most massive asteroids, whose kernels are loaded on
+demand by the SPK pool in kernels.
+'''
+
+import functools
+
+import numpy as np
+from astropy.time import Time
+
+from .spice import SpiceBody, mass
+
+PLANETS = [('Sun', 'Sun'),
+           ('Mercury', 'Mercury Barycenter'),
+           ('Venus', 'Venus Barycenter'),
+           ('Earth', 'Earth'),
+           ('Moon', 'Moon'),
+           ('Mars', 'Mars Barycenter'),
+           ('Jupiter', 'Jupiter Barycenter'),
+           ('Saturn', 'Saturn Barycenter'),
+           ('Uranus', 'Uranus Barycenter'),
+           ('Neptune', 'Neptune Barycenter'),
+           ('Pluto', 'Pluto Barycenter')]
+
+ASTEROIDS = [('Ceres', 'Ceres'),
+             ('Vesta', 'Vesta'),
+             ('Pallas', 'Pallas'),
+             ('Interamnia', '2000704'),
+             ('Juno', '2000003'),
+             ('Camilla', '2000107'),
+             ('Iris', '2000007'),
+             ('Hygiea', '2000010'),
+             ('Eunomia', '2000015'),
+             ('Psyche', '2000016'),
+             ('Euphrosyne', '2000031'),
+             ('Europa', '2000052'),
+             ('Cybele', '2000065'),
+             ('Sylvia', '2000087'),
+             ('Thisbe', '2000088'),
+             ('Davida', '2000511')]
+
+INNER = ['Mercury Barycenter', 'Venus Barycenter', 'Earth', 'Mars Barycenter']
+OUTER = ['Jupiter Barycenter', 'Saturn Barycenter', 'Uranus Barycenter', 'Neptune Barycenter']
+
+# For each model, the bodies and the spiceids whose masses are added to the Sun.
+MODELS = {0: ([PLANETS[0]], INNER + OUTER),
+          1: ([PLANETS[0]] + PLANETS[6:10], INNER),
+          2: (PLANETS, []),
+          3: (PLANETS + ASTEROIDS, [])}
+
+
+class PerturberSet:
+
+    '''
+    Names, masses (Msun) and barycentric ecliptic states (au, au/day) of
+    the massive bodies of a model at a TDB Julian date. The arrays are
+    read-only, since the set is shared between propagations.
+    '''
+
+    def __init__(self, model, epoch):
+        if model not in MODELS:
+            raise ValueError('Model not recognized. Check the documentation.')
+
+        bodies, folded = MODELS[model]
+        self.model = model
+        self.epoch = epoch
+        self.names = [name for name, _ in bodies]
+        self.spiceids = [spiceid for _, spiceid in bodies]
+
+        self.masses = np.array([mass(spiceid) for spiceid in self.spiceids])
+        self.masses[0] += sum(mass(spiceid) for spiceid in folded)
+
+        epochs = Time(np.full(len(bodies), epoch), scale='tdb', format='jd')
+        b = SpiceBody(spiceid=np.array(self.spiceids)).at(epochs)
+        self.states = np.array([b.x.au, b.y.au, b.z.au, b.vx.value, b.vy.value, b.vz.value])
+
+        self.masses.setflags(write=False)
+        self.states.setflags(write=False)
+
+    def __len__(self):
+        return len(self.names)
+
+
+@functools.lru_cache(maxsize=32)
+def perturbers(model, epoch):
+    '''
+    The PerturberSet of a model at a TDB Julian date, memoized.
+    '''
+    return PerturberSet(model, float(epoch))
@@ -7,7 +7,6 @@ from astropy.time import Time
 import datetime
 
 import numpy as np
-import pandas as pd
 
 import rebound
 import asdf
@@ -19,26 +18,21 @@ from .convenience import Convenience
 from .units import Units
 from .vector import Vector
 from .ephemerides import Ephemerides 
-from .observer import Observer
-from .cbindings import kepM_to_xyz, correct_for_ltt
+from .observer import get_observer
+from .cbindings import kepM_to_xyz, correct_for_ltt, correct_for_ltt_grid, observe as fused_observe
+from . import fast
+from .fast import as_state
+from .clones import Clones
+from .columns import Columns
 from .spice import SpiceBody
-import os
-import pkg_resources
-import spiceypy as spice
+from .perturbers import perturbers
+from .timescales import utc_jd, tdb_jd
 
 
-SPICE_PATH = pkg_resources.resource_filename('spacerocks', 'data/spice')
-spice.furnsh(os.path.join(SPICE_PATH, 'latest_leapseconds.tls'))
-spice.furnsh(os.path.join(SPICE_PATH, 'de440s.bsp'))
-spice.furnsh(os.path.join(SPICE_PATH, 'hst.bsp'))
-spice.furnsh(os.path.join(SPICE_PATH, 'nh.bsp'))
 
 sun = SpiceBody(spiceid='Sun')
 earth = SpiceBody(spiceid='Earth')
 
-DATA_PATH = pkg_resources.resource_filename('spacerocks', 'data/observatories.csv')
-observatories = pd.read_csv(DATA_PATH)
-
 
 class SpaceRock(KeplerOrbit, Convenience):
     '''
@@ -332,6 +326,41 @@ class SpaceRock(KeplerOrbit, Convenience):
                        frame=f['frame'], 
                        units=units)
 
+    @classmethod
+    def from_columns(cls, columns):
+        '''
+        A SpaceRock whose Cartesian state is a view of the block of a 
+        Columns object, named by its ids. Only the epochs are copied, into 
+        a Time.
+        '''
+        rock = cls.__new__(cls)
+        rock.frame = columns.frame
+        rock.origin = columns.origin.lower()
+        if rock.origin == 'ssb':
+            rock.mu = mu_bary
+        else:
+            rock.mu = SpiceBody(spiceid=rock.origin).mu
+
+        rock.x, rock.y, rock.z, rock.vx, rock.vy, rock.vz = columns.quantities()
+        rock.position = Vector(rock.x, rock.y, rock.z)
+        rock.velocity = Vector(rock.vx, rock.vy, rock.vz)
+        rock.epoch = Time(columns.epoch, format='jd', scale='tdb')
+        rock.name = columns.id
+        rock._columns = columns
+        return rock
+
+    def to_columns(self, id=None):
+        '''
+        The states, TDB epochs and ids of the rocks as a Columns object. 
+        For a SpaceRock made by from_columns whose state has not changed 
+        since, this is the Columns object it was made from. Otherwise the 
+        states are packed into a new block.
+        '''
+        columns = self.__dict__.get('_columns')
+        if id is None and columns is not None and columns.shares_state(self):
+            return columns
+        return Columns.from_spacerock(self, id=id)
+
     @property
     def H(self):
         if hasattr(self, 'H_func'):
@@ -359,7 +388,7 @@ class SpaceRock(KeplerOrbit, Convenience):
         self.change_frame('eclipJ2000')
 
         # Integrate all particles to the same obsdate
-        pickup_times = self.epoch.tdb.jd
+        pickup_times = tdb_jd(self.epoch)
         sim, planet_names = self.set_simulation(np.min(pickup_times), model=model)
         sim.t = np.min(pickup_times)
 
@@ -372,8 +401,8 @@ class SpaceRock(KeplerOrbit, Convenience):
         self.vz
 
         for time in np.sort(np.unique(pickup_times)):
-            ps = self[self.epoch.tdb.jd == time]
-            for x, y, z, vx, vy, vz, name in zip(ps.x.value, ps.y.value, ps.z.value, ps.vx.value, ps.vy.value, ps.vz.value, ps.name):
+            ps = self[pickup_times == time]
+            for x, y, z, vx, vy, vz, name in zip(ps.x.value, ps.y.value, ps.z.value, ps.vx.value, ps.vy.value, ps.vz.value, ps.name.tolist()):
                 sim.add(x=x, y=y, z=z, vx=vx, vy=vy, vz=vz, hash=name)
                 sim.integrate(time, exact_finish_time=1)
 
@@ -391,7 +420,7 @@ class SpaceRock(KeplerOrbit, Convenience):
 
         p_names = planet_names + [name for name in self.name]
 
-        for ii, time in enumerate(np.sort(epochs.tdb.jd)):
+        for ii, time in enumerate(np.sort(tdb_jd(epochs))):
             sim.integrate(time, exact_finish_time=1)
             a = np.zeros((sim.N, 3), dtype='float64')
             b = np.zeros((sim.N, 3), dtype='float64')
@@ -455,23 +484,59 @@ class SpaceRock(KeplerOrbit, Convenience):
 
         return rocks, planets, sim
 
+    def sample_clones(self, cov, n, seed=None):
+        '''
+        Draw n Monte-Carlo clones of every rock from a Gaussian in the 
+        Keplerian elements (a, e, inc, arg, node, M), in au and radians, 
+        around the current orbits. cov is either one 6x6 covariance matrix 
+        shared by all rocks or an (N, 6, 6) array with one per rock.
+
+        Returns a Clones object holding all clones in one array. 
+        '''
+        N = len(self)
+        cov = np.broadcast_to(cov, (N, 6, 6))
+
+        # Symmetric square roots, which also work for singular covariances 
+        # (e.g. elements that are held fixed).
+        w, v = np.linalg.eigh(cov)
+        L = v * np.sqrt(np.clip(w, 0, None))[:, None, :]
+
+        rng = np.random.default_rng(seed)
+        z = rng.standard_normal((n, N, 6))
+        elements = fast.elements(self)[:, None, :] + np.einsum('jik,njk->inj', L, z)
+
+        # An orbit with e < 0 is the orbit with -e, arg + pi and M + pi.
+        flip = elements[1] < 0
+        elements[1][flip] *= -1
+        elements[3][flip] += np.pi
+        elements[5][flip] += np.pi
+
+        # Keep the clones on the same side of e = 1 as the nominal orbit.
+        bound = np.broadcast_to(self.e < 1, elements[1].shape)
+        elements[1] = np.where(bound, np.minimum(elements[1], np.nextafter(1, 0)), np.maximum(elements[1], np.nextafter(1, 2)))
+
+        H = self.H if hasattr(self, 'H_func') else None
+        G = self.G if hasattr(self, 'G') else None
+
+        return Clones(elements, epoch=self.epoch, name=self.name, origin=self.origin, frame=self.frame, mu=self.mu.value, H=H, G=G)
+
     def calc_H(self, obscode):
         return self.__calc_H_from_mag(obscode=obscode)
 
     def __calc_H_from_mag(self, obscode):
         obs = self.observe(obscode=obscode)
 
-        e = earth.at(self.epoch)
-        s = sun.at(self.epoch)
+        s = sun.states(self.epoch)
+        es = earth.states(self.epoch) - s
 
-        x_helio = self.x - s.x
-        y_helio = self.y - s.y
-        z_helio = self.z - s.z
+        x_helio = self.x - s[:, 0] * u.au
+        y_helio = self.y - s[:, 1] * u.au
+        z_helio = self.z - s[:, 2] * u.au
 
         r_helio = Distance(np.sqrt(x_helio*x_helio + y_helio*y_helio + z_helio*z_helio).value, u.au)
-        earth_dist = ((e.x-s.x)**2 + (e.y-s.y)**2 + (e.z-s.z)**2)**0.5
+        earth_dist = (es[:, 0]**2 + es[:, 1]**2 + es[:, 2]**2)**0.5
 
-        q = (r_helio.au**2 + obs.delta.au**2 - earth_dist.value**2)/(2 * r_helio.au * obs.delta.au)
+        q = (r_helio.au**2 + obs.delta.au**2 - earth_dist**2)/(2 * r_helio.au * obs.delta.au)
 
         beta = np.arccos(q)
         beta[np.where(q <= -1)[0]] = np.pi * u.rad
@@ -502,16 +567,27 @@ class SpaceRock(KeplerOrbit, Convenience):
         Ephemerides can also be computed as observed from the Sun and the 
         solar system barycenter (ssb).
 
+        Observers can be mixed row by row, with obscode and spiceid arrays 
+        holding None where a row uses the other one, e.g. 
+        observe(obscode=['W84', None], spiceid=[None, 'HST']). All rows are 
+        still computed in one vectorized pass.
+
+        When observing many epochs from the same place, build an 
+        ObserverTable for it once and pass it as observer=table.
+
         The James Webb Space Telescope will be supported as soon as it launches
         and NASA provides the necessary spk files.
+
+        With raw=True, the ephemerides are computed in a single fused C pass 
+        and returned as a numpy structured array with the fields ra, dec, 
+        ra_rate, dec_rate (rad, rad/day), delta (au), phase_angle (rad) and 
+        mag (NaN if H is unknown) instead of an Ephemerides object.
         '''
 
-        if kwargs.get('obscode') is not None:
-            x, y, z, vx, vy, vz = self.xyz_to_tel(obscode=kwargs.get('obscode'))
-        elif kwargs.get('spiceid') is not None:
-            x, y, z, vx, vy, vz = self.xyz_to_tel(spiceid=kwargs.get('spiceid'))
-        else:
-            raise ValueError('Must pass either an obscode or spiceid.')
+        if kwargs.get('raw'):
+            return self.__observe_raw(**kwargs)
+
+        x, y, z, vx, vy, vz = self.xyz_to_tel(**kwargs)
 
         if not hasattr(self, 'H_func'):
             return Ephemerides(x=x, y=y, z=z, vx=vx, vy=vy, vz=vz, epoch=self.epoch, name=self.name)
@@ -519,6 +595,40 @@ class SpaceRock(KeplerOrbit, Convenience):
             return Ephemerides(x=x, y=y, z=z, vx=vx, vy=vy, vz=vz, epoch=self.epoch, name=self.name, H=self.H_func, G=self.G)
 
 
+    def __observe_raw(self, **kwargs):
+
+        observer = get_observer(utc_jd(self.epoch), **kwargs)
+
+        in_origin = copy.copy(self.origin)
+        self.to_bary()
+
+        in_frame = copy.copy(self.frame)
+        self.change_frame('eclipJ2000') 
+
+        s = sun.states(self.epoch)
+        H = self.H if hasattr(self, 'H_func') else np.full(len(self), np.nan)
+        G = self.G if hasattr(self, 'G') else np.full(len(self), 0.15)
+
+        observations = fused_observe(np.ascontiguousarray(self.a.au, dtype=np.float64), 
+                                     np.ascontiguousarray(self.e, dtype=np.float64), 
+                                     np.ascontiguousarray(self.inc.rad, dtype=np.float64), 
+                                     np.ascontiguousarray(self.arg.rad, dtype=np.float64), 
+                                     np.ascontiguousarray(self.node.rad, dtype=np.float64), 
+                                     np.ascontiguousarray(self.M.rad, dtype=np.float64), 
+                                     [observer.x.au, observer.y.au, observer.z.au, observer.vx.value, observer.vy.value, observer.vz.value], 
+                                     s[:, :3].T, 
+                                     H, 
+                                     G)
+
+        # Be polite
+        if in_origin != self.origin:
+            self.change_origin(in_origin)
+
+        if in_frame != self.frame:
+            self.change_frame(in_frame)
+
+        return observations
+
     def xyz_to_tel(self, **kwargs):
         '''
         Transform from barycentric ecliptic Cartesian coordinates to
@@ -527,12 +637,7 @@ class SpaceRock(KeplerOrbit, Convenience):
         Routine corrects iteratively for light travel time.
         '''
 
-        if kwargs.get('obscode') is not None:
-            observer = Observer(obscode=kwargs.get('obscode'), epoch=self.epoch.utc.jd)
-        elif kwargs.get('spiceid') is not None:
-            observer = Observer(spiceid=kwargs.get('spiceid'), epoch=self.epoch.utc.jd)
-        else:
-            raise ValueError('Must pass either an obscode or spiceid.')
+        observer = get_observer(utc_jd(self.epoch), **kwargs)
 
         in_origin = copy.copy(self.origin)
         self.to_bary()
@@ -562,145 +667,76 @@ class SpaceRock(KeplerOrbit, Convenience):
 
         return dx, dy, dz, dvx, dvy, dvz
 
-    def set_simulation(self, startdate, model):
+    def observe_grid(self, epochs, units=Units(), **kwargs) -> Ephemerides:
+        '''
+        Calculate the ephemerides of every SpaceRock at every epoch, 
+        as seen from a single observer (obscode, spiceid or observer).
+
+        The rocks are moved along their Keplerian orbits to each epoch, 
+        so this is equivalent to observing a copy of the object for each 
+        epoch, without making those copies. The ephemerides are ordered 
+        like the output of propagate: all rocks at the first epoch, then 
+        all rocks at the second epoch, and so on.
+        '''
 
-        sun = SpiceBody(spiceid='Sun')
-        mercury = SpiceBody(spiceid='Mercury Barycenter')
-        venus = SpiceBody(spiceid='Venus Barycenter')
-        earth = SpiceBody(spiceid='Earth')
-        moon = SpiceBody(spiceid='Moon')
-        mars = SpiceBody(spiceid='Mars Barycenter')
-        jupiter = SpiceBody(spiceid='Jupiter Barycenter')
-        saturn = SpiceBody(spiceid='Saturn Barycenter')
-        uranus = SpiceBody(spiceid='Uranus Barycenter')
-        neptune = SpiceBody(spiceid='Neptune Barycenter')
-        pluto = SpiceBody(spiceid='Pluto Barycenter')
-
-        M_sun = sun.mass.value
-        M_mercury = mercury.mass.value
-        M_venus = venus.mass.value
-        M_earth = earth.mass.value
-        M_moon = moon.mass.value
-        M_mars = mars.mass.value
-        M_jupiter = jupiter.mass.value
-        M_saturn = saturn.mass.value
-        M_uranus = uranus.mass.value
-        M_neptune = neptune.mass.value
-        M_pluto = pluto.mass.value
-
-        if model == 0:
-            active_bodies = [sun]
-            names = ['Sun']
-            M_sun += M_mercury + M_venus + M_earth + M_mars \
-                     + M_jupiter + M_saturn + M_uranus + M_neptune
-            masses = [M_sun]
-
-        elif model == 1:
-            active_bodies = [sun, jupiter, saturn, uranus, neptune]
-            names = ['Sun', 'Jupiter', 'Saturn', 'Uranus', 'Neptune']
-            M_sun += M_mercury + M_venus + M_earth + M_mars
-            masses = [M_sun, M_jupiter, M_saturn, M_uranus, M_neptune]
-
-
-        elif model == 2:
-            active_bodies = [sun, mercury, venus, earth, moon, mars, jupiter, saturn, uranus, neptune, pluto]
-            names = ['Sun', 'Mercury', 'Venus', 'Earth', 'Moon', 'Mars', 'Jupiter', 'Saturn', 'Uranus', 'Neptune', 'Pluto']
-            masses = [M_sun, M_mercury, M_venus, M_earth, M_moon, M_mars, M_jupiter, M_saturn, M_uranus, M_neptune, M_pluto]
-
-        elif model == 3:
-
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000001.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000002.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000003.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000004.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000007.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000010.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000015.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000016.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000031.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000052.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000065.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000087.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000088.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000107.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000511.bsp'))
-            spice.furnsh(os.path.join(SPICE_PATH, 'asteroids', '2000704.bsp'))
-
-            ceres = SpiceBody(spiceid='Ceres')
-            vesta = SpiceBody(spiceid='Vesta')
-            pallas = SpiceBody(spiceid='Pallas')
-            juno = SpiceBody(spiceid='2000003')
-            iris = SpiceBody(spiceid='2000007')
-            hygiea = SpiceBody(spiceid='2000010')
-            eunomia = SpiceBody(spiceid='2000015')
-            psyche = SpiceBody(spiceid='2000016')
-            euphrosyne = SpiceBody(spiceid='2000031')
-            europa = SpiceBody(spiceid='2000052')
-            cybele = SpiceBody(spiceid='2000065')
-            sylvia = SpiceBody(spiceid='2000087')
-            thisbe = SpiceBody(spiceid='2000088')
-            camilla = SpiceBody(spiceid='2000107')
-            davida = SpiceBody(spiceid='2000511')
-            interamnia = SpiceBody(spiceid='2000704')
-            
-            M_vesta = vesta.mass.value
-            M_ceres = ceres.mass.value
-            M_pallas = pallas.mass.value
-            M_juno = juno.mass.value
-            M_iris = iris.mass.value
-            M_hygiea = hygiea.mass.value
-            M_eunomia = eunomia.mass.value
-            M_psyche = psyche.mass.value
-            M_europa = europa.mass.value
-            M_cybele = cybele.mass.value
-            M_sylvia = sylvia.mass.value
-            M_thisbe = thisbe.mass.value
-            M_davida = davida.mass.value
-            M_interamnia = interamnia.mass.value
-            M_camilla = camilla.mass.value
-            M_euphrosyne = euphrosyne.mass.value
-
-            active_bodies = [sun, mercury, venus, earth, moon, mars, jupiter, saturn, uranus, neptune, pluto, 
-                             ceres, vesta, pallas, interamnia, juno, camilla, iris, hygiea, eunomia, psyche, 
-                             euphrosyne, europa, cybele, sylvia, thisbe, davida]
-            names = ['Sun', 'Mercury', 'Venus', 'Earth', 'Moon', 'Mars', 'Jupiter', 'Saturn', 'Uranus', 'Neptune', 'Pluto', 
-                     'Ceres', 'Vesta', 'Pallas', 'Interamnia', 'Juno', 'Camilla', 'Iris', 'Hygiea', 'Eunomia', 
-                     'Psyche', 'Euphrosyne', 'Europa', 'Cybele', 'Sylvia', 'Thisbe', 'Davida']
-            masses = [M_sun, M_mercury, M_venus, M_earth, M_moon, M_mars, M_jupiter, M_saturn, M_uranus, M_neptune, M_pluto, 
-                      M_ceres, M_vesta, M_pallas, M_interamnia, M_juno, M_camilla, M_iris, M_hygiea, M_eunomia, M_psyche, 
-                             M_euphrosyne, M_europa, M_cybele, M_sylvia, M_thisbe, M_davida]
+        epochs = self.detect_timescale(np.atleast_1d(epochs), units.timescale)
+        N = len(self)
+        T = len(epochs)
 
-        else:
-            raise ValueError('Model not recognized. Check the documentation.')
+        observer = get_observer(utc_jd(epochs), **kwargs)
+
+        in_origin = copy.copy(self.origin)
+        self.to_bary()
+
+        in_frame = copy.copy(self.frame)
+        self.change_frame('eclipJ2000') 
+
+        dx, dy, dz, dvx, dvy, dvz = correct_for_ltt_grid(self, observer, tdb_jd(epochs), raw=True)
+
+        # Be polite
+        if in_origin != self.origin:
+            self.change_origin(in_origin)
+
+        if in_frame != self.frame:
+            self.change_frame(in_frame)
 
-        startdate = Time(startdate, scale='tdb', format='jd')
+        # Transform to the equatorial frame, then attach units once
+        state = np.empty((6, N * T))
+        state[0] = dx.ravel()
+        state[1] = dy.ravel() * np.cos(epsilon) - dz.ravel() * np.sin(epsilon)
+        state[2] = dy.ravel() * np.sin(epsilon) + dz.ravel() * np.cos(epsilon)
+        state[3] = dvx.ravel()
+        state[4] = dvy.ravel() * np.cos(epsilon) - dvz.ravel() * np.sin(epsilon)
+        state[5] = dvy.ravel() * np.sin(epsilon) + dvz.ravel() * np.cos(epsilon)
+        x, y, z, vx, vy, vz = as_state(state)
 
-        bodies = [body.at(startdate) for body in active_bodies]
+        epoch = Time(np.repeat(tdb_jd(epochs), N), format='jd', scale='tdb')
+        name = np.tile(self.name, T)
 
-        # create a dataframe of the massive bodies in the solar system
-        ss = pd.DataFrame()
-        ss['x'] = [body.x.au[0] for body in bodies]
-        ss['y'] = [body.y.au[0] for body in bodies]
-        ss['z'] = [body.z.au[0] for body in bodies]
-        ss['vx'] = [body.vx.value[0] for body in bodies]
-        ss['vy'] = [body.vy.value[0] for body in bodies]
-        ss['vz'] = [body.vz.value[0] for body in bodies]
-        ss['mass'] = masses
-        ss['a'] = 1 / (2 / np.sqrt(ss.x**2 + ss.y**2 + ss.z**2) - (ss.vx**2 + ss.vy**2 + ss.vz**2) / mu_bary.value)
-        ss['hill_radius'] = ss.a * pow(ss.mass / (3 * M_sun), 1/3)
-        ss['name'] = names
+        if not hasattr(self, 'H_func'):
+            return Ephemerides(x=x, y=y, z=z, vx=vx, vy=vy, vz=vz, epoch=epoch, name=name)
+        else:
+            return Ephemerides(x=x, y=y, z=z, vx=vx, vy=vy, vz=vz, epoch=epoch, name=name, H=np.tile(self.H_func, T), G=np.tile(self.G, T))
+
+    def set_simulation(self, startdate, model):
+        '''
+        A rebound simulation holding the massive bodies of a model at a TDB
+        Julian date. The bodies come from the memoized perturbers(model,
+        startdate), so repeated calls skip the setup.
+        '''
+
+        bodies = perturbers(model, startdate)
+        names = list(bodies.names)
 
         sim = rebound.Simulation()
         sim.units = ('day', 'AU', 'Msun')
 
-        for p in ss.itertuples():
-            sim.add(x=p.x, y=p.y, z=p.z,
-                    vx=p.vx, vy=p.vy, vz=p.vz,
-                    m=p.mass, hash=p.name)
-
-        
+        for (x, y, z, vx, vy, vz), m, name in zip(bodies.states.T, bodies.masses, names):
+            sim.add(x=x, y=y, z=z,
+                    vx=vx, vy=vy, vz=vz,
+                    m=m, hash=name)
 
-        sim.N_active = len(ss)
+        sim.N_active = len(bodies)
 
         #if gr == True:
         #    rebx = reboundx.Extras(sim)
@@ -722,12 +758,7 @@ class SpaceRock(KeplerOrbit, Convenience):
         zs = []
 
         for r in self:
-            x, y, z, _, _, _ = kepM_to_xyz(np.repeat(r.a, N),
-                                           np.repeat(r.e, N),
-                                           np.repeat(r.inc.rad, N),
-                                           np.repeat(r.arg.rad, N),
-                                           np.repeat(r.node.rad, N),
-                                           M.rad)
+            x, y, z, _, _, _ = kepM_to_xyz(r.a.au, r.e, r.inc.rad, r.arg.rad, r.node.rad, M.rad)
             xs.append(x)
             ys.append(y)
             zs.append(z)
@@ -2,24 +2,47 @@
 #from .spacerock import SpaceRock
 
 from astropy import units as u
-from astropy.coordinates import Distance
+from astropy.time import Time
 
 import numpy as np
 
 from astropy.constants import G as GravitationalConstant
 
 import spiceypy as spice
-import os
+import functools
 
-import pkg_resources
+from . import spk
+from .spk import SPKLookupError
+from .timescales import utc_jd, utc_to_et
+from . import kernels
+from . import parallel
+from . import statecache
+
+
+# Conversions from GM in km^3/s^2 to mass in Msun and to GM in au^3/day^2.
+GM_TO_MSUN = (u.km**3 * u.s**(-2) / GravitationalConstant).to(u.Msun).value
+GM_TO_AU3_DAY2 = (u.km**3 * u.s**(-2)).to(u.au**3 / u.day**2)
+
+# Conversions of states from km and km/s to au and au/day.
+KM_TO_AU = u.km.to(u.au)
+KMS_TO_AU_DAY = (u.km / u.s).to(u.au / u.day)
+
+
+@functools.lru_cache(maxsize=None)
+def gm(spiceid):
+    '''
+    GM of a body in km^3/s^2, read from the kernel pool once per process.
+    '''
+    kernels.ensure_loaded()
+    return spice.bodvrd(str(spiceid), 'GM', 1)[1][0]
+
+
+def mass(spiceid):
+    '''
+    Mass of a body in Msun.
+    '''
+    return gm(spiceid) * GM_TO_MSUN
 
-SPICE_PATH = pkg_resources.resource_filename('spacerocks', 'data/spice')
-spice.furnsh(os.path.join(SPICE_PATH, 'latest_leapseconds.tls'))
-spice.furnsh(os.path.join(SPICE_PATH, 'de440s.bsp'))
-spice.furnsh(os.path.join(SPICE_PATH, 'hst.bsp'))
-spice.furnsh(os.path.join(SPICE_PATH, 'nh.bsp'))
-#spice.furnsh(os.path.join(SPICE_PATH, 'gm_de431.tpc'))
-spice.furnsh(os.path.join(SPICE_PATH, 'gm_Horizons.pck'))
 
 class SpiceBody:
 
@@ -35,29 +58,54 @@ class SpiceBody:
         Return a SpaceRock object at the specified epoch(s).
         '''
         from spacerocks.spacerock import SpaceRock
-        epoch = epoch.utc.jd
-        x, y, z, vx, vy, vz = self.__get_all_state_vectors(epoch)
+        epoch = utc_jd(epoch)
+        x, y, z, vx, vy, vz = self.states(epoch).T
         return SpaceRock(x=x, y=y, z=z, vx=vx, vy=vy, vz=vz, epoch=epoch, name=self.spiceid)
 
+    def states(self, epoch, out=None):
+        '''
+        States at the specified epoch(s), an astropy Time or UTC Julian 
+        dates, as an (N, 6) array of x, y, z (au) and vx, vy, vz (au/day). 
+        Much cheaper than at() when only the numbers are needed. If out 
+        is given, the states are written into it.
+        '''
+        if isinstance(epoch, Time):
+            epoch = utc_jd(epoch)
+        state = self.__get_all_state_vectors(epoch)
+
+        if out is None:
+            out = np.empty((state.shape[1], 6))
+        elif out.shape != (state.shape[1], 6) or out.dtype != np.float64:
+            raise ValueError('out must be a float64 array of shape {}.'.format((state.shape[1], 6)))
+        np.multiply(state[:3].T, KM_TO_AU, out=out[:, :3])
+        np.multiply(state[3:].T, KMS_TO_AU_DAY, out=out[:, 3:])
+        return out
+
     @property
     def mass(self):
         '''
         Return mass of the specified body.
         '''
-        return (spice.bodvrd(self.spiceid, 'GM', 1)[1][0] * u.km**3 * u.s**(-2) / GravitationalConstant).to(u.Msun)
+        return mass(self.spiceid) * u.Msun
 
     @property
     def mu(self):
         '''
         Return GM of the specified body.
         '''
-        return (spice.bodvrd(self.spiceid, 'GM', 1)[1][0] * u.km**3 * u.s**(-2)).to(u.au**3 / u.day**2) * u.radian**2
+        return gm(self.spiceid) * GM_TO_AU3_DAY2 * u.au**3 / u.day**2 * u.radian**2
 
     
     def __get_all_state_vectors(self, epoch):
         '''
         Very optimized way to get all state vectors from spice.
 
+        States already in the process-wide cache in statecache.py are 
+        reused. The rest are evaluated for all epochs at once by the reader 
+        in spk.py. Bodies it cannot handle fall back to calling spkezr 
+        once per unique (body, time) pair, in a pool of processes if 
+        the parallel backend is enabled, and otherwise as follows.
+
         The code is sort of convoluted, but it works and is several 
         times faster than any alternative without resorting to 
         using CSpice directly (don't want to deal with that).
@@ -73,33 +121,53 @@ class SpiceBody:
            all state vectors by reading from the dictionary. This is faster 
            than numpy indexing. The time complexity is O(1).
 
-        4. Set attributes using the usual astropy units.
-
+        Returns the states as a (6, N) array in km and km/s.
         '''
 
         epoch = np.atleast_1d(epoch)
         spiceid = np.atleast_1d(self.spiceid)
+        if len(spiceid) < len(epoch):
+            spiceid = np.repeat(spiceid, len(epoch))
+
+        # Bodies with SPKs in the pool are loaded on demand, as many at a
+        # time as the pool holds.
+        pool = kernels.pool()
+        bodies = np.unique(spiceid)
+        if len(bodies) > pool.capacity:
+            states = np.empty((6, len(epoch)))
+            for k in range(0, len(bodies), pool.capacity):
+                mask = np.isin(spiceid, bodies[k:k + pool.capacity])
+                states[:, mask] = self.__get_states(spiceid[mask], epoch[mask])
+            return states
+        return self.__get_states(spiceid, epoch)
+
+
+    def __get_states(self, spiceid, epoch):
+        '''
+        States in km and km/s, from the state cache where possible.
+        '''
+        return statecache.cache().states(np.asarray(spiceid).astype(str), epoch, self.frame, self.origin, self.__compute_states)
 
-        unique_rocks_and_times = set(list(zip(spiceid, epoch)))
-        unique_dict = {key:self.__state_from_spice(key) for key in unique_rocks_and_times}
-        x, y, z, vx, vy, vz = np.array([unique_dict[(body, time)] for body, time in zip(spiceid, epoch)]).T
-       
-        x = Distance(x, u.km, allow_negative=True).to(u.au)
-        y = Distance(y, u.km, allow_negative=True).to(u.au)
-        z = Distance(z, u.km, allow_negative=True).to(u.au)
-
-        vx = (vx * u.km/u.s).to(u.au / u.day)
-        vy = (vy * u.km/u.s).to(u.au / u.day)
-        vz = (vz * u.km/u.s).to(u.au / u.day)
-
-        return x.au, y.au, z.au, vx.value, vy.value, vz.value
-
+    def __compute_states(self, spiceid, epoch):
+        '''
+        States in km and km/s, from the vectorized reader if it can, and
+        otherwise from spkezr.
+        '''
+        kernels.pool().require(list(np.unique(spiceid)) + [self.origin])
+        try:
+            return spk.states(spiceid, epoch, frame=self.frame, origin=self.origin)
+        except SPKLookupError:
+            if parallel.enabled():
+                return parallel.states(spiceid, epoch, frame=self.frame, origin=self.origin)
+            unique_rocks_and_times = set(list(zip(spiceid, epoch)))
+            unique_dict = {key:self.__state_from_spice(key) for key in unique_rocks_and_times}
+            return np.array([unique_dict[(body, time)] for body, time in zip(spiceid, epoch)]).T
 
     def __compute_ephemeris_time(self, epoch):
         '''
-        Wrapper for spiceypy's str2et function.
+        Ephemeris time of a UTC Julian date.
         '''
-        return spice.str2et('JD{} UTC'.format(epoch))
+        return utc_to_et(epoch)
 
 
     def __state_from_spice(self, x):
@@ -108,5 +176,6 @@ class SpiceBody:
         '''
         spiceid, epoch = x
         ephemeris_time = self.__compute_ephemeris_time(epoch)
+        kernels.ensure_loaded()
         state, _ = spice.spkezr(spiceid, ephemeris_time, self.frame, 'none', self.origin)
         return state
\ No newline at end of file
@@ -0,0 +1,299 @@
+'''
+Vectorized reader for SPK ephemeris kernels.
+
+SpiceBody and Observer used to call spice.spkezr once per unique (body,
+epoch) pair. For large sets of epochs the per-call overhead dominates, so
+this module reads the Chebyshev segments (SPK types 2 and 3) of the kernels
+directly and evaluates them for whole arrays of epochs with numpy. Bodies
+whose centers are not the solar system barycenter are chained through their
+centers, e.g. Earth = (Earth - EMB) + (EMB - SSB).
+
+Segments are searched in the same order as CSPICE: later kernels first, and
+within a kernel the last segment first. Anything this reader cannot
+evaluate (other segment types, non-J2000 segments, unknown bodies or
+missing coverage) raises SPKLookupError, and the callers then fall back to
+spice.spkezr, which handles it or raises its usual error.
+
+The reader follows the SPKs of the kernel manager in kernels, and SPKs
+furnished with spiceypy directly too, in the same priority as SPICE.
+
+States are in km and km/s, like spkezr.
+'''
+
+import os
+
+import numpy as np
+import spiceypy as spice
+
+from .constants import frames
+from .timescales import utc_to_et
+from . import kernels
+
+J2000_FRAME = 1
+SUPPORTED_TYPES = (2, 3)
+CHUNK = 65536
+
+
+class SPKLookupError(LookupError):
+    pass
+
+
+class Segment:
+
+    '''
+    One Chebyshev segment of an SPK file. The coefficient records are a
+    read-only view into a memory map of the file.
+    '''
+
+    def __init__(self, target, center, frame, type, start, end, data, path=None):
+        self.path = path
+        self.target = target
+        self.center = center
+        self.frame = frame
+        self.type = type
+        self.start = start
+        self.end = end
+
+        if type in SUPPORTED_TYPES:
+            init, intlen, rsize, n = data[-4:]
+            self.init = init
+            self.intlen = intlen
+            rsize, n = int(rsize), int(n)
+            self.records = data[:rsize * n].reshape(n, rsize)
+            ncomponents = 3 if type == 2 else 6
+            self.ncoeff = (rsize - 2) // ncomponents
+
+    def evaluate(self, et):
+        '''
+        Evaluate the segment at an array of ephemeris times. Returns a
+        (6, N) array of states relative to the center.
+        '''
+        if self.type not in SUPPORTED_TYPES:
+            raise SPKLookupError('SPK type {} is not supported.'.format(self.type))
+
+        # Gathering the records is the memory bottleneck, so do it in chunks.
+        if len(et) > CHUNK:
+            return np.concatenate([self.evaluate(et[k:k + CHUNK]) for k in range(0, len(et), CHUNK)], axis=1)
+
+        n = len(self.records)
+        index = np.clip(((et - self.init) // self.intlen).astype(np.int64), 0, n - 1)
+        records = self.records[index]
+
+        s = (et - records[:, 0]) / records[:, 1]
+        K = self.ncoeff
+
+        # Chebyshev polynomials and their derivatives, by recurrence.
+        T = np.empty((K, len(et)))
+        dT = np.empty((K, len(et)))
+        T[0], dT[0] = 1, 0
+        if K > 1:
+            T[1], dT[1] = s, 1
+        for k in range(2, K):
+            T[k] = 2 * s * T[k - 1] - T[k - 2]
+            dT[k] = 2 * T[k - 1] + 2 * s * dT[k - 1] - dT[k - 2]
+
+        state = np.empty((6, len(et)))
+        for c in range(3):
+            coeffs = records[:, 2 + c * K:2 + (c + 1) * K]
+            state[c] = np.einsum('nk,kn->n', coeffs, T)
+            if self.type == 2:
+                state[3 + c] = np.einsum('nk,kn->n', coeffs, dT) / records[:, 1]
+            else:
+                state[3 + c] = np.einsum('nk,kn->n', records[:, 2 + (3 + c) * K:2 + (4 + c) * K], T)
+
+        return state
+
+
+def read_segments(path):
+    '''
+    Read the segment summaries of a DAF/SPK file. Returns the segments in
+    file order.
+    '''
+    with open(path, 'rb') as f:
+        record = f.read(1024)
+
+    if not record[:7] == b'DAF/SPK':
+        raise ValueError('{} is not an SPK file.'.format(path))
+
+    endian = '<' if record[88:96] == b'LTL-IEEE' else '>'
+    nd, ni = np.frombuffer(record[8:16], dtype=endian + 'i4')
+    fward = int(np.frombuffer(record[76:80], dtype=endian + 'i4')[0])
+    summary_size = nd + (ni + 1) // 2
+
+    words = np.memmap(path, dtype=endian + 'f8', mode='r')
+
+    segments = []
+    current = fward
+    while current > 0:
+        summary = words[(current - 1) * 128:current * 128]
+        next_record, nsum = int(summary[0]), int(summary[2])
+        for k in range(nsum):
+            s = summary[3 + k * summary_size:3 + (k + 1) * summary_size]
+            start, end = s[:nd]
+            target, center, frame, type, first, last = np.frombuffer(s[nd:].tobytes(), dtype=endian + 'i4')[:ni]
+            segments.append(Segment(int(target), int(center), int(frame), int(type), start, end, words[first - 1:last], path))
+        current = next_record
+
+    return segments
+
+
+class SPKReader:
+
+    '''
+    A set of SPK files, searched like CSPICE searches its loaded kernels.
+    '''
+
+    def __init__(self, paths=()):
+        self.paths = []
+        self.segments = {}
+        self.codes = {}
+        for path in paths:
+            self.load(path)
+
+    def load(self, path):
+        '''
+        Add an SPK file. Its segments take priority over those of the
+        files loaded before it.
+        '''
+        for segment in read_segments(path):
+            self.segments.setdefault(segment.target, []).insert(0, segment)
+        self.paths.append(path)
+
+    def unload(self, path):
+        '''
+        Remove the segments of an SPK file.
+        '''
+        for target in list(self.segments):
+            self.segments[target] = [segment for segment in self.segments[target] if segment.path != path]
+            if not self.segments[target]:
+                del self.segments[target]
+        self.paths.remove(path)
+
+    def sync(self, paths):
+        '''
+        Match the files of the reader to paths (in load order), loading and
+        unloading only the files that differ.
+        '''
+        for path in [path for path in self.paths if path not in paths]:
+            self.unload(path)
+        if self.paths != [path for path in paths if path in self.paths]:
+            for path in list(self.paths):
+                self.unload(path)
+        for path in paths:
+            if path not in self.paths:
+                self.load(path)
+
+    def code(self, body):
+        '''
+        NAIF ID code of a body given by name or number.
+        '''
+        if body not in self.codes:
+            kernels.ensure_loaded()
+            try:
+                self.codes[body] = spice.bods2c(str(body))
+            except Exception:
+                raise SPKLookupError('Unknown body {}.'.format(body))
+        return self.codes[body]
+
+    def barycentric(self, target, et):
+        '''
+        J2000 state of the body with NAIF ID target relative to the solar
+        system barycenter, as a (6, N) array in km and km/s.
+        '''
+        state = np.zeros((6, len(et)))
+        if target == 0:
+            return state
+
+        found = np.zeros(len(et), dtype=bool)
+        for segment in self.segments.get(target, []):
+            mask = ~found & (et >= segment.start) & (et <= segment.end)
+            if not mask.any():
+                continue
+            if segment.frame != J2000_FRAME:
+                raise SPKLookupError('Segments in frame {} are not supported.'.format(segment.frame))
+            state[:, mask] = segment.evaluate(et[mask])
+            if segment.center != 0:
+                state[:, mask] += self.barycentric(segment.center, et[mask])
+            found |= mask
+            if found.all():
+                return state
+
+        raise SPKLookupError('No ephemeris data for body {} at {} of the epochs.'.format(target, (~found).sum()))
+
+    def state(self, body, et, frame='ECLIPJ2000', origin='ssb'):
+        '''
+        State of body relative to origin at ephemeris times et, rotated to
+        one of the frames in constants.frames. Returns a (6, N) array in km
+        and km/s.
+        '''
+        et = np.atleast_1d(np.asarray(et, dtype=np.float64))
+        if frame.upper() not in frames:
+            raise SPKLookupError('Unknown frame {}.'.format(frame))
+
+        state = self.barycentric(self.code(body), et)
+        origin = self.code(origin)
+        if origin != 0:
+            state -= self.barycentric(origin, et)
+
+        rotation = np.asarray(frames[frame.upper()])
+        state[:3] = rotation @ state[:3]
+        state[3:] = rotation @ state[3:]
+        return state
+
+
+_reader = None
+_reader_version = None
+
+
+def furnished_spks():
+    '''
+    Paths of the SPKs loaded in SPICE, in load order.
+    '''
+    return [os.path.abspath(spice.kdata(k, 'SPK')[0]) for k in range(spice.ktotal('SPK'))]
+
+
+def default_reader():
+    '''
+    The reader for the loaded SPKs, kept in sync with them. These are the
+    SPKs of the kernel manager, unless SPKs were loaded or unloaded with
+    spiceypy directly, in which case they are read from SPICE in its
+    load order.
+    '''
+    global _reader, _reader_version
+    if _reader is None:
+        _reader = SPKReader()
+    kernels.ensure_loaded()
+    version = kernels.manager().version
+    paths = kernels.manager().spks()
+    count = spice.ktotal('SPK')
+    if count != len(paths) or (count and os.path.abspath(spice.kdata(count - 1, 'SPK')[0]) != paths[-1]):
+        paths = furnished_spks()
+        version = (version, tuple(paths))
+    if _reader_version != version:
+        _reader.sync(paths)
+        _reader_version = version
+    return _reader
+
+
+def states(spiceid, epoch, frame='ECLIPJ2000', origin='ssb'):
+    '''
+    States of bodies at UTC Julian dates, as a (6, N) array in km and km/s.
+    spiceid is a single body or one body per epoch. Each unique (body,
+    epoch) pair is evaluated once.
+    '''
+    reader = default_reader()
+    epoch = np.atleast_1d(epoch)
+    spiceid = np.atleast_1d(spiceid)
+    if len(spiceid) < len(epoch):
+        spiceid = np.repeat(spiceid, len(epoch))
+
+    unique_epochs, epoch_index = np.unique(epoch, return_inverse=True)
+    et = utc_to_et(unique_epochs)
+
+    out = np.empty((6, len(epoch)))
+    for body in np.unique(spiceid):
+        mask = spiceid == body
+        needed, inverse = np.unique(epoch_index[mask], return_inverse=True)
+        out[:, mask] = reader.state(body, et[needed], frame=frame, origin=origin)[:, inverse]
+
+    return out
@@ -0,0 +1,243 @@
+'''
+Process-wide cache of the SPICE states computed by SpiceBody and Observer.
+
+A pipeline asks for the states of the Sun, the Earth and the barycenter at
+the same epochs many times over (change_origin, xyz_to_tel, estimate_mag,
+calc_H, ...). The cache keeps every state it has computed, keyed on
+(spiceid, frame, origin, ephemeris time), so each is computed once.
+
+The states of one (spiceid, frame, origin) are kept in arrays sorted by
+ephemeris time, so whole arrays of epochs are looked up with a binary
+search. Each entry records the query that last used it. When the cache
+grows beyond its byte budget, the least recently used entries are evicted
+until it is back under budget.
+
+When an SPK is loaded or unloaded through the kernel manager, e.g. by the
+SPK pool, only the states of the bodies it covers, and of the bodies whose
+segments are chained through them, are dropped. Everything is dropped when
+all kernels are unloaded.
+
+    from spacerocks import statecache
+    statecache.cache().budget = 2**30
+    statecache.cache().stats()
+'''
+
+import functools
+
+import numpy as np
+
+from . import kernels
+from . import spk
+from .timescales import utc_to_et
+
+BUDGET = 64 * 2**20
+
+# An entry is an epoch, a state and the tick of its last use.
+ENTRY_BYTES = 8 * (1 + 6 + 1)
+
+
+class StateCache:
+
+    '''
+    States (km and km/s) of (spiceid, frame, origin) at ephemeris times,
+    with least recently used eviction under a budget in bytes. A budget of
+    0 turns the cache off.
+    '''
+
+    def __init__(self, budget=BUDGET):
+        self.budget = budget
+        self.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        '''
+        Drop every cached state.
+        '''
+        self.tables = {}
+        self.tick = 0
+        self.version = kernels.manager().version
+
+    def __len__(self):
+        return sum(len(et) for et, _, _ in self.tables.values())
+
+    @property
+    def nbytes(self):
+        return len(self) * ENTRY_BYTES
+
+    def lookup(self, key, et):
+        '''
+        Cached states of key at ephemeris times et. Returns a mask of the
+        hits and a (6, N) array filled where they hit.
+        '''
+        out = np.empty((6, len(et)))
+        if key not in self.tables:
+            return np.zeros(len(et), dtype=bool), out
+
+        cached, states, used = self.tables[key]
+        index = np.minimum(np.searchsorted(cached, et), len(cached) - 1)
+        hit = cached[index] == et
+        out[:, hit] = states[:, index[hit]]
+        used[index[hit]] = self.tick
+        return hit, out
+
+    def insert(self, key, et, states):
+        '''
+        Add the states of key at ephemeris times et, which are not cached.
+        '''
+        et, first = np.unique(et, return_index=True)
+        states = states[:, first]
+        used = np.full(len(et), self.tick)
+        if key in self.tables:
+            cached, cached_states, cached_used = self.tables[key]
+            et = np.concatenate([cached, et])
+            states = np.concatenate([cached_states, states], axis=1)
+            used = np.concatenate([cached_used, used])
+            order = np.argsort(et, kind='stable')
+            et, states, used = et[order], states[:, order], used[order]
+        self.tables[key] = (et, states, used)
+
+    def evict(self):
+        '''
+        Drop the least recently used entries until the cache fits its
+        budget.
+        '''
+        excess = len(self) - self.budget // ENTRY_BYTES
+        if excess <= 0:
+            return
+        ticks = np.concatenate([used for _, _, used in self.tables.values()])
+        # Entries last used before the cutoff go, and some of those used
+        # at the cutoff, oldest query first.
+        cutoff = np.partition(ticks, excess - 1)[excess - 1]
+        quota = excess - (ticks < cutoff).sum()
+        for key in list(self.tables):
+            et, states, used = self.tables[key]
+            keep = used > cutoff
+            at_cutoff = np.flatnonzero(used == cutoff)
+            keep[at_cutoff[quota:]] = True
+            quota = max(quota - len(at_cutoff), 0)
+            self.evictions += len(et) - keep.sum()
+            if keep.any():
+                self.tables[key] = (et[keep], states[:, keep], used[keep])
+            else:
+                del self.tables[key]
+
+    def sync(self):
+        '''
+        Drop the states of the bodies covered by the SPKs loaded or
+        unloaded since the last call.
+        '''
+        manager = kernels.manager()
+        if self.version == manager.version:
+            return
+        paths = manager.changed_since(self.version)
+        codes = None if paths is None else affected(paths)
+        if codes is None:
+            self.clear()
+            return
+
+        self.version = manager.version
+        for key in list(self.tables):
+            body, _, origin = key
+            if {kernels.pool().code(body), kernels.pool().code(origin)} & (codes | {None}):
+                del self.tables[key]
+
+    def states(self, spiceid, epoch, frame, origin, compute):
+        '''
+        States of bodies at UTC Julian dates, as a (6, N) array in km and
+        km/s. spiceid has one body per epoch. compute(spiceid, epoch) is
+        called once, for the rows that miss.
+        '''
+        if self.budget <= 0:
+            return compute(spiceid, epoch)
+        kernels.ensure_loaded()
+        self.sync()
+
+        self.tick += 1
+        et = utc_to_et(epoch)
+        out = np.empty((6, len(epoch)))
+        missing = np.zeros(len(epoch), dtype=bool)
+        bodies = np.unique(spiceid)
+        for body in bodies:
+            mask = spiceid == body
+            hit, states = self.lookup((body, frame, origin), et[mask])
+            out[:, mask] = states
+            missing[np.flatnonzero(mask)[~hit]] = True
+
+        self.hits += len(epoch) - missing.sum()
+        self.misses += missing.sum()
+        if not missing.any():
+            return out
+
+        computed = np.asarray(compute(spiceid[missing], epoch[missing]), dtype=np.float64)
+        out[:, missing] = computed
+
+        # compute may have loaded the SPKs of the bodies it was asked for.
+        self.sync()
+        for body in np.unique(spiceid[missing]):
+            mask = spiceid[missing] == body
+            self.insert((body, frame, origin), et[missing][mask], computed[:, mask])
+        self.evict()
+        return out
+
+    def stats(self):
+        '''
+        Counts of hits, misses and evictions (in states), and the number
+        and size of the cached states.
+        '''
+        return {'hits': int(self.hits), 'misses': int(self.misses), 'evictions': int(self.evictions),
+                'entries': len(self), 'bytes': self.nbytes, 'budget': self.budget}
+
+
+@functools.lru_cache(maxsize=None)
+def targets(path):
+    '''
+    NAIF IDs of the bodies with segments in an SPK.
+    '''
+    return frozenset(segment.target for segment in spk.read_segments(path))
+
+
+def affected(paths):
+    '''
+    NAIF IDs of the bodies whose states can change when the SPKs at paths
+    are loaded or unloaded: their targets, and the bodies with segments
+    relative to those, as far down as the chains go. None if an SPK cannot
+    be read.
+    '''
+    try:
+        codes = set().union(*[targets(path) for path in paths])
+    except (OSError, ValueError):
+        return None
+
+    centers = {target: {segment.center for segment in segments}
+               for target, segments in spk.default_reader().segments.items()}
+    grown = True
+    while grown:
+        grown = False
+        for target, around in centers.items():
+            if target not in codes and around & codes:
+                codes.add(target)
+                grown = True
+    return codes
+
+
+_cache = None
+
+
+def cache():
+    '''
+    The process-wide state cache.
+    '''
+    global _cache
+    if _cache is None:
+        _cache = StateCache()
+    return _cache
+
+
+def invalidate():
+    '''
+    Drop every cached state, e.g. after loading kernels with spiceypy
+    directly.
+    '''
+    cache().clear()
@@ -0,0 +1,279 @@
+import unittest
+from spacerocks import fast, ufuncs
+from spacerocks.cbindings import _check_grid
+from spacerocks.cbindings import kepM_to_xyz, calc_kep_from_xyz, calc_E_from_M, propagate_kepler, kep_jacobian, stm_kepler, set_threads, get_threads
+
+import numpy as np
+
+class TestCBindings(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        N = 100
+        self.a = rng.uniform(1, 50, N)
+        self.e = rng.uniform(0, 0.9, N)
+        self.inc = rng.uniform(0, np.pi, N)
+        self.arg = rng.uniform(0, 2 * np.pi, N)
+        self.node = rng.uniform(0, 2 * np.pi, N)
+        self.M = rng.uniform(0, 2 * np.pi, N)
+
+    def test_output_buffer(self):
+
+        N = len(self.a)
+        x, y, z, vx, vy, vz = kepM_to_xyz(self.a, self.e, self.inc, self.arg, self.node, self.M)
+
+        out = np.empty((6, N))
+        for _ in range(3):
+            xo, yo, zo, vxo, vyo, vzo = kepM_to_xyz(self.a, self.e, self.inc, self.arg, self.node, self.M, out=out)
+
+        self.assertTrue(np.shares_memory(xo.value, out))
+        self.assertTrue(np.array_equal(x.value, out[0]))
+        self.assertTrue(np.array_equal(vz.value, out[5]))
+
+        a, e, inc, arg, node, f = calc_kep_from_xyz(0.00029630927493457475, x.au, y.au, z.au, vx.value, vy.value, vz.value)
+        self.assertTrue(np.allclose(a.au, self.a))
+        self.assertTrue(np.allclose(e, self.e))
+
+        E = np.empty(N)
+        calc_E_from_M(self.e, self.M, out=E)
+        self.assertTrue(np.allclose(E - self.e * np.sin(E), self.M))
+
+        with self.assertRaises(ValueError):
+            kepM_to_xyz(self.a, self.e, self.inc, self.arg, self.node, self.M, out=np.empty((N, 6)))
+        with self.assertRaises(ValueError):
+            kepM_to_xyz(self.a, self.e, self.inc, self.arg, self.node, self.M, out=np.empty((6, N), dtype=np.float32))
+
+    def test_threads(self):
+
+        rng = np.random.default_rng(7)
+        N = 10007
+        a = rng.uniform(1, 50, N)
+        e = rng.uniform(0, 0.9, N)
+        angles = [rng.uniform(0, 2 * np.pi, N) for _ in range(4)]
+
+        serial = np.empty((6, N))
+        parallel = np.empty((6, N))
+        kepM_to_xyz(a, e, *angles, out=serial, threads=1)
+        kepM_to_xyz(a, e, *angles, out=parallel, threads=4)
+        self.assertTrue(np.array_equal(serial, parallel))
+
+        calc_kep_from_xyz(0.00029630927493457475, *serial, out=parallel, threads=3)
+        self.assertTrue(np.allclose(parallel[0], a))
+
+        default = get_threads()
+        set_threads(2)
+        self.assertEqual(get_threads(), 2)
+        set_threads(default)
+        with self.assertRaises(ValueError):
+            set_threads(0)
+
+    def test_kepler_solver(self):
+
+        rng = np.random.default_rng(3)
+        N = 5000
+        e = np.concatenate([rng.uniform(0, 1, N), 1 - 10**rng.uniform(-8, -1, N)])
+        M = rng.uniform(-20, 20, 2 * N)
+        for tol in ['precise', 'screening', 1e-10]:
+            E = calc_E_from_M(e, M, tol=tol).rad
+            self.assertLess(np.abs(E - e * np.sin(E) - M).max(), 1e-8)
+        E = calc_E_from_M(e, M, tol='precise').rad
+        self.assertLess(np.abs(E - e * np.sin(E) - M).max(), 1e-13)
+
+        e = 1 + 10**rng.uniform(-6, 2, N)
+        M = 10**rng.uniform(-6, 3, N) * rng.choice([-1, 1], N)
+        E = calc_E_from_M(e, M, tol='precise').rad
+        self.assertLess(np.max(np.abs(e * np.sinh(E) - E - M) / np.maximum(1, np.abs(M))), 1e-13)
+
+        with self.assertRaises(ValueError):
+            calc_E_from_M(e, M, tol='sloppy')
+
+    def test_propagate_kepler(self):
+
+        mu = 0.00029630927493457475
+        x, y, z, vx, vy, vz = kepM_to_xyz(self.a, self.e, self.inc, self.arg, self.node, self.M)
+        epoch0 = np.full(len(self.a), 2459000.5)
+        epochs = np.array([2459000.5, 2458000.5, 2459123.25, 2470000.5])
+
+        states = propagate_kepler(mu, x.au, y.au, z.au, vx.value, vy.value, vz.value, epoch0, epochs)
+        self.assertEqual(states[0].shape, (len(epochs), len(self.a)))
+
+        n = np.sqrt(mu / self.a**3)
+        for t, epoch in enumerate(epochs):
+            M = self.M + n * (epoch - epoch0)
+            expected = kepM_to_xyz(self.a, self.e, self.inc, self.arg, self.node, M)
+            for state, truth in zip(states, expected):
+                self.assertTrue(np.allclose(state[t].value, truth.value, rtol=1e-9, atol=1e-12))
+
+        # Hyperbolic and near-parabolic orbits take the other branches of the 
+        # universal-variable solver.
+        rng = np.random.default_rng(5)
+        N = len(self.a)
+        for eccentricity in [1.5, 1.02, 1.0001, 0.99999]:
+            e = np.full(N, eccentricity)
+            a = rng.uniform(0.5, 5, N) / (1 - e)
+            M = rng.uniform(-0.5, 0.5, N) * (1 if eccentricity > 1 else 1e-3)
+            n = np.sqrt(mu / np.abs(a)**3)
+            x, y, z, vx, vy, vz = kepM_to_xyz(a, e, self.inc, self.arg, self.node, M)
+            states = propagate_kepler(mu, x.au, y.au, z.au, vx.value, vy.value, vz.value, epoch0, epochs)
+            for t, epoch in enumerate(epochs):
+                expected = kepM_to_xyz(a, e, self.inc, self.arg, self.node, M + n * (epoch - epoch0))
+                for state, truth in zip(states, expected):
+                    self.assertTrue(np.allclose(state[t].value, truth.value, rtol=1e-9, atol=1e-12))
+
+    def test_grid_size(self):
+
+        # Grids past 2^31 states are indexed with 64-bit integers, and grids 
+        # that do not fit even those are refused.
+        _check_grid(1200000, 365)
+        with self.assertRaises(ValueError):
+            _check_grid(2**40, 2**30)
+
+    def test_raw(self):
+
+        x, y, z, vx, vy, vz = kepM_to_xyz(self.a, self.e, self.inc, self.arg, self.node, self.M)
+        state = kepM_to_xyz(self.a, self.e, self.inc, self.arg, self.node, self.M, raw=True)
+        self.assertIsInstance(state, np.ndarray)
+        self.assertEqual(state.shape, (6, len(self.a)))
+        self.assertTrue(np.array_equal(state[0], x.au))
+        self.assertTrue(np.array_equal(state[5], vz.value))
+
+        block = fast.kepM_to_xyz(list(self.a), self.e, self.inc, self.arg, self.node, np.stack([self.M, self.M], axis=1)[:, 0])
+        self.assertTrue(np.array_equal(block, state))
+
+        elements = fast.calc_kep_from_xyz(0.00029630927493457475, *block)
+        self.assertTrue(np.allclose(elements[0], self.a))
+        self.assertTrue(np.allclose(elements[1], self.e))
+
+        E = fast.calc_E_from_M(self.e, self.M)
+        self.assertTrue(np.allclose(fast.calc_M_from_E(self.e, E), self.M))
+
+        xq, _, _, _, _, vzq = fast.as_state(block)
+        self.assertTrue(np.shares_memory(xq.value, block))
+        self.assertEqual(vzq.unit, vz.unit)
+
+    def test_broadcasting(self):
+
+        # One orbit traced at many anomalies, without expanding its elements.
+        N = len(self.M)
+        traced = fast.kepM_to_xyz(self.a[0], self.e[0], self.inc[0], self.arg[0], self.node[0], self.M)
+        expanded = fast.kepM_to_xyz(*[np.full(N, q[0]) for q in [self.a, self.e, self.inc, self.arg, self.node]], self.M)
+        self.assertTrue(np.array_equal(traced, expanded))
+
+        single = fast.kepM_to_xyz(self.a[0], self.e[0], self.inc[0], self.arg[0], self.node[0], self.M, dtype=np.float32)
+        self.assertLess(np.abs(single - traced).max() / np.abs(traced).max(), 2e-6)
+
+        # Many orbits seen by a single observer.
+        observer = [1, 0, 0, 0, 0.0172, 0]
+        shared = fast.correct_for_ltt(self.a, self.e, self.inc, self.arg, self.node, self.M, *observer)
+        full = fast.correct_for_ltt(self.a, self.e, self.inc, self.arg, self.node, self.M, *np.outer(observer, np.ones(N)))
+        self.assertTrue(np.array_equal(shared, full))
+
+        E = fast.calc_E_from_M(0.5, self.M)
+        self.assertTrue(np.array_equal(E, fast.calc_E_from_M(np.full(N, 0.5), self.M)))
+
+        with self.assertRaises(ValueError):
+            fast.kepM_to_xyz(self.a[:3], self.e, self.inc, self.arg, self.node, self.M)
+
+    def test_single_precision(self):
+
+        x, y, z, vx, vy, vz = kepM_to_xyz(self.a, self.e, self.inc, self.arg, self.node, self.M, raw=True)
+        state = kepM_to_xyz(self.a, self.e, self.inc, self.arg, self.node, self.M, raw=True, dtype=np.float32)
+        self.assertEqual(state.dtype, np.float32)
+
+        r = np.sqrt(x**2 + y**2 + z**2)
+        v = np.sqrt(vx**2 + vy**2 + vz**2)
+        self.assertLess((np.sqrt(((state[:3] - [x, y, z])**2).sum(axis=0)) / r).max(), 2e-6)
+        self.assertLess((np.sqrt(((state[3:] - [vx, vy, vz])**2).sum(axis=0)) / v).max(), 2e-6)
+
+        E = calc_E_from_M(self.e, self.M + 40 * np.pi, dtype=np.float32, raw=True)
+        self.assertEqual(E.dtype, np.float32)
+        self.assertLess(np.abs(np.sin(E - calc_E_from_M(self.e, self.M, raw=True))).max(), 1e-6)
+
+        observer = np.ones((6, len(self.a))) * [[1], [0], [0], [0], [0.0172], [0]]
+        d64 = fast.correct_for_ltt(self.a, self.e, self.inc, self.arg, self.node, self.M, *observer)
+        d32 = fast.correct_for_ltt(self.a, self.e, self.inc, self.arg, self.node, self.M, *observer, dtype=np.float32)
+        u64 = d64[:3] / np.sqrt((d64[:3]**2).sum(axis=0))
+        u32 = d32[:3] / np.sqrt((d32[:3]**2).sum(axis=0))
+        self.assertLess(np.degrees(np.sqrt(((u64 - u32)**2).sum(axis=0)).max()) * 3600, 0.5)
+
+        with self.assertRaises(ValueError):
+            kepM_to_xyz(self.a, self.e, self.inc, self.arg, self.node, self.M, dtype=np.float16)
+        with self.assertRaises(ValueError):
+            kepM_to_xyz(self.a, self.e, self.inc, self.arg, self.node, self.M, out=np.empty((6, len(self.a))), dtype=np.float32)
+
+    def test_partials(self):
+
+        mu = 0.00029630927493457475
+        elements = np.array([self.a, self.e, self.inc, self.arg, self.node, self.M])
+        J = kep_jacobian(mu, *elements)
+        self.assertEqual(J.shape, (len(self.a), 6, 6))
+
+        for j in range(6):
+            h = 1e-6 * np.maximum(np.abs(elements[j]), 1e-2)
+            plus, minus = elements.copy(), elements.copy()
+            plus[j] += h
+            minus[j] -= h
+            diff = (fast.kepM_to_xyz(*plus) - fast.kepM_to_xyz(*minus)) / (2 * h)
+            self.assertTrue(np.allclose(J[:, :, j].T, diff, rtol=1e-6, atol=1e-8 * np.abs(diff).max()))
+
+        state = fast.kepM_to_xyz(*elements)
+        epoch0 = np.zeros(len(self.a))
+        for dt in [-700, 30000]:
+            phi = stm_kepler(mu, *state, dt)
+            for j in range(6):
+                h = 1e-6 * np.maximum(np.abs(state[j]), 1e-4)
+                plus, minus = state.copy(), state.copy()
+                plus[j] += h
+                minus[j] -= h
+                diff = (fast.propagate_kepler(mu, *plus, epoch0, [dt])[:, 0] - fast.propagate_kepler(mu, *minus, epoch0, [dt])[:, 0]) / (2 * h)
+                self.assertLess(np.abs(phi[:, :, j].T - diff).max() / np.abs(diff).max(), 1e-5)
+
+            # The flow is symplectic.
+            omega = np.block([[np.zeros((3, 3)), np.eye(3)], [-np.eye(3), np.zeros((3, 3))]])
+            residual = np.einsum('nji,jk,nkl->nil', phi, omega, phi) - omega
+            self.assertLess(np.abs(residual).max() / np.abs(phi).max()**2, 1e-14)
+
+    def test_ufuncs(self):
+
+        elements = np.array([self.a, self.e, self.inc, self.arg, self.node, self.M])
+        state = fast.kepM_to_xyz(*elements)
+        self.assertTrue(np.array_equal(ufuncs.kepM_to_xyz(*elements), state))
+
+        # Strided rows of an (N, 6) table, and broadcasting against a grid of anomalies.
+        table = elements.T.copy()
+        self.assertTrue(np.array_equal(ufuncs.kepM_to_xyz(*table.T), state))
+        M = np.linspace(0, 2 * np.pi, 5)
+        grid = ufuncs.kepM_to_xyz(*elements[:5, :, None], M)
+        self.assertEqual(grid[0].shape, (len(self.a), 5))
+        self.assertTrue(np.array_equal(grid[2][:, 3], fast.kepM_to_xyz(*elements[:5], np.full(len(self.a), M[3]))[2]))
+
+        out = np.empty((6, len(self.a)))
+        ufuncs.kepM_to_xyz(*elements, out=tuple(out))
+        self.assertTrue(np.array_equal(out, state))
+
+        kep = ufuncs.calc_kep_from_xyz(0.00029630927493457475, *out)
+        self.assertTrue(np.array_equal(np.array(kep), fast.calc_kep_from_xyz(0.00029630927493457475, *state)))
+
+        E = ufuncs.calc_E_from_M(self.e, self.M)
+        self.assertTrue(np.array_equal(E, fast.calc_E_from_M(self.e, self.M)))
+        self.assertTrue(np.allclose(ufuncs.calc_M_from_E(self.e, E), self.M))
+        self.assertTrue(np.allclose(ufuncs.calc_E_from_f(self.e, ufuncs.calc_f_from_E(self.e, E)), E))
+
+        single = ufuncs.kepM_to_xyz(*elements.astype(np.float32))
+        self.assertEqual(single[0].dtype, np.float32)
+        self.assertLess(np.abs(single[0] - state[0]).max() / np.abs(state[0]).max(), 1e-5)
+
+        # The float32 loops reduce the angles like the float32 path of cbindings, 
+        # so large mean anomalies keep the same error budget.
+        rng = np.random.default_rng(11)
+        a, e = self.a.astype(np.float32), self.e.astype(np.float32)
+        angles = [rng.uniform(-1000, 1000, len(self.a)).astype(np.float32) for _ in range(4)]
+        single = np.array(ufuncs.kepM_to_xyz(a, e, *angles))
+        self.assertTrue(np.array_equal(single, fast.kepM_to_xyz(a, e, *angles, dtype=np.float32)))
+        double = fast.kepM_to_xyz(a, e, *angles)
+        self.assertLess((np.abs(single[:3] - double[:3]).max(axis=0) / np.abs(double[:3]).max(axis=0)).max(), 1.1e-6)
+        self.assertTrue(np.array_equal(ufuncs.calc_E_from_M(e, angles[3]), fast.calc_E_from_M(e, angles[3], dtype=np.float32)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+from spacerocks import SpaceRock
+from spacerocks.columns import Columns
+from spacerocks.units import Units
+
+import numpy as np
+
+class TestColumns(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        N = 100
+        units = Units()
+        units.timescale = 'tdb'
+        self.rocks = SpaceRock(a=rng.uniform(2, 50, N), e=rng.uniform(0, 0.5, N), inc=rng.uniform(0, 40, N), 
+                               node=rng.uniform(0, 360, N), arg=rng.uniform(0, 360, N), M=rng.uniform(0, 360, N), 
+                               epoch=rng.uniform(2459600.5, 2459900.5, N), origin='ssb', units=units)
+
+    def test_views(self):
+
+        columns = self.rocks.to_columns()
+        self.assertEqual(columns.state.shape, (100, 6))
+        self.assertTrue(np.array_equal(columns.id, np.arange(100)))
+        self.assertEqual(columns.nbytes, 100 * 64)
+
+        rocks = SpaceRock.from_columns(columns)
+        for k, coord in enumerate(['x', 'y', 'z', 'vx', 'vy', 'vz']):
+            self.assertTrue(np.shares_memory(getattr(rocks, coord).value, columns.state))
+            self.assertTrue(np.array_equal(getattr(rocks, coord).value, getattr(self.rocks, coord).value))
+        self.assertTrue(np.allclose(rocks.a.au, self.rocks.a.au, rtol=1e-12))
+        self.assertIs(rocks.to_columns(), columns)
+
+        # Slices stay views, and changing the state detaches the block.
+        part = rocks[10:20]
+        self.assertTrue(np.shares_memory(part.to_columns().state, columns.state))
+        self.assertTrue(np.array_equal(part.name, np.arange(10, 20)))
+        rocks.to_helio()
+        self.assertIsNot(rocks.to_columns(), columns)
+        self.assertEqual(rocks.to_columns().origin, 'sun')
+
+    def test_single(self):
+
+        columns = self.rocks.to_columns()
+        one = SpaceRock.from_columns(columns)[3].to_columns()
+        self.assertEqual(one.state.shape, (1, 6))
+        self.assertTrue(np.array_equal(one.state, columns.state[3:4]))
+        self.assertTrue(np.array_equal(one.id, [3]))
+
+        one = self.rocks[3].to_columns()
+        self.assertEqual(len(one), 1)
+        self.assertTrue(np.array_equal(one.state, columns.state[3:4]))
+        self.assertEqual(one.epoch[0], columns.epoch[3])
+
+    def test_no_copy(self):
+
+        state = np.random.default_rng(0).normal(size=(50, 6))
+        epoch = np.full(50, 2459600.5)
+        ids = np.arange(1000, 1050)
+        columns = Columns(state, epoch, ids)
+        self.assertIs(columns.state, state)
+        self.assertIs(columns.epoch, epoch)
+        self.assertIs(columns.id, ids)
+
+        with self.assertRaises(ValueError):
+            Columns(state.T, epoch, ids)
+        with self.assertRaises(ValueError):
+            Columns(state, epoch[:10], ids)
+
+    def test_observe(self):
+
+        rocks = SpaceRock.from_columns(self.rocks.to_columns())
+        obs = rocks.observe(obscode='W84')
+        expected = self.rocks.observe(obscode='W84')
+        self.assertTrue(np.allclose(obs.ra.deg, expected.ra.deg, rtol=0, atol=1e-9))
+        self.assertTrue(np.allclose(obs.dec.deg, expected.dec.deg, rtol=0, atol=1e-9))
+
+
+if __name__ == '__main__':
+    unittest.main()
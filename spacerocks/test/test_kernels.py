@@ -0,0 +1,81 @@
+import unittest
+from spacerocks import kernels, spk
+from spacerocks.spice import SpiceBody
+
+import os
+
+import numpy as np
+import spiceypy as spice
+from astropy.time import Time
+
+class TestKernels(unittest.TestCase):
+
+    def test_register(self):
+
+        kernels.ensure_loaded()
+        kernels.ensure_loaded()
+        self.assertEqual(spice.ktotal('ALL'), len(kernels.loaded()))
+
+        path = os.path.join(kernels.SPICE_PATH, 'asteroids', '2000029.bsp')
+        self.assertEqual(kernels.register(path), path)
+        kernels.register(path)
+        self.assertEqual(kernels.loaded().count(path), 1)
+        self.assertEqual(spice.ktotal('ALL'), len(kernels.loaded()))
+        self.assertIn(path, spk.default_reader().paths)
+
+        kernels.unload(path)
+        self.assertNotIn(path, kernels.loaded())
+        self.assertNotIn(path, spk.default_reader().paths)
+        self.assertEqual(spice.ktotal('ALL'), len(kernels.loaded()))
+
+        with self.assertRaises(FileNotFoundError):
+            kernels.register('missing.bsp')
+        self.assertEqual(spice.ktotal('ALL'), len(kernels.loaded()))
+
+    def test_furnsh(self):
+
+        # SPKs furnished without the kernel manager are read too, last.
+        kernels.ensure_loaded()
+        kernels.pool().clear()
+        path = os.path.join(kernels.SPICE_PATH, 'asteroids', '2000031.bsp')
+        spice.furnsh(path)
+        try:
+            self.assertEqual(spk.default_reader().paths[-1], path)
+            self.assertIn(2000031, spk.default_reader().segments)
+        finally:
+            spice.unload(path)
+        self.assertNotIn(path, spk.default_reader().paths)
+        self.assertEqual(spk.default_reader().paths, kernels.manager().spks())
+
+    def test_pool(self):
+
+        pool = kernels.pool()
+        pool.clear()
+        capacity = pool.capacity
+        pool.capacity = 2
+        try:
+            epoch = Time([2459600.5, 2459601.5], format='jd', scale='tdb')
+            for body in ['Ceres', 'Vesta', '2000003', 'Ceres']:
+                states = SpiceBody(spiceid=body).at(epoch)
+            stats = pool.stats()
+            self.assertEqual((stats['misses'], stats['evictions'], stats['loaded']), (4, 2, 2))
+
+            # A new epoch, so that the state cache does not answer for the pool.
+            SpiceBody(spiceid='Ceres').at(Time([2459602.5], format='jd', scale='tdb'))
+            self.assertEqual(pool.stats()['hits'], stats['hits'] + 1)
+
+            et = spice.str2et('JD{} TDB'.format(epoch.jd[0]))
+            truth = spice.spkezr('Ceres', et, 'ECLIPJ2000', 'none', 'ssb')[0]
+            self.assertLess(abs(states.x.au[0] - truth[0] / 149597870.7), 1e-12)
+
+            # More pooled bodies than the pool holds are done in batches.
+            rocks = SpiceBody(spiceid=np.array(['Ceres', 'Vesta', 'Pallas', '2000003'])).at(Time(np.full(4, 2459600.5), format='jd', scale='tdb'))
+            self.assertEqual(len(rocks), 4)
+            self.assertLessEqual(pool.stats()['loaded'], 2)
+            self.assertEqual(spice.ktotal('ALL'), len(kernels.loaded()))
+        finally:
+            pool.capacity = capacity
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+from spacerocks.observatories import observatories, build, CSV_PATH
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+class TestObservatories(unittest.TestCase):
+
+    def test_lookup(self):
+
+        table = observatories()
+        csv = pd.read_csv(CSV_PATH)
+        self.assertEqual(len(table), len(csv))
+
+        codes = np.array(['W84', '500', 'I41', 'W84', '000'])
+        sites = table.lookup(codes)
+        self.assertTrue(np.array_equal(sites['obscode'], codes))
+        for code, site in zip(codes, sites):
+            row = csv[csv.obscode == code]
+            self.assertAlmostEqual(site['lat'], row.lat.values[0])
+            self.assertAlmostEqual(site['lon'], row.lon.values[0])
+            self.assertAlmostEqual(site['elevation'], row.elevation.values[0])
+
+        # The geocenter is at the center of the Earth.
+        self.assertLess(abs(table.lookup('500')['rho_cos'][0]), 1e-9)
+
+        with self.assertRaises(ValueError):
+            table.lookup(['W84', 'XXX'])
+
+    def test_build(self):
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'observatories.npy')
+            build(path=path)
+            self.assertTrue(np.array_equal(np.load(path), observatories().data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from spacerocks import parallel
+from spacerocks.observer import Observer
+
+import numpy as np
+
+class TestParallel(unittest.TestCase):
+
+    def test_states(self):
+
+        # New Horizons is a type 1 segment, which is left to spkezr.
+        epochs = np.random.default_rng(4).uniform(2458600.5, 2460600.5, 200)
+        epochs[100:] = epochs[:100]
+        serial = Observer(spiceid='-98', epoch=epochs)
+
+        min_pairs = parallel.MIN_PAIRS
+        parallel.MIN_PAIRS = 10
+        parallel.enable(2)
+        try:
+            self.assertTrue(parallel.enabled())
+            pooled = Observer(spiceid='-98', epoch=epochs)
+            states = parallel.states(['-98', 'Earth'], epochs[:2], origin='Sun')
+        finally:
+            parallel.disable()
+            parallel.MIN_PAIRS = min_pairs
+
+        self.assertFalse(parallel.enabled())
+        for coord in ['x', 'y', 'z', 'vx', 'vy', 'vz']:
+            self.assertTrue(np.array_equal(getattr(pooled, coord), getattr(serial, coord)))
+        self.assertTrue(np.array_equal(states, parallel.states(['-98', 'Earth'], epochs[:2], origin='Sun')))
+
+
+if __name__ == '__main__':
+    unittest.main()
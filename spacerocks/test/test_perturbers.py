@@ -0,0 +1,38 @@
+import unittest
+from spacerocks.perturbers import perturbers
+from spacerocks.spice import SpiceBody, gm
+
+import numpy as np
+from astropy.time import Time
+
+class TestPerturbers(unittest.TestCase):
+
+    def test_perturbers(self):
+
+        epoch = 2459600.5
+        bodies = perturbers(2, epoch)
+        self.assertIs(perturbers(2, epoch), bodies)
+        self.assertIsNot(perturbers(2, epoch + 1), bodies)
+        self.assertEqual(len(bodies), 11)
+        self.assertFalse(bodies.states.flags.writeable)
+
+        jupiter = SpiceBody(spiceid='Jupiter Barycenter')
+        k = bodies.names.index('Jupiter')
+        self.assertAlmostEqual(bodies.masses[k], jupiter.mass.value, places=15)
+        state = jupiter.at(Time(epoch, scale='tdb', format='jd'))
+        self.assertTrue(np.allclose(bodies.states[:, k], [state.x.au[0], state.y.au[0], state.z.au[0], 
+                                                          state.vx.value[0], state.vy.value[0], state.vz.value[0]], rtol=0, atol=1e-15))
+
+        # The masses of the planets are added to the Sun.
+        self.assertAlmostEqual(perturbers(0, epoch).masses[0], bodies.masses[:11].sum() - bodies.masses[4] - bodies.masses[10], places=15)
+
+        hits = gm.cache_info().hits
+        jupiter.mass
+        self.assertEqual(gm.cache_info().hits, hits + 1)
+
+        with self.assertRaises(ValueError):
+            perturbers(4, epoch)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 import unittest
 from spacerocks import SpaceRock, Units
+from spacerocks.observer import Observer, ObserverTable
+from spacerocks.ephemerides import Ephemerides
+from spacerocks.spice import SpiceBody
 
 import numpy as np
 
@@ -260,7 +263,160 @@ class TestSpacerock(unittest.TestCase):
         with self.assertRaises(ValueError): 
             SpaceRock(a=40, e=1.5, inc=5, node=14, M=10, arg=100)
 
-        
+    def test_observe_grid(self):
+
+        units = Units()
+        units.timescale = 'tdb'
+        rocks = SpaceRock(a=[44, 3], e=[0.1, 0.5], inc=[10, 4], node=[140, 2], arg=[109, 3], M=[98, 4], 
+                          H=[7, 8], epoch=[2459500.5, 2459600.5], origin='ssb', units=units)
+        epochs = [2459500.5, 2459700.5, 2460000.5]
+
+        grid = rocks.observe_grid(epochs, obscode='W84', units=units)
+        obs = rocks.propagate_kepler(epochs, units=units).observe(obscode='W84')
+
+        self.assertEqual(len(grid), 6)
+        self.assertTrue(np.array_equal(grid.name, obs.name))
+        self.assertTrue(np.allclose(grid.epoch.tdb.jd, obs.epoch.tdb.jd))
+        self.assertTrue(np.allclose(grid.ra.deg, obs.ra.deg, rtol=0, atol=1e-9))
+        self.assertTrue(np.allclose(grid.dec.deg, obs.dec.deg, rtol=0, atol=1e-9))
+        self.assertTrue(np.allclose(grid.mag, obs.mag))
+
+    def test_observer_table(self):
+
+        table = ObserverTable(2459600.5, 2459610.5, obscode='W84')
+        epochs = np.random.default_rng(3).uniform(2459600.5, 2459610.5, 100)
+        interpolated = table.at(epochs)
+        observer = Observer(obscode='W84', epoch=epochs)
+        for coord in ['x', 'y', 'z']:
+            self.assertLess(np.abs(getattr(interpolated, coord) - getattr(observer, coord)).to(u.m).value.max(), 1)
+
+        # The site velocities include the rotation of the Earth, so they
+        # interpolate as the derivatives of the positions.
+        for coord in ['vx', 'vy', 'vz']:
+            self.assertLess(np.abs(getattr(interpolated, coord) - getattr(observer, coord)).to(u.m / u.s).value.max(), 1e-2)
+
+        with self.assertRaises(ValueError):
+            table.at(2459611.5)
+
+        units = Units()
+        units.timescale = 'utc'
+        rocks = SpaceRock(a=[44, 3], e=[0.1, 0.5], inc=[10, 4], node=[140, 2], arg=[109, 3], M=[98, 4], 
+                          H=[7, 8], epoch=epochs[:2], origin='ssb', units=units)
+        obs = rocks.observe(obscode='W84')
+        tabulated = rocks.observe(observer=table)
+        self.assertTrue(np.allclose(tabulated.ra.deg, obs.ra.deg, rtol=0, atol=1e-9))
+        self.assertTrue(np.allclose(tabulated.dec.deg, obs.dec.deg, rtol=0, atol=1e-9))
+
+    def test_observe_mixed(self):
+
+        epochs = np.linspace(2459000.5, 2459100.5, 6)
+        obscode = np.array(['W84', None, '500', None, 'W84', None], dtype=object)
+        spiceid = np.array([None, 'HST', None, '-98', None, 'Earth'], dtype=object)
+        mixed = Observer(obscode=obscode, spiceid=spiceid, epoch=epochs)
+
+        for k in range(len(epochs)):
+            if obscode[k] is not None:
+                single = Observer(obscode=obscode[k], epoch=epochs[k:k+1])
+            else:
+                single = Observer(spiceid=spiceid[k], epoch=epochs[k:k+1])
+            for coord in ['x', 'y', 'z', 'vx', 'vy', 'vz']:
+                self.assertEqual(getattr(mixed, coord)[k], getattr(single, coord)[0])
+
+        with self.assertRaises(ValueError):
+            Observer(obscode=['W84', None], spiceid=['HST', None], epoch=epochs[:2])
+
+        units = Units()
+        units.timescale = 'utc'
+        rocks = SpaceRock(a=[44, 3], e=[0.1, 0.5], inc=[10, 4], node=[140, 2], arg=[109, 3], M=[98, 4], 
+                          H=[7, 8], epoch=epochs[:2], origin='ssb', units=units)
+        obs = rocks.observe(obscode=['W84', None], spiceid=[None, 'HST'])
+        self.assertAlmostEqual(obs.ra.deg[0], rocks[0].observe(obscode='W84').ra.deg[0], places=9)
+        self.assertAlmostEqual(obs.ra.deg[1], rocks[1].observe(spiceid='HST').ra.deg[0], places=9)
+
+
+    def test_observe_raw(self):
+
+        units = Units()
+        units.timescale = 'tdb'
+        rng = np.random.default_rng(0)
+        N = 50
+        rocks = SpaceRock(a=rng.uniform(2, 50, N), e=rng.uniform(0, 0.5, N), inc=rng.uniform(0, 40, N), 
+                          node=rng.uniform(0, 360, N), arg=rng.uniform(0, 360, N), M=rng.uniform(0, 360, N), 
+                          H=rng.uniform(5, 10, N), epoch=rng.uniform(2459600.5, 2459900.5, N), origin='sun', units=units)
+
+        obs = rocks.observe(obscode='W84')
+        raw = rocks.observe(obscode='W84', raw=True)
+
+        self.assertEqual(rocks.origin, 'sun')
+        self.assertEqual(raw.dtype.names, ('ra', 'dec', 'ra_rate', 'dec_rate', 'delta', 'phase_angle', 'mag'))
+        self.assertTrue(np.allclose(raw['ra'], obs.ra.rad, rtol=0, atol=1e-12))
+        self.assertTrue(np.allclose(raw['dec'], obs.dec.rad, rtol=0, atol=1e-12))
+        self.assertTrue(np.allclose(raw['ra_rate'], obs.ra_rate.value, rtol=1e-10))
+        self.assertTrue(np.allclose(raw['dec_rate'], obs.dec_rate.value, rtol=1e-10))
+        self.assertTrue(np.allclose(raw['delta'], obs.delta.au, rtol=1e-12))
+        self.assertTrue(np.all((raw['phase_angle'] >= 0) & (raw['phase_angle'] < np.pi)))
+        self.assertTrue(np.all(raw['mag'] > rocks.H))
+
+        # Both paths use the same phase angle, up to the observatory's offset 
+        # from the geocenter.
+        self.assertTrue(np.allclose(raw['mag'], obs.mag, rtol=0, atol=1e-3))
+
+        rocks = SpaceRock(a=[40], e=[0.1], inc=[5], node=[14], arg=[10], M=[10], epoch=[2459600.5], units=units)
+        self.assertTrue(np.isnan(rocks.observe(spiceid='Earth', raw=True)['mag'][0]))
+
+    def test_estimate_mag(self):
+
+        # Rocks at known heliocentric ecliptic positions, seen from the geocenter.
+        rng = np.random.default_rng(4)
+        N = 50
+        epoch = Time(np.full(N, 2459600.5), format='jd', scale='tdb')
+        rock = rng.uniform(-3, 3, (3, N))
+        earth = SpiceBody(spiceid='Earth').states(epoch) - SpiceBody(spiceid='Sun').states(epoch)
+        d = rock - earth[:, :3].T
+
+        epsilon = np.radians(84381.448 / 3600)
+        rotation = np.array([[1, 0, 0], [0, np.cos(epsilon), -np.sin(epsilon)], [0, np.sin(epsilon), np.cos(epsilon)]])
+        x, y, z = rotation @ d
+        H, G = rng.uniform(5, 20, N), np.full(N, 0.15)
+        ephem = Ephemerides(x=x * u.au, y=y * u.au, z=z * u.au, vx=np.zeros(N) * u.au / u.day, vy=np.zeros(N) * u.au / u.day, 
+                            vz=np.zeros(N) * u.au / u.day, epoch=epoch, name=np.arange(N), 
+                            H=np.array([lambda _, h=h: h for h in H]), G=G)
+
+        # The phase angle is the angle between the rock-Sun and rock-observer vectors.
+        r = np.linalg.norm(rock, axis=0)
+        delta = np.linalg.norm(d, axis=0)
+        beta = np.arccos(np.sum(rock * d, axis=0) / (r * delta))
+        psi_1 = np.exp(-3.332 * np.tan(beta / 2)**0.631)
+        psi_2 = np.exp(-1.862 * np.tan(beta / 2)**1.218)
+        mag = H + 5 * np.log10(r * delta) - 2.5 * np.log10((1 - G) * psi_1 + G * psi_2)
+
+        self.assertTrue(np.allclose(ephem.estimate_mag(), mag, rtol=0, atol=1e-9))
+
+    def test_clones(self):
+
+        units = Units()
+        units.timescale = 'tdb'
+        rng = np.random.default_rng(1)
+        N = 10
+        rocks = SpaceRock(a=rng.uniform(2, 50, N), e=rng.uniform(0, 0.5, N), inc=rng.uniform(0, 40, N), 
+                          node=rng.uniform(0, 360, N), arg=rng.uniform(0, 360, N), M=rng.uniform(0, 360, N), 
+                          H=rng.uniform(5, 10, N), epoch=np.full(N, 2459600.5), origin='sun', frame='J2000', units=units)
+        nominal = rocks.observe(obscode='W84', raw=True)
+
+        clones = rocks.sample_clones(np.zeros((6, 6)), 3)
+        self.assertEqual(clones.elements.shape, (6, 3, N))
+        obs = clones.observe(obscode='W84')
+        self.assertEqual(obs.shape, (3, N))
+        self.assertTrue(np.allclose(obs['ra'], nominal['ra'], rtol=0, atol=1e-12))
+        self.assertTrue(np.allclose(obs['dec'], nominal['dec'], rtol=0, atol=1e-12))
+
+        cov = np.diag([1e-8, 1e-10, 1e-12, 1e-10, 1e-10, 1e-10])
+        small = rocks.sample_clones(cov, 500, seed=2).ellipses(obscode='W84')
+        large = rocks.sample_clones(4 * cov, 500, seed=2).ellipses(obscode='W84')
+        self.assertTrue(np.allclose(large['sigma_major'], 2 * small['sigma_major'], rtol=1e-3))
+        self.assertTrue(np.allclose(large['position_angle'], small['position_angle'], atol=1e-3))
+        self.assertTrue(np.all(small['sigma_major'] >= small['sigma_minor']))
+        self.assertTrue(np.allclose(small['ra'], nominal['ra'], rtol=0, atol=5 * small['sigma_major']))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,30 @@
+import unittest
+from spacerocks.spice import SpiceBody
+
+import numpy as np
+from astropy.time import Time
+
+class TestSpice(unittest.TestCase):
+
+    def test_states(self):
+
+        epochs = Time(np.linspace(2459000.5, 2460000.5, 50), format='jd', scale='tdb')
+        earth = SpiceBody(spiceid='Earth')
+        rock = earth.at(epochs)
+
+        states = earth.states(epochs)
+        self.assertEqual(states.shape, (50, 6))
+        self.assertTrue(np.array_equal(states, np.array([rock.x.au, rock.y.au, rock.z.au, 
+                                                         rock.vx.value, rock.vy.value, rock.vz.value]).T))
+
+        out = np.empty((50, 6))
+        self.assertIs(earth.states(epochs, out=out), out)
+        self.assertTrue(np.array_equal(out, states))
+        self.assertTrue(np.array_equal(earth.states(rock.epoch.utc.jd), states))
+
+        with self.assertRaises(ValueError):
+            earth.states(epochs, out=np.empty((6, 50)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+from spacerocks import kernels, spk
+
+import numpy as np
+import spiceypy as spice
+
+class TestSPK(unittest.TestCase):
+
+    def setUp(self):
+        kernels.ensure_loaded()
+
+    def test_states(self):
+
+        rng = np.random.default_rng(11)
+        epochs = rng.uniform(2442000, 2470000, 200)
+        epochs[:50] = epochs[50:100]
+
+        for body, origin, frame in [('Earth', 'ssb', 'ECLIPJ2000'),
+                                    ('Moon', 'Earth', 'J2000'),
+                                    ('Jupiter Barycenter', 'Sun', 'ECLIPJ2000')]:
+            states = spk.states(body, epochs, frame=frame, origin=origin)
+            truth = np.array([spice.spkezr(body, spice.str2et('JD{} UTC'.format(epoch)), frame, 'none', origin)[0] for epoch in epochs]).T
+            self.assertLess(np.abs(states[:3] - truth[:3]).max(), 1e-3)
+            self.assertLess(np.abs(states[3:] - truth[3:]).max(), 1e-9)
+
+        bodies = np.where(np.arange(len(epochs)) % 2, 'Earth', 'Sun')
+        mixed = spk.states(bodies, epochs)
+        self.assertTrue(np.array_equal(mixed[:, 1::2], spk.states('Earth', epochs[1::2])))
+        self.assertTrue(np.array_equal(mixed[:, ::2], spk.states('Sun', epochs[::2])))
+
+        # New Horizons is a type 1 segment, which is left to spkezr.
+        with self.assertRaises(spk.SPKLookupError):
+            spk.states('-98', epochs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+from spacerocks import kernels, statecache
+from spacerocks.statecache import StateCache, ENTRY_BYTES
+from spacerocks.spk import states
+from spacerocks.spice import SpiceBody
+
+import numpy as np
+
+class TestStateCache(unittest.TestCase):
+
+    def setUp(self):
+        kernels.ensure_loaded()
+        self.calls = []
+
+    def compute(self, spiceid, epoch):
+        self.calls.append(len(epoch))
+        return states(spiceid, epoch, frame='ECLIPJ2000', origin='ssb')
+
+    def test_hits(self):
+
+        cache = StateCache()
+        epoch = np.linspace(2459000.5, 2459100.5, 100)
+        spiceid = np.array(['Earth', 'Sun'] * 50)
+
+        first = cache.states(spiceid, epoch, 'ECLIPJ2000', 'ssb', self.compute)
+        second = cache.states(spiceid, epoch, 'ECLIPJ2000', 'ssb', self.compute)
+        self.assertTrue(np.array_equal(first, second))
+        self.assertTrue(np.array_equal(first, self.compute(spiceid, epoch)))
+        self.assertEqual(self.calls, [100, 100])
+
+        # Only the new rows are computed.
+        epoch = np.concatenate([epoch, [2459200.5]])
+        spiceid = np.append(spiceid, 'Earth')
+        third = cache.states(spiceid, epoch, 'ECLIPJ2000', 'ssb', self.compute)
+        self.assertEqual(self.calls[-1], 1)
+        self.assertTrue(np.array_equal(third[:, :100], first))
+        self.assertEqual(cache.stats()['hits'], 200)
+        self.assertEqual(cache.stats()['misses'], 101)
+
+    def test_evict(self):
+
+        cache = StateCache(budget=50 * ENTRY_BYTES)
+        old = np.linspace(2459000.5, 2459010.5, 40)
+        new = np.linspace(2459020.5, 2459030.5, 40)
+        spiceid = np.array(['Earth'] * 40)
+
+        cache.states(spiceid, old, 'ECLIPJ2000', 'ssb', self.compute)
+        cache.states(spiceid, new, 'ECLIPJ2000', 'ssb', self.compute)
+        self.assertEqual(len(cache), 50)
+        self.assertEqual(cache.stats()['evictions'], 30)
+
+        # The newest query survives.
+        cache.states(spiceid, new, 'ECLIPJ2000', 'ssb', self.compute)
+        self.assertEqual(cache.stats()['hits'], 40)
+
+    def test_invalidate(self):
+
+        cache = statecache.cache()
+        statecache.invalidate()
+        epoch = np.linspace(2459000.5, 2459100.5, 10)
+        cache.states(np.array(['Earth'] * 10), epoch, 'ECLIPJ2000', 'ssb', self.compute)
+        self.assertGreater(len(cache), 0)
+
+        kernels.unload()
+        cache.states(np.array(['Earth'] * 10), epoch, 'ECLIPJ2000', 'ssb', self.compute)
+        self.assertEqual(self.calls, [10, 10])
+
+        statecache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+    def test_pooled(self):
+
+        cache = statecache.cache()
+        pool = kernels.pool()
+        pool.clear()
+        capacity = pool.capacity
+        pool.capacity = 1
+        try:
+            earth = SpiceBody(spiceid='Earth')
+            epoch = np.linspace(2459000.5, 2459100.5, 100)
+            earth.states(epoch)
+
+            # Loading and evicting pooled SPKs keeps the states of other bodies.
+            SpiceBody(spiceid='Ceres').states(epoch[:1])
+            SpiceBody(spiceid='Vesta').states(epoch[:1])
+            hits = cache.hits
+            earth.states(epoch)
+            self.assertEqual(cache.hits - hits, 100)
+
+            # The evicted body is computed again.
+            self.assertFalse(any(key[0] == 'Ceres' for key in cache.tables))
+            self.assertTrue(any(key[0] == 'Vesta' for key in cache.tables))
+        finally:
+            pool.capacity = capacity
+
+    def test_disabled(self):
+
+        cache = StateCache(budget=0)
+        epoch = np.linspace(2459000.5, 2459100.5, 10)
+        cache.states(np.array(['Earth'] * 10), epoch, 'ECLIPJ2000', 'ssb', self.compute)
+        cache.states(np.array(['Earth'] * 10), epoch, 'ECLIPJ2000', 'ssb', self.compute)
+        self.assertEqual(self.calls, [10, 10])
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from spacerocks import kernels, timescales
+
+import numpy as np
+import spiceypy as spice
+from astropy.time import Time
+
+class TestTimescales(unittest.TestCase):
+
+    def setUp(self):
+        kernels.ensure_loaded()
+
+    def test_utc_to_et(self):
+
+        rng = np.random.default_rng(5)
+        epochs = rng.uniform(2430000, 2470000, 1000)
+
+        # Around the first leap second, and the last one in the kernel.
+        epochs[:4] = [2441317.5, 2441317.4999, 2457754.5, 2457754.49999]
+
+        et = timescales.utc_to_et(epochs)
+        truth = np.array([spice.str2et('JD{} UTC'.format(epoch)) for epoch in epochs])
+        self.assertLess(np.abs(et - truth).max(), 1e-4)
+
+        self.assertLess(np.abs(timescales.et_to_utc(et) - epochs).max() * 86400, 1e-4)
+
+        # A TDB Julian date only resolves ~40 microseconds, so instants right
+        # at a leap second can round to the other side of it.
+        tdb = timescales.utc_to_tdb(epochs[4:])
+        self.assertLess(np.abs(timescales.tdb_to_utc(tdb) - epochs[4:]).max() * 86400, 1e-4)
+
+        delta = np.array([spice.deltet(t, 'ET') for t in et])
+        self.assertLess(np.abs(et - (timescales.et_to_utc(et) - 2451545) * 86400 - delta).max(), 1e-4)
+
+        self.assertEqual(np.shape(timescales.utc_to_et(2459000.5)), ())
+
+    def test_astropy(self):
+
+        epochs = np.linspace(2450000.5, 2460000.5, 100)
+        utc = Time(epochs, format='jd', scale='utc')
+        tdb = Time(epochs, format='jd', scale='tdb')
+
+        self.assertTrue(np.array_equal(timescales.utc_jd(utc), epochs))
+        self.assertTrue(np.array_equal(timescales.tdb_jd(tdb), epochs))
+
+        # SPICE and astropy use different TDB - TT models, which differ by
+        # tens of microseconds.
+        self.assertLess(np.abs(timescales.tdb_jd(utc) - utc.tdb.jd).max() * 86400, 1e-3)
+        self.assertLess(np.abs(timescales.utc_jd(tdb) - tdb.utc.jd).max() * 86400, 1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+'''
+Vectorized conversions between UTC and TDB Julian dates and ephemeris time.
+
+These follow the model of SPICE's deltet, with the constants and the leap
+second table parsed once from latest_leapseconds.tls, so the results agree
+with spice.str2et('JD... UTC') to the precision of a float64 Julian date.
+Ephemeris time (ET) is TDB seconds past J2000; TDB is the same time scale
+as a Julian date. All functions take scalars or arrays of any shape.
+
+Before the first leap second in 1972 SPICE uses one second less than the
+first entry in the table (i.e. TAI - UTC = 9 s), and so do these
+functions. This differs from astropy's treatment of pre-1972 UTC.
+'''
+
+import datetime
+import os
+import re
+
+import numpy as np
+import pkg_resources
+
+SPICE_PATH = pkg_resources.resource_filename('spacerocks', 'data/spice')
+LEAPSECONDS = os.path.join(SPICE_PATH, 'latest_leapseconds.tls')
+
+J2000 = 2451545.0
+SECONDS_PER_DAY = 86400.0
+
+_MONTHS = {month: k + 1 for k, month in enumerate(['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
+                                                   'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'])}
+_J2000_DATETIME = datetime.datetime(2000, 1, 1, 12)
+
+
+class LeapSeconds:
+
+    '''
+    The DELTET variables of a leapseconds kernel.
+    '''
+
+    def __init__(self, path=LEAPSECONDS):
+        with open(path) as f:
+            text = f.read()
+
+        data = ' '.join(re.findall(r'\\begindata(.*?)(?:\\begintext|$)', text, flags=re.S))
+        variables = dict(re.findall(r'DELTET/(\w+)\s*=\s*(\([^)]*\)|\S+)', data))
+
+        def number(value):
+            return float(value.replace('D', 'E'))
+
+        self.delta_t_a = number(variables['DELTA_T_A'])
+        self.k = number(variables['K'])
+        self.eb = number(variables['EB'])
+        self.m0, self.m1 = [number(v) for v in variables['M'].strip('()').split()]
+
+        leaps = re.findall(r'([\d.]+)\s*,\s*@(\d+)-(\w+)-(\d+)', variables['DELTA_AT'])
+        self.delta_at = np.array([number(dta) for dta, _, _, _ in leaps])
+
+        # UTC seconds past J2000 at which each value of DELTA_AT starts.
+        self.dates = np.array([(datetime.datetime(int(year), _MONTHS[month.upper()], int(day)) - _J2000_DATETIME).total_seconds()
+                               for _, year, month, day in leaps])
+
+        # Table of DELTA_AT indexed by position, with the pre-1972 value first.
+        self._dta = np.concatenate([[self.delta_at[0] - 1], self.delta_at])
+
+    def _periodic(self, et):
+        m = self.m0 + self.m1 * et
+        return self.k * np.sin(m + self.eb * np.sin(m))
+
+    def et_minus_utc(self, utc):
+        '''
+        ET - UTC in seconds, for UTC seconds past J2000.
+        '''
+        dta = self._dta[np.searchsorted(self.dates, utc, side='right')]
+        return self.delta_t_a + dta + self._periodic(utc + dta + self.delta_t_a)
+
+    def et_minus_utc_at_et(self, et):
+        '''
+        ET - UTC in seconds, for ET seconds past J2000.
+        '''
+        periodic = self._periodic(et)
+        tai = et - self.delta_t_a - periodic
+        dta = self._dta[np.searchsorted(self.dates + self.delta_at, tai, side='right')]
+        return self.delta_t_a + dta + periodic
+
+
+_leapseconds = None
+
+
+def leapseconds():
+    '''
+    The leap second table of the kernel shipped with spacerocks, parsed on
+    first use.
+    '''
+    global _leapseconds
+    if _leapseconds is None:
+        _leapseconds = LeapSeconds()
+    return _leapseconds
+
+
+def utc_to_et(jd):
+    '''
+    Ephemeris time of UTC Julian dates.
+    '''
+    utc = (np.asarray(jd, dtype=np.float64) - J2000) * SECONDS_PER_DAY
+    return utc + leapseconds().et_minus_utc(utc)
+
+
+def et_to_utc(et):
+    '''
+    UTC Julian dates of ephemeris times.
+    '''
+    et = np.asarray(et, dtype=np.float64)
+    return J2000 + (et - leapseconds().et_minus_utc_at_et(et)) / SECONDS_PER_DAY
+
+
+def tdb_to_et(jd):
+    '''
+    Ephemeris time of TDB Julian dates.
+    '''
+    return (np.asarray(jd, dtype=np.float64) - J2000) * SECONDS_PER_DAY
+
+
+def et_to_tdb(et):
+    '''
+    TDB Julian dates of ephemeris times.
+    '''
+    return J2000 + np.asarray(et, dtype=np.float64) / SECONDS_PER_DAY
+
+
+def utc_to_tdb(jd):
+    '''
+    TDB Julian dates of UTC Julian dates.
+    '''
+    return et_to_tdb(utc_to_et(jd))
+
+
+def tdb_to_utc(jd):
+    '''
+    UTC Julian dates of TDB Julian dates.
+    '''
+    return et_to_utc(tdb_to_et(jd))
+
+
+def utc_jd(time):
+    '''
+    UTC Julian dates of an astropy Time. Times in UTC or TDB are converted
+    here; other scales are left to astropy.
+    '''
+    if time.scale == 'utc':
+        return time.jd
+    if time.scale == 'tdb':
+        return tdb_to_utc(time.jd)
+    return time.utc.jd
+
+
+def tdb_jd(time):
+    '''
+    TDB Julian dates of an astropy Time. Times in UTC or TDB are converted
+    here; other scales are left to astropy.
+    '''
+    if time.scale == 'tdb':
+        return time.jd
+    if time.scale == 'utc':
+        return utc_to_tdb(time.jd)
+    return time.tdb.jd
@@ -0,0 +1,46 @@
+'''
+NumPy ufuncs over the orbit kernels.
+
+Unlike the ctypes wrappers in cbindings and fast, these take inputs of any
+shape, strides and dtype, broadcast them against each other, and accept
+out= (a tuple with one array per output) and where=. Results come back as
+one array per quantity, in canonical units (au, au/day, radians), e.g.
+
+    x, y, z, vx, vy, vz = ufuncs.kepM_to_xyz(a, e, inc, arg, node, M)
+
+To fill a preallocated (6, ...) block, pass its rows:
+
+    ufuncs.kepM_to_xyz(a, e, inc, arg, node, M, out=tuple(block))
+
+Iteration is done by NumPy in a single thread, so the per-call overhead is
+small and these are the better choice for small batches and strided or
+broadcast inputs. For very large contiguous batches the threaded kernels in
+fast are faster. kepM_to_xyz and calc_E_from_M run in single precision
+when all of their inputs are float32; otherwise inputs are cast to float64.
+In single precision the angles are reduced in double precision first, as in
+cbindings, so the results are the same as with dtype=np.float32 there.
+'''
+
+from . import _ufuncs
+from .cbindings import _resolve_tol
+
+kepE_to_xyz = _ufuncs.kepE_to_xyz
+calc_kep_from_xyz = _ufuncs.calc_kep_from_xyz
+calc_M_from_E = _ufuncs.calc_M_from_E
+calc_E_from_f = _ufuncs.calc_E_from_f
+calc_f_from_E = _ufuncs.calc_f_from_E
+
+
+def kepM_to_xyz(a, e, inc, arg, node, M, tol='precise', **kwargs):
+    '''
+    Barycentric ecliptic state (x, y, z, vx, vy, vz) from elements with
+    mean anomalies. tol is a Kepler solver tier or a float, as in cbindings.
+    '''
+    return _ufuncs.kepM_to_xyz(a, e, inc, arg, node, M, _resolve_tol(tol), **kwargs)
+
+
+def calc_E_from_M(e, M, tol='precise', **kwargs):
+    '''
+    Eccentric anomaly from the mean anomaly.
+    '''
+    return _ufuncs.calc_E_from_M(e, M, _resolve_tol(tol), **kwargs)
@@ -1,6 +1,10 @@
 #include <math.h>
+#include <stddef.h>
 #include <stdlib.h>
 #include <stdio.h>
+#include <pthread.h>
+
+#include "speedy.h"
 
 const double EMIN           = 1e-8;
 const double IMIN           = 1e-8;
@@ -11,82 +15,168 @@ const double speed_of_light = 173.14463267424034;
     #define M_PI 3.14159265358979323846
 #endif
 
-struct StateVector{
-  double x;
-  double y;
-  double z;
-  double vx;
-  double vy;
-  double vz;
+// Chunked parallel execution.
+//
+// Every object in the batched kernels is independent, so the N dimension is
+// split into contiguous chunks, one per thread. Each output element is
+// computed by exactly the same code as in the serial loop, so the results do
+// not depend on the number of threads. Counts and indices are ptrdiff_t, so
+// that grids of N objects times T epochs can exceed 2^31 elements.
+
+// Chunks smaller than this are not worth the cost of starting a thread.
+const int MIN_CHUNK = 1024;
+#define MAX_THREADS 256
+
+typedef void (*range_kernel)(ptrdiff_t start, ptrdiff_t end, void* args);
+
+struct Chunk{
+  range_kernel kernel;
+  void* args;
+  ptrdiff_t start;
+  ptrdiff_t end;
 };
 
-struct KeplerOrbit{
-  double a;
-  double e;
-  double inc;
-  double arg;
-  double node;
-  double f;
-};
+static void* run_chunk(void* p) {
+  struct Chunk* chunk = p;
+  chunk->kernel(chunk->start, chunk->end, chunk->args);
+  return NULL;
+}
 
-struct Vector3{
-  double x;
-  double y;
-  double z;
-};
+void run_chunked(ptrdiff_t N, int nthreads, range_kernel kernel, void* args) {
 
-double calc_E_from_M(double e, double M){
-    // Compute Danby (1988) fourth-order root-finding method with given number of steps
-    // This has quartic convergence.
-    // The initial step is defined as E_0 = ell + sgn(sin(ell))*e*k following Danby (1988)
+  struct Chunk chunks[MAX_THREADS];
+  pthread_t threads[MAX_THREADS];
+  int started[MAX_THREADS];
 
-    double E;
+  if (nthreads > MAX_THREADS) nthreads = MAX_THREADS;
+  if (nthreads > N / MIN_CHUNK) nthreads = N / MIN_CHUNK;
 
-    if (e < 1) {
+  if (nthreads <= 1) {
+    kernel(0, N, args);
+    return;
+  }
 
-      double k = 0.85;
-      double f_E, fP_E, fPP_E, fPPP_E, delta_i1, delta_i2, delta_i3, esinE, ecosE;
+  ptrdiff_t size = N / nthreads;
+  ptrdiff_t remainder = N % nthreads;
+  ptrdiff_t start = 0;
 
-      // Define initial estimate
-      if((sin(M)) < 0) E = M - k * e;
-      else E = M + k * e;
+  for (int idx = 0; idx < nthreads; idx++) {
+    chunks[idx].kernel = kernel;
+    chunks[idx].args = args;
+    chunks[idx].start = start;
+    chunks[idx].end = start + size + (idx < remainder ? 1 : 0);
+    start = chunks[idx].end;
+  }
 
-      // Perform Newton-Raphson estimate
-      for(int j = 0; j < 10; j++) {
+  // The calling thread takes the first chunk. If a thread cannot be
+  // started, its chunk is run serially instead.
+  for (int idx = 1; idx < nthreads; idx++) {
+    started[idx] = pthread_create(&threads[idx], NULL, run_chunk, &chunks[idx]) == 0;
+    if (!started[idx]) run_chunk(&chunks[idx]);
+  }
 
-        // Compute f(E), f'(E), f''(E) and f'''(E), avoiding recomputation of sine and cosine.
-        esinE = e*sin(E);
-        ecosE = e*cos(E);
-        f_E = E - esinE - M;
-        fP_E = 1 - ecosE;
-        fPP_E = esinE;
-        fPPP_E = ecosE;
+  run_chunk(&chunks[0]);
+
+  for (int idx = 1; idx < nthreads; idx++) {
+    if (started[idx]) pthread_join(threads[idx], NULL);
+  }
 
-        delta_i1 = -f_E/fP_E;
-        delta_i2 = -f_E/(fP_E+1./2.*delta_i1*fPP_E);
-        delta_i3 = -f_E/(fP_E+1./2.*delta_i2*fPP_E+1./6.*fPPP_E*delta_i2*delta_i2);
+}
 
-        // Update E
-        E += delta_i3;
+// Iteration caps for the Kepler solvers. With the starters below the
+// elliptic solver needs at most two steps and the hyperbolic solver at most
+// three to reach 1e-12, so these only matter for unreachable tolerances.
+#define MAX_ITER_ELLIPTIC 10
+#define MAX_ITER_HYPERBOLIC 100
+
+double calc_E_from_M_elliptic(double e, double M, double tol) {
+    // Mikkola (1987) cubic starter, accurate to a few 1e-3 for all e < 1,
+    // followed by Danby (1988) fourth-order steps. The iteration stops once
+    // the Newton estimate of the error in E drops below tol, and that final
+    // Newton correction is applied. Apart from the early exit the update is
+    // branch-free.
+
+    // Solve on [-pi, pi] and restore the original revolution afterwards.
+    double Mr = remainder(M, 2 * M_PI);
+
+    double alpha = (1 - e) / (4 * e + 0.5);
+    double beta = 0.5 * Mr / (4 * e + 0.5);
+    double z = cbrt(beta + copysign(sqrt(beta * beta + alpha * alpha * alpha), beta));
+    double s = z - alpha / z;
+    s = s - 0.078 * s * s * s * s * s / (1 + e);
+    double E = Mr + e * s * (3 - 4 * s * s);
+
+    double f_E, fP_E, fPP_E, fPPP_E, delta_i1, delta_i2, delta_i3, esinE, ecosE;
+
+    for (int j = 0; j < MAX_ITER_ELLIPTIC; j++) {
+
+      // Compute f(E), f'(E), f''(E) and f'''(E), avoiding recomputation of sine and cosine.
+      esinE = e * sin(E);
+      ecosE = e * cos(E);
+      f_E = E - esinE - Mr;
+      fP_E = 1 - ecosE;
+      fPP_E = esinE;
+      fPPP_E = ecosE;
+
+      delta_i1 = -f_E / fP_E;
+      if (fabs(delta_i1) < tol) {
+        E += delta_i1;
+        break;
       }
-    }
 
-    else {
+      delta_i2 = -f_E / (fP_E + 1./2. * delta_i1 * fPP_E);
+      delta_i3 = -f_E / (fP_E + 1./2. * delta_i2 * fPP_E + 1./6. * fPPP_E * delta_i2 * delta_i2);
 
-      E = M/fabs(M)*log(2.*fabs(M)/e + 1.8);
+      E += delta_i3;
+    }
 
-  		double F = E - e*sinh(E) + M;
-  		for(int i=0; i < 100; i++){
-  			E = E - F/(1.0 - e*cosh(E));
-  			F = E - e*sinh(E) + M;
-  			if(fabs(F) < 1.e-16){
-  				break;
-        }
+    return E + (M - Mr);
+}
+
+double calc_E_from_M_hyperbolic(double e, double M, double tol) {
+    // Starter: the smaller of the root of the cubic expansion
+    // (e - 1) E + e E^3 / 6 = |M|, which is good near pericenter, and the
+    // asymptotic log(2 |M| / e + 1.8), which is good far from it. Both
+    // overestimate |E| where they are poor. This is followed by Halley steps
+    // with the same stopping rule as the elliptic solver.
+
+    double absM = fabs(M);
+    double p = 6 * (e - 1) / e;
+    double q = 6 * absM / e;
+    double disc = sqrt(q * q / 4 + p * p * p / 27);
+    double E_cubic = cbrt(q / 2 + disc) - cbrt(disc - q / 2);
+    double E_log = log(2 * absM / e + 1.8);
+    double E = copysign(fmin(E_cubic, E_log), M);
+
+    double f_E, fP_E, esinhE, delta_i1;
+
+    for (int j = 0; j < MAX_ITER_HYPERBOLIC; j++) {
+
+      esinhE = e * sinh(E);
+      f_E = esinhE - E - M;
+      fP_E = e * cosh(E) - 1;
+
+      delta_i1 = -f_E / fP_E;
+      if (fabs(delta_i1) < tol) {
+        E += delta_i1;
+        break;
       }
+
+      E += -f_E / (fP_E + 1./2. * delta_i1 * esinhE);
     }
+
     return E;
 }
 
+double calc_E_from_M(double e, double M, double tol) {
+
+    if (e < 1) {
+      return calc_E_from_M_elliptic(e, M, tol);
+    }
+    return calc_E_from_M_hyperbolic(e, M, tol);
+
+}
+
 struct Vector3 calc_vovec_from_kep(double mu, double a, double e, double r, double E){
 
   struct Vector3 vec;
@@ -109,7 +199,7 @@ struct Vector3 calc_vovec_from_kep(double mu, double a, double e, double r, doub
 }
 
 
-struct StateVector kepM_to_xyz(double a, double e, double inc, double arg, double node, double M) {
+struct StateVector kepM_to_xyz(double a, double e, double inc, double arg, double node, double M, double tol) {
 
   double E, f, r, c, ox, oy, vox, voy;
   double cosE, omece;
@@ -121,7 +211,7 @@ struct StateVector kepM_to_xyz(double a, double e, double inc, double arg, doubl
   if (e < 1) {
 
     // Compute E
-    E = calc_E_from_M(e, M);
+    E = calc_E_from_M(e, M, tol);
 
     cosE = cos(E);
     omece = 1 - e * cosE;
@@ -139,7 +229,7 @@ struct StateVector kepM_to_xyz(double a, double e, double inc, double arg, doubl
 
   } else {
 
-    E = calc_E_from_M(e, M);
+    E = calc_E_from_M(e, M, tol);
 
     //f = 2 * atan2(sqrt(e + 1) * tanh(E / 2), sqrt(e - 1));
     f = 2 * atan2(sqrt(e + 1) * sinh(E / 2), cosh(E / 2) * sqrt(e - 1));
@@ -401,25 +491,154 @@ struct KeplerOrbit calc_kep_from_xyz(double mu, double x, double y, double z, do
 
 }
 
-double* py_calc_kep_from_xyz(int N, double mu, double* xs, double* ys, double* zs, double* vxs, double* vys, double* vzs) {
-  //struct KeplerOrbit* output = malloc(N * sizeof(struct KeplerOrbit));
-  double* output = malloc(N * 6 * sizeof(double));
-  int dummy;
+void stumpff(double z, double* C, double* S) {
+  // Stumpff functions C(z) and S(z), with series expansions near z = 0
+  // where the closed forms lose precision.
+  if (z > 1e-3) {
+    double sz = sqrt(z);
+    *C = (1 - cos(sz)) / z;
+    *S = (sz - sin(sz)) / (z * sz);
+  }
+  else if (z < -1e-3) {
+    double sz = sqrt(-z);
+    *C = (cosh(sz) - 1) / (-z);
+    *S = (sinh(sz) - sz) / (-z * sz);
+  }
+  else {
+    *C = 1./2. - z * (1./24. - z * (1./720. - z / 40320.));
+    *S = 1./6. - z * (1./120. - z * (1./5040. - z / 362880.));
+  }
+}
+
+static double universal_anomaly(double smu, double r0, double sigma0, double alpha, double dt) {
+
+  // Solve the universal Kepler equation
+  //   sqrt(mu) dt = sigma0 chi^2 C + (1 - alpha r0) chi^3 S + r0 chi
+  // for chi with the Laguerre-Conway iteration. For bound orbits dt should
+  // already be reduced to less than a period.
+
+  double chi, z, C, S, F, dF, ddF, delta;
+
+  if (alpha > 1e-12) {
+    chi = smu * dt * alpha;
+  }
+  else if (alpha < -1e-12) {
+    double a = 1 / alpha;
+    double sdt = dt < 0 ? -1 : 1;
+    chi = sdt * sqrt(-a) * log((-2 * smu * smu * alpha * dt) / (sigma0 * smu + sdt * smu * sqrt(-a) * (1 - r0 * alpha)));
+    if (!isfinite(chi)) chi = smu * dt / r0;
+  }
+  else {
+    chi = smu * dt / r0;
+  }
+
+  const double n = 5;
+  for (int j = 0; j < 50; j++) {
+
+    z = alpha * chi * chi;
+    stumpff(z, &C, &S);
+
+    F = sigma0 * chi * chi * C + (1 - alpha * r0) * chi * chi * chi * S + r0 * chi - smu * dt;
+    dF = sigma0 * chi * (1 - z * S) + (1 - alpha * r0) * chi * chi * C + r0;
+    ddF = sigma0 * (1 - z * C) + (1 - alpha * r0) * chi * (1 - z * S);
+
+    delta = n * F / (dF + copysign(sqrt(fabs((n - 1) * (n - 1) * dF * dF - n * (n - 1) * F * ddF)), dF));
+    chi -= delta;
+
+    if (fabs(delta) < 1e-14 * fmax(1, fabs(chi))) break;
+  }
+
+  return chi;
+
+}
+
+struct StateVector propagate_kepler(double mu, struct StateVector s0, double dt) {
+
+  // Two-body propagation in universal variables (e.g. Danby 1988, Vallado 2013),
+  // valid for elliptic, parabolic and hyperbolic orbits. Kepler's equation in
+  // the universal anomaly chi is solved with the Laguerre-Conway iteration, and
+  // the state is advanced with the Lagrange f and g coefficients.
+
+  struct StateVector rock;
+
+  double r0 = sqrt(s0.x*s0.x + s0.y*s0.y + s0.z*s0.z);
+  double rdotv = s0.x*s0.vx + s0.y*s0.vy + s0.z*s0.vz;
+  double vsq = s0.vx*s0.vx + s0.vy*s0.vy + s0.vz*s0.vz;
+  double smu = sqrt(mu);
+  double sigma0 = rdotv / smu;
+
+  // alpha = 1 / a; positive for bound orbits.
+  double alpha = 2 / r0 - vsq / mu;
+  double chi, z, C, S, r;
+
+  if (alpha > 1e-12) {
+    // Only the time since the last full period matters for bound orbits.
+    double period = 2 * M_PI / (smu * alpha * sqrt(alpha));
+    dt = fmod(dt, period);
+  }
+
+  chi = universal_anomaly(smu, r0, sigma0, alpha, dt);
+
+  z = alpha * chi * chi;
+  stumpff(z, &C, &S);
+  double chi2 = chi * chi;
+
+  double f = 1 - chi2 * C / r0;
+  double g = dt - chi2 * chi * S / smu;
+
+  rock.x = f * s0.x + g * s0.vx;
+  rock.y = f * s0.y + g * s0.vy;
+  rock.z = f * s0.z + g * s0.vz;
+
+  r = sqrt(rock.x*rock.x + rock.y*rock.y + rock.z*rock.z);
+
+  double fdot = smu / (r * r0) * chi * (z * S - 1);
+  double gdot = 1 - chi2 * C / r;
+
+  rock.vx = fdot * s0.x + gdot * s0.vx;
+  rock.vy = fdot * s0.y + gdot * s0.vy;
+  rock.vz = fdot * s0.z + gdot * s0.vz;
+
+  return rock;
+
+}
+
+// The py_* entry points below are called from cbindings.py. They never
+// allocate: results are written into the caller-owned `output` buffer in
+// struct-of-arrays order, i.e. output[k * N + idx] holds quantity k of object idx.
+
+struct XYZArgs{
+  double mu;
+  double *xs, *ys, *zs, *vxs, *vys, *vzs;
+  double* output;
+  int N;
+};
+
+static void calc_kep_from_xyz_range(ptrdiff_t start, ptrdiff_t end, void* p) {
+
+  struct XYZArgs* args = p;
+  double* output = args->output;
+  int N = args->N;
   struct KeplerOrbit kep;
 
-  for (int idx = 0; idx < N; idx++) {
-    kep = calc_kep_from_xyz(mu, xs[idx], ys[idx], zs[idx], vxs[idx], vys[idx], vzs[idx]);
-    dummy = idx * 6;
+  for (int idx = start; idx < end; idx++) {
+    kep = calc_kep_from_xyz(args->mu, args->xs[idx], args->ys[idx], args->zs[idx], args->vxs[idx], args->vys[idx], args->vzs[idx]);
 
-    output[dummy] = kep.a;
-    output[dummy + 1] = kep.e;
-    output[dummy + 2] = kep.inc;
-    output[dummy + 3] = kep.arg;
-    output[dummy + 4] = kep.node;
-    output[dummy + 5] = kep.f;
+    output[idx]         = kep.a;
+    output[1 * N + idx] = kep.e;
+    output[2 * N + idx] = kep.inc;
+    output[3 * N + idx] = kep.arg;
+    output[4 * N + idx] = kep.node;
+    output[5 * N + idx] = kep.f;
 
   }
-  return output;
+}
+
+void py_calc_kep_from_xyz(int N, double mu, double* xs, double* ys, double* zs, double* vxs, double* vys, double* vzs, double* output, int nthreads) {
+
+  struct XYZArgs args = {mu, xs, ys, zs, vxs, vys, vzs, output, N};
+  run_chunked(N, nthreads, calc_kep_from_xyz_range, &args);
+
 }
 
 double calc_M_from_E(double e, double E) {
@@ -437,16 +656,12 @@ double calc_M_from_E(double e, double E) {
 
 }
 
-double* py_calc_M_from_E(int N, double* es, double* Es) {
-
-  double* output = malloc(N * sizeof(double));
+void py_calc_M_from_E(int N, double* es, double* Es, double* output) {
 
   for (int idx = 0; idx < N; idx++) {
     output[idx] = calc_M_from_E(es[idx], Es[idx]);
   }
 
-  return output;
-
 }
 
 // If inc > pi/2, varpi = node - arg
@@ -468,16 +683,12 @@ double calc_E_from_f(double e, double f) {
   return E;
 }
 
-double* py_calc_E_from_f(int N, double* es, double* fs) {
-
-  double* output = malloc(N * sizeof(double));
+void py_calc_E_from_f(int N, double* es, double* fs, double* output) {
 
   for (int idx = 0; idx < N; idx++) {
     output[idx] = calc_E_from_f(es[idx], fs[idx]);
   }
 
-  return output;
-
 }
 
 
@@ -498,108 +709,135 @@ double calc_f_from_E(double e, double E) {
 
 }
 
-double* py_calc_f_from_E(int N, double* es, double* Es) {
-
-  double* output = malloc(N * sizeof(double));
+void py_calc_f_from_E(int N, double* es, double* Es, double* output) {
 
   for (int idx = 0; idx < N; idx++) {
     output[idx] = calc_f_from_E(es[idx], Es[idx]);
   }
 
-  return output;
-
 }
 
 
-double* py_kepM_to_xyz(int N, double *as, double *es, double *incs, double *args, double *nodes, double *Ms)
-{
+// Broadcasting.
+//
+// Each per-object input of the element-to-state, Kepler solver, light-time
+// and observe kernels comes with a stride, which is 1 for an array of N
+// values and 0 for a single value shared by every object. Orbits can then be
+// traced or sampled at many anomalies, or seen by a single observer, without
+// allocating full-length copies of the constant inputs.
+
+struct KepArgs{
+  double *as, *es, *incs, *args, *nodes, *anomalies;
+  const int* strides;
+  double tol;
+  double* output;
+  int N;
+};
 
-  double* output = malloc(N * 6 * sizeof(double));
-  int dummy;
+static void kepM_to_xyz_range(ptrdiff_t start, ptrdiff_t end, void* p) {
 
+  struct KepArgs* args = p;
+  const int* s = args->strides;
+  double* output = args->output;
+  int N = args->N;
   struct StateVector rock;
 
-  for (int idx = 0; idx < N; idx++) {
-
-    rock = kepM_to_xyz(as[idx], es[idx], incs[idx], args[idx], nodes[idx], Ms[idx]);
+  for (int idx = start; idx < end; idx++) {
 
-    dummy = idx * 6;
+    rock = kepM_to_xyz(args->as[s[0] * idx], args->es[s[1] * idx], args->incs[s[2] * idx], args->args[s[3] * idx], args->nodes[s[4] * idx], args->anomalies[s[5] * idx], args->tol);
 
-    output[dummy] = rock.x;
-    output[dummy + 1] = rock.y;
-    output[dummy + 2] = rock.z;
-    output[dummy + 3] = rock.vx;
-    output[dummy + 4] = rock.vy;
-    output[dummy + 5] = rock.vz;
+    output[idx]         = rock.x;
+    output[1 * N + idx] = rock.y;
+    output[2 * N + idx] = rock.z;
+    output[3 * N + idx] = rock.vx;
+    output[4 * N + idx] = rock.vy;
+    output[5 * N + idx] = rock.vz;
 
   }
 
-  return output;
-
 }
 
-double* py_kepE_to_xyz(int N, double *as, double *es, double *incs, double *args, double *nodes, double *Es)
+void py_kepM_to_xyz(int N, double *as, double *es, double *incs, double *args, double *nodes, double *Ms, const int* strides, double tol, double* output, int nthreads)
 {
 
-  double* output = malloc(N * 6 * sizeof(double));
-  int dummy;
+  struct KepArgs kargs = {as, es, incs, args, nodes, Ms, strides, tol, output, N};
+  run_chunked(N, nthreads, kepM_to_xyz_range, &kargs);
 
-  struct StateVector rock;
+}
 
-  for (int idx = 0; idx < N; idx++) {
+static void kepE_to_xyz_range(ptrdiff_t start, ptrdiff_t end, void* p) {
 
-    rock = kepE_to_xyz(as[idx], es[idx], incs[idx], args[idx], nodes[idx], Es[idx]);
+  struct KepArgs* args = p;
+  const int* s = args->strides;
+  double* output = args->output;
+  int N = args->N;
+  struct StateVector rock;
 
-    dummy = idx * 6;
+  for (int idx = start; idx < end; idx++) {
 
-    output[dummy] = rock.x;
-    output[dummy + 1] = rock.y;
-    output[dummy + 2] = rock.z;
-    output[dummy + 3] = rock.vx;
-    output[dummy + 4] = rock.vy;
-    output[dummy + 5] = rock.vz;
+    rock = kepE_to_xyz(args->as[s[0] * idx], args->es[s[1] * idx], args->incs[s[2] * idx], args->args[s[3] * idx], args->nodes[s[4] * idx], args->anomalies[s[5] * idx]);
+
+    output[idx]         = rock.x;
+    output[1 * N + idx] = rock.y;
+    output[2 * N + idx] = rock.z;
+    output[3 * N + idx] = rock.vx;
+    output[4 * N + idx] = rock.vy;
+    output[5 * N + idx] = rock.vz;
 
   }
 
-  return output;
+}
+
+void py_kepE_to_xyz(int N, double *as, double *es, double *incs, double *args, double *nodes, double *Es, const int* strides, double* output, int nthreads)
+{
+
+  struct KepArgs kargs = {as, es, incs, args, nodes, Es, strides, 0, output, N};
+  run_chunked(N, nthreads, kepE_to_xyz_range, &kargs);
 
 }
 
+struct AnomalyArgs{
+  double *es, *anomalies;
+  const int* strides;
+  double tol;
+  double* output;
+};
 
-double* py_calc_E_from_M(int N, double* es, double* Ms) {
+static void calc_E_from_M_range(ptrdiff_t start, ptrdiff_t end, void* p) {
 
-  double* output = malloc(N * sizeof(double));
+  struct AnomalyArgs* args = p;
+  const int* s = args->strides;
 
-  for (int idx = 0; idx < N; idx++) {
-    output[idx] = calc_E_from_M(es[idx], Ms[idx]);
+  for (int idx = start; idx < end; idx++) {
+    args->output[idx] = calc_E_from_M(args->es[s[0] * idx], args->anomalies[s[1] * idx], args->tol);
   }
 
-  return output;
+}
+
+void py_calc_E_from_M(int N, double* es, double* Ms, const int* strides, double tol, double* output, int nthreads) {
+
+  struct AnomalyArgs args = {es, Ms, strides, tol, output};
+  run_chunked(N, nthreads, calc_E_from_M_range, &args);
 
 }
 
-double* py_calc_vovec_from_kep(int N, double mu, double* as, double* es, double* rs, double* Es){
+void py_calc_vovec_from_kep(int N, double mu, double* as, double* es, double* rs, double* Es, double* output){
 
-  double* output = malloc(N * 3 * sizeof(double));
   struct Vector3 vec;
-  int dummy;
 
   for (int idx = 0; idx < N; idx++) {
     vec = calc_vovec_from_kep(mu, as[idx], es[idx], rs[idx], Es[idx]);
 
-    dummy = idx * 3;
-    output[dummy] = vec.x;
-    output[dummy + 1] = vec.y;
-    output[dummy + 2] = vec.z;
+    output[idx]         = vec.x;
+    output[1 * N + idx] = vec.y;
+    output[2 * N + idx] = vec.z;
 
   }
 
-  return output;
-
 }
 
 struct StateVector correct_for_ltt(double a, double e, double inc, double arg, double node, double M0, 
-                                  double ox, double oy, double oz, double ovx, double ovy, double ovz) {
+                                  double ox, double oy, double oz, double ovx, double ovy, double ovz, double tol) {
 
  struct StateVector rock;
  struct StateVector out;
@@ -609,7 +847,7 @@ struct StateVector correct_for_ltt(double a, double e, double inc, double arg, d
  double delta, ltt, dltt;
  double M;
 
- rock = kepM_to_xyz(a, e, inc, arg, node, M0);
+ rock = kepM_to_xyz(a, e, inc, arg, node, M0, tol);
  double n = sqrt(mu_bary / fabs(a*a*a));
 
  for (int idx = 0; idx < 5; idx++) {
@@ -638,7 +876,7 @@ struct StateVector correct_for_ltt(double a, double e, double inc, double arg, d
    }
    else {
      M = M0 - (ltt * n);
-     rock = kepM_to_xyz(a, e, inc, arg, node, M);
+     rock = kepM_to_xyz(a, e, inc, arg, node, M, tol);
 
      ltt0 = ltt;
    }
@@ -727,41 +965,798 @@ struct StateVector correct_for_ltt(double a, double e, double inc, double arg, d
 
 // }
 
-double* py_correct_for_ltt(int N, double* as, double* es, double* incs, double* args, double* nodes, double* Ms, 
-                           double* obsx, double* obsy, double* obsz, double* obsvx, double* obsvy, double* obsvz) {
+struct LTTArgs{
+  double *as, *es, *incs, *args, *nodes, *Ms;
+  double *obsx, *obsy, *obsz, *obsvx, *obsvy, *obsvz;
+  const int* strides;
+  double tol;
+  double* output;
+  int N;
+};
+
+static void correct_for_ltt_range(ptrdiff_t start, ptrdiff_t end, void* p) {
 
-  double* output = malloc(N * sizeof(struct StateVector));
+  struct LTTArgs* args = p;
+  const int* s = args->strides;
+  double* output = args->output;
+  int N = args->N;
   struct StateVector rock;
-  int dummy;
 
-  for (int idx = 0; idx < N; idx++) {
+  for (int idx = start; idx < end; idx++) {
+
+    rock = correct_for_ltt(args->as[s[0] * idx], args->es[s[1] * idx], args->incs[s[2] * idx], args->args[s[3] * idx], args->nodes[s[4] * idx], args->Ms[s[5] * idx],
+                           args->obsx[s[6] * idx], args->obsy[s[7] * idx], args->obsz[s[8] * idx], args->obsvx[s[9] * idx], args->obsvy[s[10] * idx], args->obsvz[s[11] * idx], args->tol);
+
+    output[idx]         = rock.x;
+    output[1 * N + idx] = rock.y;
+    output[2 * N + idx] = rock.z;
+    output[3 * N + idx] = rock.vx;
+    output[4 * N + idx] = rock.vy;
+    output[5 * N + idx] = rock.vz;
+
+  }
+
+}
+
+void py_correct_for_ltt(int N, double* as, double* es, double* incs, double* args, double* nodes, double* Ms, 
+                        double* obsx, double* obsy, double* obsz, double* obsvx, double* obsvy, double* obsvz,
+                        const int* strides, double tol, double* output, int nthreads) {
+
+  struct LTTArgs largs = {as, es, incs, args, nodes, Ms, obsx, obsy, obsz, obsvx, obsvy, obsvz, strides, tol, output, N};
+  run_chunked(N, nthreads, correct_for_ltt_range, &largs);
+
+}
+
+struct PropagateArgs{
+  double mu;
+  double *xs, *ys, *zs, *vxs, *vys, *vzs, *epochs0;
+  double *epochs;
+  double* output;
+  ptrdiff_t N;
+  ptrdiff_t T;
+};
+
+static void propagate_kepler_range(ptrdiff_t start, ptrdiff_t end, void* p) {
+
+  struct PropagateArgs* args = p;
+  double* output = args->output;
+  ptrdiff_t NT = args->N * args->T;
+  struct StateVector s0, rock;
+
+  for (ptrdiff_t flat = start; flat < end; flat++) {
+
+    ptrdiff_t t = flat / args->N;
+    ptrdiff_t idx = flat % args->N;
+
+    s0.x  = args->xs[idx];
+    s0.y  = args->ys[idx];
+    s0.z  = args->zs[idx];
+    s0.vx = args->vxs[idx];
+    s0.vy = args->vys[idx];
+    s0.vz = args->vzs[idx];
+
+    rock = propagate_kepler(args->mu, s0, args->epochs[t] - args->epochs0[idx]);
+
+    output[flat]          = rock.x;
+    output[1 * NT + flat] = rock.y;
+    output[2 * NT + flat] = rock.z;
+    output[3 * NT + flat] = rock.vx;
+    output[4 * NT + flat] = rock.vy;
+    output[5 * NT + flat] = rock.vz;
+
+  }
+
+}
+
+void py_propagate_kepler(ptrdiff_t N, ptrdiff_t T, double mu, double* xs, double* ys, double* zs, double* vxs, double* vys, double* vzs,
+                         double* epochs0, double* epochs, double* output, int nthreads) {
+
+  // N initial states at epochs0, each propagated to all T epochs. The output
+  // holds the (T, N) grid of states for each of the six quantities.
+  struct PropagateArgs args = {mu, xs, ys, zs, vxs, vys, vzs, epochs0, epochs, output, N, T};
+  run_chunked(N * T, nthreads, propagate_kepler_range, &args);
+
+}
+
+struct LTTGridArgs{
+  double *as, *es, *incs, *args, *nodes, *Ms, *epochs0;
+  double *epochs;
+  double *obsx, *obsy, *obsz, *obsvx, *obsvy, *obsvz;
+  double tol;
+  double* output;
+  ptrdiff_t N;
+  ptrdiff_t T;
+};
+
+static void correct_for_ltt_grid_range(ptrdiff_t start, ptrdiff_t end, void* p) {
+
+  struct LTTGridArgs* args = p;
+  double* output = args->output;
+  ptrdiff_t NT = args->N * args->T;
+  struct StateVector rock;
+  double a, n, M;
+
+  for (ptrdiff_t flat = start; flat < end; flat++) {
+
+    ptrdiff_t t = flat / args->N;
+    ptrdiff_t idx = flat % args->N;
+
+    a = args->as[idx];
+    n = sqrt(mu_bary / fabs(a*a*a));
+    M = args->Ms[idx] + n * (args->epochs[t] - args->epochs0[idx]);
+
+    rock = correct_for_ltt(a, args->es[idx], args->incs[idx], args->args[idx], args->nodes[idx], M,
+                           args->obsx[t], args->obsy[t], args->obsz[t], args->obsvx[t], args->obsvy[t], args->obsvz[t], args->tol);
+
+    output[flat]          = rock.x;
+    output[1 * NT + flat] = rock.y;
+    output[2 * NT + flat] = rock.z;
+    output[3 * NT + flat] = rock.vx;
+    output[4 * NT + flat] = rock.vy;
+    output[5 * NT + flat] = rock.vz;
+
+  }
+
+}
+
+void py_correct_for_ltt_grid(ptrdiff_t N, ptrdiff_t T, double* as, double* es, double* incs, double* args, double* nodes, double* Ms, double* epochs0,
+                             double* epochs, double* obsx, double* obsy, double* obsz, double* obsvx, double* obsvy, double* obsvz,
+                             double tol, double* output, int nthreads) {
+
+  // N barycentric element sets with mean anomalies at epochs0, observed from
+  // T observer states at epochs. The mean anomaly is advanced on the fly, so
+  // the elements are shared by every epoch instead of being copied T times.
+  struct LTTGridArgs gargs = {as, es, incs, args, nodes, Ms, epochs0, epochs, obsx, obsy, obsz, obsvx, obsvy, obsvz, tol, output, N, T};
+  run_chunked(N * T, nthreads, correct_for_ltt_grid_range, &gargs);
+
+}
+
+// Single-precision screening variants.
+//
+// These mirror calc_E_from_M, kepM_to_xyz and correct_for_ltt with every
+// input, intermediate and output in float, which halves the memory traffic
+// and doubles the SIMD width. They are meant for coverage screening of very
+// large synthetic populations, where arcsecond-level positions suffice. See
+// the error budget in cbindings.py before using them for anything else.
+
+// float carries ~7 significant digits, so the solvers cannot do better than
+// this. Tighter tolerances are clamped to it rather than iterating to the cap.
+const float TOL_FLOAT = 1e-6f;
+
+float calc_E_from_M_elliptic_f(float e, float M, float tol) {
+    // Same algorithm as calc_E_from_M_elliptic.
+
+    float Mr = remainderf(M, 2 * (float) M_PI);
+
+    float alpha = (1 - e) / (4 * e + 0.5f);
+    float beta = 0.5f * Mr / (4 * e + 0.5f);
+    float z = cbrtf(beta + copysignf(sqrtf(beta * beta + alpha * alpha * alpha), beta));
+    float s = z - alpha / z;
+    s = s - 0.078f * s * s * s * s * s / (1 + e);
+    float E = Mr + e * s * (3 - 4 * s * s);
+
+    float f_E, fP_E, fPP_E, fPPP_E, delta_i1, delta_i2, delta_i3, esinE, ecosE;
+
+    for (int j = 0; j < MAX_ITER_ELLIPTIC; j++) {
+
+      esinE = e * sinf(E);
+      ecosE = e * cosf(E);
+      f_E = E - esinE - Mr;
+      fP_E = 1 - ecosE;
+      fPP_E = esinE;
+      fPPP_E = ecosE;
+
+      delta_i1 = -f_E / fP_E;
+      if (fabsf(delta_i1) < tol) {
+        E += delta_i1;
+        break;
+      }
+
+      delta_i2 = -f_E / (fP_E + 0.5f * delta_i1 * fPP_E);
+      delta_i3 = -f_E / (fP_E + 0.5f * delta_i2 * fPP_E + fPPP_E * delta_i2 * delta_i2 / 6);
+
+      E += delta_i3;
+    }
+
+    return E + (M - Mr);
+}
+
+float calc_E_from_M_hyperbolic_f(float e, float M, float tol) {
+    // Same algorithm as calc_E_from_M_hyperbolic.
+
+    float absM = fabsf(M);
+    float p = 6 * (e - 1) / e;
+    float q = 6 * absM / e;
+    float disc = sqrtf(q * q / 4 + p * p * p / 27);
+    float E_cubic = cbrtf(q / 2 + disc) - cbrtf(disc - q / 2);
+    float E_log = logf(2 * absM / e + 1.8f);
+    float E = copysignf(fminf(E_cubic, E_log), M);
+
+    float f_E, fP_E, esinhE, delta_i1;
+
+    for (int j = 0; j < MAX_ITER_HYPERBOLIC; j++) {
+
+      esinhE = e * sinhf(E);
+      f_E = esinhE - E - M;
+      fP_E = e * coshf(E) - 1;
+
+      delta_i1 = -f_E / fP_E;
+      if (fabsf(delta_i1) < tol) {
+        E += delta_i1;
+        break;
+      }
+
+      E += -f_E / (fP_E + 0.5f * delta_i1 * esinhE);
+    }
+
+    return E;
+}
+
+float calc_E_from_M_f(float e, float M, float tol) {
+
+    if (tol < TOL_FLOAT) tol = TOL_FLOAT;
+    if (e < 1) {
+      return calc_E_from_M_elliptic_f(e, M, tol);
+    }
+    return calc_E_from_M_hyperbolic_f(e, M, tol);
+
+}
+
+struct StateVectorf kepM_to_xyz_f(float a, float e, float inc, float arg, float node, float M, float tol) {
+
+  float E, f, r, c, ox, oy, vox, voy;
+  float si, sa, sn, ci, ca, cn;
+  float c1, c2, c3, c4, c5, c6;
+
+  struct StateVectorf rock;
+
+  E = calc_E_from_M_f(e, M, tol);
+
+  if (e < 1) {
+
+    float cosE = cosf(E);
+
+    f = 2 * atan2f(sqrtf((1 + e)/(1 - e)) * sinf(E / 2), cosf(E / 2));
+    r = a * (1 - e * cosE);
+
+    c = sqrtf((float) mu_bary * a) / r;
+
+    ox = r * cosf(f);
+    oy = r * sinf(f);
+    vox = - c * sinf(E);
+    voy = c * sqrtf(1 - e * e) * cosE;
+
+  } else {
+
+    f = 2 * atan2f(sqrtf(e + 1) * sinhf(E / 2), coshf(E / 2) * sqrtf(e - 1));
+    r = a * (1 - e*e) / (1 + e * cosf(f));
+
+    c = sqrtf(- (float) mu_bary * a) / r;
+
+    ox = r * cosf(f);
+    oy = r * sinf(f);
+    vox = - c * sinhf(E);
+    voy = c * sqrtf(e*e - 1) * coshf(E);
+
+  }
+
+  sa = sinf(arg);
+  si = sinf(inc);
+  sn = sinf(node);
+  ca = cosf(arg);
+  ci = cosf(inc);
+  cn = cosf(node);
+
+  c1 = ca * cn - sa * sn * ci;
+  c2 = sa * cn + ca * sn * ci;
+  c3 = ca * sn + sa * cn * ci;
+  c4 = ca * cn * ci - sa * sn;
+  c5 = sa * si;
+  c6 = ca * si;
+
+  rock.x = ox * c1 - oy * c2;
+  rock.y = ox * c3 + oy * c4;
+  rock.z = ox * c5 + oy * c6;
+  rock.vx = vox * c1 - voy * c2;
+  rock.vy = vox * c3 + voy * c4;
+  rock.vz = vox * c5 + voy * c6;
+
+  return rock;
+
+}
+
+struct StateVectorf correct_for_ltt_f(float a, float e, float inc, float arg, float node, float M0, 
+                                      float ox, float oy, float oz, float ovx, float ovy, float ovz, float tol) {
+
+  // Same iteration as correct_for_ltt. The light travel time only needs to
+  // settle to ~0.1 s, well below what float positions can resolve.
+  struct StateVectorf rock, out;
+  float ltt0 = 0;
+  float dx, dy, dz, delta, ltt;
+
+  rock = kepM_to_xyz_f(a, e, inc, arg, node, M0, tol);
+  float n = sqrtf((float) mu_bary / fabsf(a*a*a));
+
+  for (int idx = 0; idx < 5; idx++) {
+
+    dx = rock.x - ox;
+    dy = rock.y - oy;
+    dz = rock.z - oz;
+
+    delta = sqrtf(dx*dx + dy*dy + dz*dz);
+    ltt = delta / (float) speed_of_light;
+
+    if (fabsf(ltt - ltt0) < 1e-6f) {
+      break;
+    }
+
+    rock = kepM_to_xyz_f(a, e, inc, arg, node, M0 - ltt * n, tol);
+    ltt0 = ltt;
+  }
+
+  out.x  = dx;
+  out.y  = dy;
+  out.z  = dz;
+  out.vx = rock.vx - ovx;
+  out.vy = rock.vy - ovy;
+  out.vz = rock.vz - ovz;
+
+  return out;
+
+}
+
+struct KepArgsf{
+  float *as, *es, *incs, *args, *nodes, *Ms;
+  const int* strides;
+  float tol;
+  float* output;
+  int N;
+};
+
+static void kepM_to_xyz_f_range(ptrdiff_t start, ptrdiff_t end, void* p) {
+
+  struct KepArgsf* args = p;
+  const int* s = args->strides;
+  float* output = args->output;
+  int N = args->N;
+  struct StateVectorf rock;
+
+  for (int idx = start; idx < end; idx++) {
+
+    rock = kepM_to_xyz_f(args->as[s[0] * idx], args->es[s[1] * idx], args->incs[s[2] * idx], args->args[s[3] * idx], args->nodes[s[4] * idx], args->Ms[s[5] * idx], args->tol);
+
+    output[idx]         = rock.x;
+    output[1 * N + idx] = rock.y;
+    output[2 * N + idx] = rock.z;
+    output[3 * N + idx] = rock.vx;
+    output[4 * N + idx] = rock.vy;
+    output[5 * N + idx] = rock.vz;
+
+  }
+
+}
+
+void py_kepM_to_xyz_f(int N, float *as, float *es, float *incs, float *args, float *nodes, float *Ms, const int* strides, double tol, float* output, int nthreads)
+{
+  struct KepArgsf kargs = {as, es, incs, args, nodes, Ms, strides, (float) tol, output, N};
+  run_chunked(N, nthreads, kepM_to_xyz_f_range, &kargs);
+}
+
+struct AnomalyArgsf{
+  float *es, *Ms;
+  const int* strides;
+  float tol;
+  float* output;
+};
+
+static void calc_E_from_M_f_range(ptrdiff_t start, ptrdiff_t end, void* p) {
+
+  struct AnomalyArgsf* args = p;
+  const int* s = args->strides;
+
+  for (int idx = start; idx < end; idx++) {
+    args->output[idx] = calc_E_from_M_f(args->es[s[0] * idx], args->Ms[s[1] * idx], args->tol);
+  }
+
+}
+
+void py_calc_E_from_M_f(int N, float* es, float* Ms, const int* strides, double tol, float* output, int nthreads) {
+
+  struct AnomalyArgsf aargs = {es, Ms, strides, (float) tol, output};
+  run_chunked(N, nthreads, calc_E_from_M_f_range, &aargs);
+
+}
+
+struct LTTArgsf{
+  float *as, *es, *incs, *args, *nodes, *Ms;
+  float *obsx, *obsy, *obsz, *obsvx, *obsvy, *obsvz;
+  const int* strides;
+  float tol;
+  float* output;
+  int N;
+};
+
+static void correct_for_ltt_f_range(ptrdiff_t start, ptrdiff_t end, void* p) {
+
+  struct LTTArgsf* args = p;
+  const int* s = args->strides;
+  float* output = args->output;
+  int N = args->N;
+  struct StateVectorf rock;
+
+  for (int idx = start; idx < end; idx++) {
+
+    rock = correct_for_ltt_f(args->as[s[0] * idx], args->es[s[1] * idx], args->incs[s[2] * idx], args->args[s[3] * idx], args->nodes[s[4] * idx], args->Ms[s[5] * idx],
+                             args->obsx[s[6] * idx], args->obsy[s[7] * idx], args->obsz[s[8] * idx], args->obsvx[s[9] * idx], args->obsvy[s[10] * idx], args->obsvz[s[11] * idx], args->tol);
 
-    double a    = as[idx];
-    double e    = es[idx];
-    double inc  = incs[idx];
-    double arg  = args[idx];
-    double node = nodes[idx];
-    double M0   = Ms[idx];
+    output[idx]         = rock.x;
+    output[1 * N + idx] = rock.y;
+    output[2 * N + idx] = rock.z;
+    output[3 * N + idx] = rock.vx;
+    output[4 * N + idx] = rock.vy;
+    output[5 * N + idx] = rock.vz;
 
-    double ox  = obsx[idx];
-    double oy  = obsy[idx];
-    double oz  = obsz[idx];
-    double ovx = obsvx[idx];
-    double ovy = obsvy[idx];
-    double ovz = obsvz[idx];
+  }
+
+}
+
+void py_correct_for_ltt_f(int N, float* as, float* es, float* incs, float* args, float* nodes, float* Ms, 
+                          float* obsx, float* obsy, float* obsz, float* obsvx, float* obsvy, float* obsvz,
+                          const int* strides, double tol, float* output, int nthreads) {
+
+  struct LTTArgsf largs = {as, es, incs, args, nodes, Ms, obsx, obsy, obsz, obsvx, obsvy, obsvz, strides, (float) tol, output, N};
+  run_chunked(N, nthreads, correct_for_ltt_f_range, &largs);
+
+}
+
+// Fused observation kernel.
+//
+// Everything SpaceRock.observe and Ephemerides compute for the usual
+// ephemeris columns, in one pass per object: the light-time corrected
+// position relative to the observer, the rotation to the equatorial frame,
+// the angles and their rates, the distances, the phase angle and the HG
+// magnitude. The results are written as one record of OBSERVATION_FIELDS
+// doubles per object, matching a numpy structured array.
+
+const double obliquity = 84381.448 / 3600 * M_PI / 180;
+
+#define OBSERVATION_FIELDS 7
+
+struct ObserveArgs{
+  double *as, *es, *incs, *args, *nodes, *Ms;
+  double *obsx, *obsy, *obsz, *obsvx, *obsvy, *obsvz;
+  double *sunx, *suny, *sunz;
+  double *Hs, *Gs;
+  const int* strides;
+  double tol;
+  double* output;
+};
+
+static void observe_range(ptrdiff_t start, ptrdiff_t end, void* p) {
+
+  struct ObserveArgs* args = p;
+  const int* s = args->strides;
+  struct StateVector rel;
+  double ce = cos(obliquity);
+  double se = sin(obliquity);
+  double x, y, z, vx, vy, vz, rho2, delta, hx, hy, hz, r, cos_beta, beta, tan_half, psi1, psi2, mag, G;
+
+  for (int idx = start; idx < end; idx++) {
+
+    rel = correct_for_ltt(args->as[s[0] * idx], args->es[s[1] * idx], args->incs[s[2] * idx], args->args[s[3] * idx], args->nodes[s[4] * idx], args->Ms[s[5] * idx],
+                          args->obsx[s[6] * idx], args->obsy[s[7] * idx], args->obsz[s[8] * idx], args->obsvx[s[9] * idx], args->obsvy[s[10] * idx], args->obsvz[s[11] * idx], args->tol);
+
+    // Heliocentric position of the rock at the time the light left it.
+    hx = rel.x + args->obsx[s[6] * idx] - args->sunx[s[12] * idx];
+    hy = rel.y + args->obsy[s[7] * idx] - args->suny[s[13] * idx];
+    hz = rel.z + args->obsz[s[8] * idx] - args->sunz[s[14] * idx];
+    r = sqrt(hx*hx + hy*hy + hz*hz);
+
+    // Ecliptic to equatorial.
+    x  = rel.x;
+    y  = rel.y * ce - rel.z * se;
+    z  = rel.y * se + rel.z * ce;
+    vx = rel.vx;
+    vy = rel.vy * ce - rel.vz * se;
+    vz = rel.vy * se + rel.vz * ce;
+
+    rho2 = x*x + y*y;
+    delta = sqrt(rho2 + z*z);
+
+    // Sun-rock-observer angle. The rock-observer direction is -rel.
+    cos_beta = (hx * rel.x + hy * rel.y + hz * rel.z) / (r * delta);
+    beta = acos(fmax(-1, fmin(1, cos_beta)));
+
+    tan_half = tan(beta / 2);
+    psi1 = exp(-3.332 * pow(tan_half, 0.631));
+    psi2 = exp(-1.862 * pow(tan_half, 1.218));
+    G = args->Gs[s[16] * idx];
+    mag = args->Hs[s[15] * idx] + 5 * log10(r * delta);
+    if (psi1 != 0 || psi2 != 0) {
+      mag -= 2.5 * log10((1 - G) * psi1 + G * psi2);
+    }
+
+    double ra = atan2(y, x);
+    if (ra < 0) ra += 2 * M_PI;
+
+    double* record = args->output + (long) idx * OBSERVATION_FIELDS;
+    record[0] = ra;
+    record[1] = asin(z / delta);
+    record[2] = -sqrt(rho2) / delta * (y * vx - x * vy) / rho2;
+    record[3] = (-z * (x * vx + y * vy) + rho2 * vz) / (sqrt(rho2) * delta * delta);
+    record[4] = delta;
+    record[5] = beta;
+    record[6] = mag;
+
+  }
+
+}
+
+void py_observe(int N, double* as, double* es, double* incs, double* args, double* nodes, double* Ms, 
+                double* obsx, double* obsy, double* obsz, double* obsvx, double* obsvy, double* obsvz,
+                double* sunx, double* suny, double* sunz, double* Hs, double* Gs,
+                const int* strides, double tol, double* output, int nthreads) {
+
+  struct ObserveArgs oargs = {as, es, incs, args, nodes, Ms, obsx, obsy, obsz, obsvx, obsvy, obsvz, sunx, suny, sunz, Hs, Gs, strides, tol, output};
+  run_chunked(N, nthreads, observe_range, &oargs);
+
+}
+
+// Partial derivatives.
+//
+// kep_jacobian gives d(x, y, z, vx, vy, vz) / d(a, e, inc, arg, node, M) for
+// the same element-to-state map as kepM_to_xyz, but with an arbitrary mu.
+// stm_kepler gives the two-body state transition matrix
+// d(state at t0 + dt) / d(state at t0), which is well defined for circular and
+// equatorial orbits too. Both write a row-major 6x6 matrix.
+
+void kep_jacobian(double mu, double a, double e, double inc, double arg, double node, double M, double tol, double* J) {
+
+  double E = calc_E_from_M(e, M, tol);
+  double ox, oy, vox, voy, dox_de, doy_de, dvox_de, dvoy_de, r;
+
+  if (e < 1) {
+
+    double sE = sin(E), cE = cos(E);
+    double s = sqrt(1 - e*e);
+    double D = 1 - e * cE;
+    double k = sqrt(mu / a);
+    double dE_de = sE / D;
+    double dD_de = -cE + e * sE * dE_de;
+
+    ox = a * (cE - e);
+    oy = a * s * sE;
+    vox = -k * sE / D;
+    voy = k * s * cE / D;
+    r = a * D;
+
+    dox_de = a * (-sE * dE_de - 1);
+    doy_de = a * (-e / s * sE + s * cE * dE_de);
+    dvox_de = -k * (cE * dE_de * D - sE * dD_de) / (D * D);
+    dvoy_de = k * (-e / s * cE / D + s * (-sE * dE_de * D - cE * dD_de) / (D * D));
+
+  } else {
+
+    double sE = sinh(E), cE = cosh(E);
+    double s = sqrt(e*e - 1);
+    double D = e * cE - 1;
+    double k = sqrt(-mu / a);
+    double dE_de = -sE / D;
+    double dD_de = cE + e * sE * dE_de;
+
+    ox = a * (cE - e);
+    oy = -a * s * sE;
+    vox = -k * sE / D;
+    voy = k * s * cE / D;
+    r = -a * D;
+
+    dox_de = a * (sE * dE_de - 1);
+    doy_de = -a * (e / s * sE + s * cE * dE_de);
+    dvox_de = -k * (cE * dE_de * D - sE * dD_de) / (D * D);
+    dvoy_de = k * (e / s * cE / D + s * (sE * dE_de * D - cE * dD_de) / (D * D));
+
+  }
+
+  double n = sqrt(mu / fabs(a*a*a));
+  double xi = mu / (r * r * r * n);
+
+  double sa = sin(arg), si = sin(inc), sn = sin(node);
+  double ca = cos(arg), ci = cos(inc), cn = cos(node);
+
+  // Columns of the rotation from the orbital plane.
+  double P[3] = {ca * cn - sa * sn * ci, ca * sn + sa * cn * ci, sa * si};
+  double Q[3] = {-(sa * cn + ca * sn * ci), ca * cn * ci - sa * sn, ca * si};
+  // Unit vector towards the ascending node.
+  double Nx = cn, Ny = sn;
+
+  double pos[3], vel[3];
+  for (int k = 0; k < 3; k++) {
+    pos[k] = ox * P[k] + oy * Q[k];
+    vel[k] = vox * P[k] + voy * Q[k];
+  }
+
+  double dpos_dinc[3] = {Ny * pos[2], -Nx * pos[2], Nx * pos[1] - Ny * pos[0]};
+  double dvel_dinc[3] = {Ny * vel[2], -Nx * vel[2], Nx * vel[1] - Ny * vel[0]};
+  double dpos_dnode[3] = {-pos[1], pos[0], 0};
+  double dvel_dnode[3] = {-vel[1], vel[0], 0};
+
+  for (int k = 0; k < 3; k++) {
 
-    rock = correct_for_ltt(a, e, inc, arg, node, M0, ox, oy, oz, ovx, ovy, ovz);
+    double* Jp = J + 6 * k;
+    double* Jv = J + 6 * (k + 3);
 
-    dummy = idx * 6;
-    output[dummy]     = rock.x;
-    output[dummy + 1] = rock.y;
-    output[dummy + 2] = rock.z;
-    output[dummy + 3] = rock.vx;
-    output[dummy + 4] = rock.vy;
-    output[dummy + 5] = rock.vz;
+    Jp[0] = pos[k] / a;
+    Jp[1] = dox_de * P[k] + doy_de * Q[k];
+    Jp[2] = dpos_dinc[k];
+    Jp[3] = -oy * P[k] + ox * Q[k];
+    Jp[4] = dpos_dnode[k];
+    Jp[5] = vel[k] / n;
 
+    Jv[0] = -vel[k] / (2 * a);
+    Jv[1] = dvox_de * P[k] + dvoy_de * Q[k];
+    Jv[2] = dvel_dinc[k];
+    Jv[3] = -voy * P[k] + vox * Q[k];
+    Jv[4] = dvel_dnode[k];
+    Jv[5] = -xi * pos[k];
+
+  }
+
+}
+
+void stm_kepler(double mu, struct StateVector s0, double dt, double* phi) {
+
+  // Battin (1999), section 9.7, in terms of the universal functions
+  // U_n = chi^n c_n(alpha chi^2). The periodic terms use dt reduced to less
+  // than a period, like propagate_kepler, while the secular term C is
+  // evaluated with the full time step.
+
+  double r0v[3] = {s0.x, s0.y, s0.z};
+  double v0v[3] = {s0.vx, s0.vy, s0.vz};
+
+  double r0 = sqrt(s0.x*s0.x + s0.y*s0.y + s0.z*s0.z);
+  double rdotv = s0.x*s0.vx + s0.y*s0.vy + s0.z*s0.vz;
+  double vsq = s0.vx*s0.vx + s0.vy*s0.vy + s0.vz*s0.vz;
+  double smu = sqrt(mu);
+  double sigma0 = rdotv / smu;
+  double alpha = 2 / r0 - vsq / mu;
+
+  double dt_red = dt;
+  double revolutions = 0;
+  if (alpha > 1e-12) {
+    double period = 2 * M_PI / (smu * alpha * sqrt(alpha));
+    dt_red = fmod(dt, period);
+    revolutions = (dt - dt_red) / period;
+  }
+
+  double chi = universal_anomaly(smu, r0, sigma0, alpha, dt_red);
+  double z = alpha * chi * chi;
+  double C, S;
+  stumpff(z, &C, &S);
+
+  double U1 = chi * (1 - z * S);
+  double U2 = chi * chi * C;
+  double U3 = chi * chi * chi * S;
+
+  double F = 1 - U2 / r0;
+  double G = dt_red - U3 / smu;
+
+  double rv[3], vv[3];
+  for (int k = 0; k < 3; k++) rv[k] = F * r0v[k] + G * v0v[k];
+  double r = sqrt(rv[0]*rv[0] + rv[1]*rv[1] + rv[2]*rv[2]);
+
+  double Fdot = -smu * U1 / (r * r0);
+  double Gdot = 1 - U2 / r;
+  for (int k = 0; k < 3; k++) vv[k] = Fdot * r0v[k] + Gdot * v0v[k];
+
+  // Secular term, with the universal anomaly over the full time step.
+  double chi_full = chi + revolutions * 2 * M_PI / sqrt(alpha > 1e-12 ? alpha : 1);
+  double zf = alpha * chi_full * chi_full;
+  double Cf, Sf, c4, c5;
+  stumpff(zf, &Cf, &Sf);
+  if (fabs(zf) > 1e-3) {
+    c4 = (0.5 - Cf) / zf;
+    c5 = (1./6. - Sf) / zf;
+  } else {
+    c4 = 1./24. - zf * (1./720. - zf * (1./40320. - zf / 3628800.));
+    c5 = 1./120. - zf * (1./5040. - zf * (1./362880. - zf / 39916800.));
+  }
+  double chi2 = chi_full * chi_full;
+  double U2f = chi2 * Cf;
+  double U4f = chi2 * chi2 * c4;
+  double U5f = chi2 * chi2 * chi_full * c5;
+  double Csec = (3 * U5f - chi_full * U4f - smu * dt * U2f) / smu;
+
+  double dr[3], dv[3];
+  for (int k = 0; k < 3; k++) {
+    dr[k] = rv[k] - r0v[k];
+    dv[k] = vv[k] - v0v[k];
+  }
+
+  // (r v^T - v r^T) r = r (r.v) - v r^2, for the last term of the
+  // velocity-position block.
+  double r2 = r * r;
+  double rdotv_t = rv[0]*vv[0] + rv[1]*vv[1] + rv[2]*vv[2];
+  double w[3];
+  for (int i = 0; i < 3; i++) w[i] = rv[i] * rdotv_t - vv[i] * r2;
+
+  for (int i = 0; i < 3; i++) {
+    for (int j = 0; j < 3; j++) {
+
+      double I = i == j ? 1 : 0;
+
+      double Rt = r / mu * dv[i] * dv[j] + (r0 * (1 - F) * rv[i] * r0v[j] + Csec * vv[i] * r0v[j]) / (r0 * r0 * r0) + F * I;
+      double R = r0 / mu * (1 - F) * (dr[i] * v0v[j] - dv[i] * r0v[j]) + Csec / mu * vv[i] * v0v[j] + G * I;
+      double Vt = -dv[i] * r0v[j] / (r0 * r0) - rv[i] * dv[j] / r2 - mu * Csec / (r2 * r * r0 * r0 * r0) * rv[i] * r0v[j]
+                  + Fdot * (I - rv[i] * rv[j] / r2 + w[i] * dv[j] / (mu * r));
+      double V = r0 / mu * dv[i] * dv[j] + (r0 * (1 - F) * rv[i] * r0v[j] - Csec * rv[i] * v0v[j]) / (r2 * r) + Gdot * I;
+
+      phi[6 * i + j] = Rt;
+      phi[6 * i + j + 3] = R;
+      phi[6 * (i + 3) + j] = Vt;
+      phi[6 * (i + 3) + j + 3] = V;
+
+    }
   }
 
-  return output;
+}
+
+struct JacobianArgs{
+  double mu;
+  double *as, *es, *incs, *args, *nodes, *Ms;
+  double tol;
+  double* output;
+};
+
+static void kep_jacobian_range(ptrdiff_t start, ptrdiff_t end, void* p) {
+
+  struct JacobianArgs* args = p;
 
-}
\ No newline at end of file
+  for (int idx = start; idx < end; idx++) {
+    kep_jacobian(args->mu, args->as[idx], args->es[idx], args->incs[idx], args->args[idx], args->nodes[idx], args->Ms[idx],
+                 args->tol, args->output + 36 * (long) idx);
+  }
+
+}
+
+void py_kep_jacobian(int N, double mu, double* as, double* es, double* incs, double* args, double* nodes, double* Ms,
+                     double tol, double* output, int nthreads) {
+
+  // One row-major 6x6 matrix per object, so output has shape (N, 6, 6).
+  struct JacobianArgs jargs = {mu, as, es, incs, args, nodes, Ms, tol, output};
+  run_chunked(N, nthreads, kep_jacobian_range, &jargs);
+
+}
+
+struct STMArgs{
+  double mu;
+  double *xs, *ys, *zs, *vxs, *vys, *vzs, *dts;
+  double* output;
+};
+
+static void stm_kepler_range(ptrdiff_t start, ptrdiff_t end, void* p) {
+
+  struct STMArgs* args = p;
+  struct StateVector s0;
+
+  for (int idx = start; idx < end; idx++) {
+
+    s0.x  = args->xs[idx];
+    s0.y  = args->ys[idx];
+    s0.z  = args->zs[idx];
+    s0.vx = args->vxs[idx];
+    s0.vy = args->vys[idx];
+    s0.vz = args->vzs[idx];
+
+    stm_kepler(args->mu, s0, args->dts[idx], args->output + 36 * (long) idx);
+  }
+
+}
+
+void py_stm_kepler(int N, double mu, double* xs, double* ys, double* zs, double* vxs, double* vys, double* vzs,
+                   double* dts, double* output, int nthreads) {
+
+  // One row-major 6x6 matrix per object, so output has shape (N, 6, 6).
+  struct STMArgs sargs = {mu, xs, ys, zs, vxs, vys, vzs, dts, output};
+  run_chunked(N, nthreads, stm_kepler_range, &sargs);
+
+}
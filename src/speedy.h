@@ -0,0 +1,50 @@
+#ifndef SPEEDY_H
+#define SPEEDY_H
+
+// Scalar kernels of speedy.c, shared with the NumPy ufunc module.
+
+struct StateVector{
+  double x;
+  double y;
+  double z;
+  double vx;
+  double vy;
+  double vz;
+};
+
+struct KeplerOrbit{
+  double a;
+  double e;
+  double inc;
+  double arg;
+  double node;
+  double f;
+};
+
+struct Vector3{
+  double x;
+  double y;
+  double z;
+};
+
+struct StateVectorf{
+  float x;
+  float y;
+  float z;
+  float vx;
+  float vy;
+  float vz;
+};
+
+double calc_E_from_M(double e, double M, double tol);
+double calc_M_from_E(double e, double E);
+double calc_E_from_f(double e, double f);
+double calc_f_from_E(double e, double E);
+struct StateVector kepM_to_xyz(double a, double e, double inc, double arg, double node, double M, double tol);
+struct StateVector kepE_to_xyz(double a, double e, double inc, double arg, double node, double E);
+struct KeplerOrbit calc_kep_from_xyz(double mu, double x, double y, double z, double vx, double vy, double vz);
+
+float calc_E_from_M_f(float e, float M, float tol);
+struct StateVectorf kepM_to_xyz_f(float a, float e, float inc, float arg, float node, float M, float tol);
+
+#endif
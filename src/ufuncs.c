@@ -0,0 +1,215 @@
+// NumPy ufuncs over the scalar kernels in speedy.c.
+//
+// The ctypes wrappers in cbindings.py need contiguous float64 arrays of equal
+// length. These ufuncs instead let NumPy do the iteration, so they take any
+// strides and dtypes, broadcast their inputs against each other, and write
+// into out= arrays. Each output quantity is a separate array, so the results
+// of e.g. kepM_to_xyz are the (x, y, z, vx, vy, vz) rows of a struct-of-arrays
+// state. float32 inputs dispatch to the single-precision kernels; everything
+// else is cast to float64.
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#define NPY_NO_DEPRECATED_API NPY_1_7_API_VERSION
+#include <numpy/arrayobject.h>
+#include <numpy/ufuncobject.h>
+
+#include "speedy.h"
+
+#include <math.h>
+
+#ifndef M_PI
+    #define M_PI 3.14159265358979323846
+#endif
+
+#define IN(type, k) (*(type*)(args[k] + i * steps[k]))
+#define OUT(type, k) (*(type*)(args[k] + i * steps[k]))
+
+// kepM_to_xyz(a, e, inc, arg, node, M, tol) -> (x, y, z, vx, vy, vz)
+
+static void kepM_to_xyz_d(char** args, npy_intp const* dimensions, npy_intp const* steps, void* data) {
+  for (npy_intp i = 0; i < dimensions[0]; i++) {
+    struct StateVector s = kepM_to_xyz(IN(double, 0), IN(double, 1), IN(double, 2), IN(double, 3),
+                                       IN(double, 4), IN(double, 5), IN(double, 6));
+    OUT(double, 7) = s.x;
+    OUT(double, 8) = s.y;
+    OUT(double, 9) = s.z;
+    OUT(double, 10) = s.vx;
+    OUT(double, 11) = s.vy;
+    OUT(double, 12) = s.vz;
+  }
+}
+
+// The float32 loops reduce the angles to [-pi, pi] in double precision
+// before rounding them back to float, like _reduce and _as_float_anomaly in
+// cbindings, so that they give the same results as the float32 path there.
+// Only elliptic mean anomalies are reduced.
+
+static float reduce_f(float x) {
+  double r = fmod((double)x + M_PI, 2 * M_PI);
+  if (r < 0) r += 2 * M_PI;
+  return (float)(r - M_PI);
+}
+
+static float reduce_anomaly_f(float e, float M) {
+  return e < 1 ? reduce_f(M) : M;
+}
+
+static void kepM_to_xyz_f_loop(char** args, npy_intp const* dimensions, npy_intp const* steps, void* data) {
+  for (npy_intp i = 0; i < dimensions[0]; i++) {
+    struct StateVectorf s = kepM_to_xyz_f(IN(float, 0), IN(float, 1), reduce_f(IN(float, 2)), reduce_f(IN(float, 3)),
+                                          reduce_f(IN(float, 4)), reduce_anomaly_f(IN(float, 1), IN(float, 5)), IN(float, 6));
+    OUT(float, 7) = s.x;
+    OUT(float, 8) = s.y;
+    OUT(float, 9) = s.z;
+    OUT(float, 10) = s.vx;
+    OUT(float, 11) = s.vy;
+    OUT(float, 12) = s.vz;
+  }
+}
+
+// kepE_to_xyz(a, e, inc, arg, node, E) -> (x, y, z, vx, vy, vz)
+
+static void kepE_to_xyz_d(char** args, npy_intp const* dimensions, npy_intp const* steps, void* data) {
+  for (npy_intp i = 0; i < dimensions[0]; i++) {
+    struct StateVector s = kepE_to_xyz(IN(double, 0), IN(double, 1), IN(double, 2), IN(double, 3),
+                                       IN(double, 4), IN(double, 5));
+    OUT(double, 6) = s.x;
+    OUT(double, 7) = s.y;
+    OUT(double, 8) = s.z;
+    OUT(double, 9) = s.vx;
+    OUT(double, 10) = s.vy;
+    OUT(double, 11) = s.vz;
+  }
+}
+
+// calc_kep_from_xyz(mu, x, y, z, vx, vy, vz) -> (a, e, inc, arg, node, f)
+
+static void calc_kep_from_xyz_d(char** args, npy_intp const* dimensions, npy_intp const* steps, void* data) {
+  for (npy_intp i = 0; i < dimensions[0]; i++) {
+    struct KeplerOrbit o = calc_kep_from_xyz(IN(double, 0), IN(double, 1), IN(double, 2), IN(double, 3),
+                                             IN(double, 4), IN(double, 5), IN(double, 6));
+    OUT(double, 7) = o.a;
+    OUT(double, 8) = o.e;
+    OUT(double, 9) = o.inc;
+    OUT(double, 10) = o.arg;
+    OUT(double, 11) = o.node;
+    OUT(double, 12) = o.f;
+  }
+}
+
+// calc_E_from_M(e, M, tol) -> E
+
+static void calc_E_from_M_d(char** args, npy_intp const* dimensions, npy_intp const* steps, void* data) {
+  for (npy_intp i = 0; i < dimensions[0]; i++) {
+    OUT(double, 3) = calc_E_from_M(IN(double, 0), IN(double, 1), IN(double, 2));
+  }
+}
+
+static void calc_E_from_M_f_loop(char** args, npy_intp const* dimensions, npy_intp const* steps, void* data) {
+  for (npy_intp i = 0; i < dimensions[0]; i++) {
+    OUT(float, 3) = calc_E_from_M_f(IN(float, 0), reduce_anomaly_f(IN(float, 0), IN(float, 1)), IN(float, 2));
+  }
+}
+
+// Two-argument anomaly conversions, (e, anomaly) -> anomaly.
+
+typedef double (*anomaly_function)(double, double);
+
+static void anomaly_d(char** args, npy_intp const* dimensions, npy_intp const* steps, void* data) {
+  anomaly_function func = (anomaly_function)data;
+  for (npy_intp i = 0; i < dimensions[0]; i++) {
+    OUT(double, 2) = func(IN(double, 0), IN(double, 1));
+  }
+}
+
+// Loop tables. Each ufunc lists its float64 loop last, so that NumPy only
+// picks the float32 loop when all of the inputs safely cast to float32.
+
+static PyUFuncGenericFunction kepM_to_xyz_loops[] = {kepM_to_xyz_f_loop, kepM_to_xyz_d};
+static void* kepM_to_xyz_data[] = {NULL, NULL};
+static char kepM_to_xyz_types[] = {
+  NPY_FLOAT, NPY_FLOAT, NPY_FLOAT, NPY_FLOAT, NPY_FLOAT, NPY_FLOAT, NPY_FLOAT,
+  NPY_FLOAT, NPY_FLOAT, NPY_FLOAT, NPY_FLOAT, NPY_FLOAT, NPY_FLOAT,
+  NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE,
+  NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE
+};
+
+static PyUFuncGenericFunction kepE_to_xyz_loops[] = {kepE_to_xyz_d};
+static void* kepE_to_xyz_data[] = {NULL};
+static char kepE_to_xyz_types[] = {
+  NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE,
+  NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE
+};
+
+static PyUFuncGenericFunction calc_kep_from_xyz_loops[] = {calc_kep_from_xyz_d};
+static void* calc_kep_from_xyz_data[] = {NULL};
+static char calc_kep_from_xyz_types[] = {
+  NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE,
+  NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE
+};
+
+static PyUFuncGenericFunction calc_E_from_M_loops[] = {calc_E_from_M_f_loop, calc_E_from_M_d};
+static void* calc_E_from_M_data[] = {NULL, NULL};
+static char calc_E_from_M_types[] = {
+  NPY_FLOAT, NPY_FLOAT, NPY_FLOAT, NPY_FLOAT,
+  NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE
+};
+
+static PyUFuncGenericFunction anomaly_loops[] = {anomaly_d};
+static void* calc_M_from_E_data[] = {(void*)calc_M_from_E};
+static void* calc_E_from_f_data[] = {(void*)calc_E_from_f};
+static void* calc_f_from_E_data[] = {(void*)calc_f_from_E};
+static char anomaly_types[] = {NPY_DOUBLE, NPY_DOUBLE, NPY_DOUBLE};
+
+static int add_ufunc(PyObject* module, const char* name, PyUFuncGenericFunction* loops, void** data,
+                     char* types, int ntypes, int nin, int nout, const char* doc) {
+  PyObject* ufunc = PyUFunc_FromFuncAndData(loops, data, types, ntypes, nin, nout,
+                                            PyUFunc_None, name, doc, 0);
+  if (ufunc == NULL) {
+    return -1;
+  }
+  if (PyModule_AddObject(module, name, ufunc) < 0) {
+    Py_DECREF(ufunc);
+    return -1;
+  }
+  return 0;
+}
+
+static struct PyModuleDef ufuncs_module = {
+  PyModuleDef_HEAD_INIT, "_ufuncs", "NumPy ufuncs over the spacerocks orbit kernels.", -1, NULL
+};
+
+PyMODINIT_FUNC PyInit__ufuncs(void) {
+
+  PyObject* module = PyModule_Create(&ufuncs_module);
+  if (module == NULL) {
+    return NULL;
+  }
+
+  import_array();
+  import_umath();
+
+  if (add_ufunc(module, "kepM_to_xyz", kepM_to_xyz_loops, kepM_to_xyz_data, kepM_to_xyz_types, 2, 7, 6,
+                "kepM_to_xyz(a, e, inc, arg, node, M, tol)\n\n"
+                "Barycentric ecliptic state (x, y, z, vx, vy, vz) from elements with mean anomalies.") < 0 ||
+      add_ufunc(module, "kepE_to_xyz", kepE_to_xyz_loops, kepE_to_xyz_data, kepE_to_xyz_types, 1, 6, 6,
+                "kepE_to_xyz(a, e, inc, arg, node, E)\n\n"
+                "Barycentric ecliptic state (x, y, z, vx, vy, vz) from elements with eccentric anomalies.") < 0 ||
+      add_ufunc(module, "calc_kep_from_xyz", calc_kep_from_xyz_loops, calc_kep_from_xyz_data, calc_kep_from_xyz_types, 1, 7, 6,
+                "calc_kep_from_xyz(mu, x, y, z, vx, vy, vz)\n\n"
+                "Elements (a, e, inc, arg, node, f) of states about a body with gravitational parameter mu.") < 0 ||
+      add_ufunc(module, "calc_E_from_M", calc_E_from_M_loops, calc_E_from_M_data, calc_E_from_M_types, 2, 3, 1,
+                "calc_E_from_M(e, M, tol)\n\nEccentric anomaly from the mean anomaly.") < 0 ||
+      add_ufunc(module, "calc_M_from_E", anomaly_loops, calc_M_from_E_data, anomaly_types, 1, 2, 1,
+                "calc_M_from_E(e, E)\n\nMean anomaly from the eccentric anomaly.") < 0 ||
+      add_ufunc(module, "calc_E_from_f", anomaly_loops, calc_E_from_f_data, anomaly_types, 1, 2, 1,
+                "calc_E_from_f(e, f)\n\nEccentric anomaly from the true anomaly.") < 0 ||
+      add_ufunc(module, "calc_f_from_E", anomaly_loops, calc_f_from_E_data, anomaly_types, 1, 2, 1,
+                "calc_f_from_E(e, E)\n\nTrue anomaly from the eccentric anomaly.") < 0) {
+    Py_DECREF(module);
+    return NULL;
+  }
+
+  return module;
+}